@@ -0,0 +1,33 @@
+"""
+Realistic Discord messages for the text normalization benchmarks.
+"""
+
+MESSAGES = [
+    "おはよう",
+    "おはようございます！",
+    "わらわら",
+    "wwwwww",
+    "草ｗｗｗ",
+    "それはさすがに笑笑笑",
+    "こんにちは、今日はいい天気ですね。",
+    "<@123456789012345678> 今から通話入れる？",
+    "<@123456789012345678> <@876543210987654321> 集合〜",
+    "<:pepe_sad:987654321098765432> つらい",
+    "<a:party_parrot:112233445566778899><a:party_parrot:112233445566778899> やったー",
+    "😀😀😀 最高すぎる 🎉🎉",
+    "今日のランチはラーメン🍜でした！めっちゃ美味しかった😋",
+    "GG",
+    "nice shot!",
+    "I'll be back in 5 minutes",
+    "ｱｲｳｴｵ",
+    "明日の予定\n・10時 集合\n・12時 ランチ\n・15時 解散",
+    "ちょっと待って　今行く",
+    "★☆★ お知らせ ★☆★ 次のイベントは土曜日です！",
+    "2+2=4 ^^",
+    "ｗｗｗｗｗ それはない",
+    "それな",
+    "え、マジで？？？",
+    "いや〜、昨日のアップデートで仕様が結構変わったみたいで、今までの立ち回りが通用しなくなったんだよね。"
+    "特にボス戦の後半がきつくて、回復アイテムを多めに持っていかないとすぐやられる。"
+    "みんなはどうやって攻略してる？おすすめの装備とかあったら教えてほしい！",
+]
@@ -0,0 +1,289 @@
+"""
+Stand-ins for Discord and VOICEVOX, so the VoiceVox cog can run offline under load (see load_test.py).
+"""
+
+import asyncio
+import io
+import logging
+import sys
+import threading
+import time
+import types
+import wave
+from typing import Optional
+
+from aiohttp import web
+from discord.opus import Encoder as OpusEncoder
+
+from utils import StartupTimer
+
+# VOICEVOX reads Japanese at about 8 morae per second
+SECONDS_PER_CHARACTER = 0.12
+
+
+def silent_wav(seconds: float, rate: int = 24000) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(b"\x00\x00" * int(seconds * rate))
+    return buffer.getvalue()
+
+
+class FakeMora:
+    def __init__(self, vowel_length: float = 0.1) -> None:
+        self.vowel_length = vowel_length
+
+
+class FakeAccentPhrase:
+    def __init__(self, pause: bool) -> None:
+        self.pause_mora = FakeMora() if pause else None
+
+
+class FakeAudioQuery:
+    """
+    The fields of voicevox_core.AudioQuery that the bot reads or writes.
+    """
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self.speed_scale = 1.0
+        self.pitch_scale = 0.0
+        self.intonation_scale = 1.0
+        self.volume_scale = 1.0
+        self.pre_phoneme_length = 0.1
+        self.post_phoneme_length = 0.1
+        self.accent_phrases = [FakeAccentPhrase(pause=index % 2 == 1) for index in range(max(1, len(text) // 8))]
+
+
+class FakeVoicevoxCore:
+    """
+    A VoicevoxCore that sleeps instead of running inference (releasing the GIL, like the real one)
+    and returns silence of a realistic length.
+
+    :param query_cost: Seconds per character of the audio_query stage (plus a fixed 10 ms).
+    :param synthesis_cost: Seconds per character of the synthesis stage (plus a fixed 20 ms).
+    :param load_cost: Seconds to load a model.
+    """
+
+    def __init__(
+        self,
+        open_jtalk_dict_dir=None,
+        query_cost: float = 0.001,
+        synthesis_cost: float = 0.004,
+        load_cost: float = 0.5,
+        **kwargs,
+    ) -> None:
+        self.query_cost = query_cost
+        self.synthesis_cost = synthesis_cost
+        self.load_cost = load_cost
+        self.loaded = set()
+        self._lock = threading.Lock()
+
+    def load_model(self, speaker_id: int) -> None:
+        with self._lock:
+            if speaker_id not in self.loaded:
+                time.sleep(self.load_cost)
+                self.loaded.add(speaker_id)
+
+    def is_model_loaded(self, speaker_id: int) -> bool:
+        return speaker_id in self.loaded
+
+    def audio_query(self, text: str, speaker_id: int, kana: bool = False) -> FakeAudioQuery:
+        time.sleep(0.01 + self.query_cost * len(text))
+        return FakeAudioQuery(text)
+
+    def synthesis(self, audio_query: FakeAudioQuery, speaker_id: int, enable_interrogative_upspeak: bool = True) -> bytes:
+        time.sleep(0.02 + self.synthesis_cost * len(audio_query.text))
+        return silent_wav(SECONDS_PER_CHARACTER * len(audio_query.text) / audio_query.speed_scale)
+
+    def tts(self, text: str, speaker_id: int) -> bytes:
+        return self.synthesis(self.audio_query(text, speaker_id), speaker_id)
+
+
+class FakeEngineServer:
+    """
+    A stub of the HTTP API of the VOICEVOX engine (``/version``, ``/audio_query`` and ``/synthesis``)
+    on localhost, with the costs of FakeVoicevoxCore, for the remote mode of the bot.
+
+    Setting ``down`` makes every endpoint answer 503, like an engine that is restarting.
+    """
+
+    def __init__(self, query_cost: float = 0.001, synthesis_cost: float = 0.004) -> None:
+        self.query_cost = query_cost
+        self.synthesis_cost = synthesis_cost
+        self.down = False
+        self.requests = 0
+        self.outstanding = 0
+        self.url = None
+        self._runner = None
+
+    async def start(self) -> str:
+        """
+        Starts the server on a free port and returns its URL.
+        """
+        app = web.Application(middlewares=[self._track])
+        app.router.add_get("/version", self._version)
+        app.router.add_post("/audio_query", self._audio_query)
+        app.router.add_post("/synthesis", self._synthesis)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self.url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    @web.middleware
+    async def _track(self, request: web.Request, handler):
+        if self.down:
+            return web.Response(status=503)
+        self.requests += 1
+        self.outstanding += 1
+        try:
+            return await handler(request)
+        finally:
+            self.outstanding -= 1
+
+    async def _version(self, request: web.Request) -> web.Response:
+        return web.json_response("fake")
+
+    async def _audio_query(self, request: web.Request) -> web.Response:
+        text = request.query["text"]
+        await asyncio.sleep(0.01 + self.query_cost * len(text))
+        return web.json_response({
+            "accent_phrases": [
+                {"pause_mora": {"vowel_length": 0.1} if index % 2 == 1 else None}
+                for index in range(max(1, len(text) // 8))
+            ],
+            "speedScale": 1.0,
+            "pitchScale": 0.0,
+            "intonationScale": 1.0,
+            "volumeScale": 1.0,
+            "prePhonemeLength": 0.1,
+            "postPhonemeLength": 0.1,
+            "kana": text,
+        })
+
+    async def _synthesis(self, request: web.Request) -> web.Response:
+        query = await request.json()
+        characters = len(query["kana"])
+        await asyncio.sleep(0.02 + self.synthesis_cost * characters)
+        return web.Response(
+            body=silent_wav(SECONDS_PER_CHARACTER * characters / query["speedScale"]), content_type="audio/wav"
+        )
+
+
+def install_fake_voicevox_core(**costs) -> None:
+    """
+    Registers a ``voicevox_core`` module backed by FakeVoicevoxCore. Must run before cogs.voicevox is imported.
+    """
+    module = types.ModuleType("voicevox_core")
+    module.__version__ = "fake"
+    module.AudioQuery = FakeAudioQuery
+    module.VoicevoxCore = lambda *args, **kwargs: FakeVoicevoxCore(*args, **{**costs, **kwargs})
+    sys.modules["voicevox_core"] = module
+
+
+class FakeVoiceClient:
+    """
+    A voice client that consumes audio sources frame by frame on a thread, like discord.py's
+    AudioPlayer, and records when the first frame of each utterance was read.
+
+    :param playback_speed: How much faster than real time the frames are consumed (0: as fast as possible).
+    """
+
+    def __init__(self, playback_speed: float = 1.0) -> None:
+        self.playback_speed = playback_speed
+        self.channel = None
+        self.on_first_frame = None
+        self.frames = 0
+        self._playing = False
+
+    def is_connected(self) -> bool:
+        return True
+
+    def is_playing(self) -> bool:
+        return self._playing
+
+    def stop(self) -> None:
+        self._playing = False
+
+    async def disconnect(self, force: bool = False) -> None:
+        self._playing = False
+
+    def play(self, source, after=None) -> None:
+        self._playing = True
+        on_first_frame = self.on_first_frame
+        threading.Thread(target=self._run, args=(source, after, on_first_frame), daemon=True).start()
+
+    def _run(self, source, after, on_first_frame) -> None:
+        delay = OpusEncoder.FRAME_LENGTH / 1000 / self.playback_speed if self.playback_speed else 0
+        frames = 0
+        started = time.perf_counter()
+        while self._playing:
+            frame = source.read()
+            if not frame:
+                break
+            if not frames and on_first_frame is not None:
+                on_first_frame()
+            frames += 1
+            self.frames += 1
+            if delay:
+                # paced like discord.py's player, against the clock of this utterance rather than frame by frame
+                time.sleep(max(0.0, started + frames * delay - time.perf_counter()))
+        self._playing = False
+        if after is not None:
+            after(None)
+
+
+class FakeAuthor:
+    def __init__(self, user_id: int) -> None:
+        self.id = user_id
+        self.bot = False
+
+    def __str__(self) -> str:
+        return f"user{self.id}"
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int) -> None:
+        self.id = guild_id
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int) -> None:
+        self.id = channel_id
+
+
+class FakeMessage:
+    def __init__(self, content: str, author: FakeAuthor, guild: FakeGuild, channel: FakeChannel) -> None:
+        self.content = content
+        self.author = author
+        self.guild = guild
+        self.channel = channel
+        self.stickers = []
+
+
+class FakeBot:
+    """
+    The attributes of DiscordBot that the VoiceVox cog uses.
+    """
+
+    def __init__(self, config: dict, logger: Optional[logging.Logger] = None) -> None:
+        self.config = config
+        self.logger = logger or logging.getLogger("load_test")
+        self.user = types.SimpleNamespace(id=0)
+        self.latency = 0.0
+        self.database = None
+        self.guilds = []
+        self.startup = StartupTimer(self.logger)
+
+    def is_ready(self) -> bool:
+        return True
@@ -0,0 +1,271 @@
+"""
+End-to-end load test of the VoiceVox cog, without Discord.
+
+Simulated guilds receive messages at a given rate (Poisson arrivals), which go through
+``on_message`` -> ``_add_to_queue`` -> synthesis -> playback on fake voice clients. The report gives
+the time to first frame (from the message to the first audio frame read by the voice client),
+the throughput, the queue depths over time and the CPU/RSS of the process, as JSON that can be
+compared between commits::
+
+    python -m benchmarks.load_test --guilds 20 --rate 10 --duration 60 --output before.json
+    python -m benchmarks.load_test --guilds 20 --rate 10 --duration 60 --compare before.json
+
+``--core fake`` (the default) replaces voicevox_core with benchmarks.fakes.FakeVoicevoxCore;
+``--core real`` uses the installed engine and its model files. ``--mode process`` needs
+``--core real``: the worker processes import the installed voicevox_core, not the fake, and their
+CPU time is not included. ``--mode remote`` sends the synthesis to ``--engines`` stub engines
+(benchmarks.fakes.FakeEngineServer) with ``--core fake``, or to the engines of config.json with
+``--core real``.
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import random
+import subprocess
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+from .corpus import MESSAGES
+from .fakes import (
+    FakeAuthor,
+    FakeBot,
+    FakeChannel,
+    FakeEngineServer,
+    FakeGuild,
+    FakeMessage,
+    FakeVoiceClient,
+    install_fake_voicevox_core,
+)
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 4)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def make_config(args: argparse.Namespace, engine_urls: Optional[List[str]] = None) -> dict:
+    with open(ROOT / "config.json") as file:
+        config = json.load(file)
+    config.setdefault("synthesis", {})["mode"] = args.mode
+    # every run starts cold and leaves nothing behind
+    config.setdefault("cache", {})["disk_dir"] = None
+    config.setdefault("clips", {})["disk_dir"] = None
+    if args.no_cache:
+        config["cache"]["memory_mb"] = 0
+    config.setdefault("english_tts", {})["backend"] = "silent"
+    if engine_urls:
+        config.setdefault("remote_engine", {}).update(urls=engine_urls, fallback=False)
+    return config
+
+
+async def run(args: argparse.Namespace) -> dict:
+    if args.core == "fake":
+        install_fake_voicevox_core(
+            query_cost=args.query_cost, synthesis_cost=args.synthesis_cost, load_cost=args.load_cost
+        )
+    voicevox = importlib.import_module("cogs.voicevox")
+
+    logger = logging.getLogger("load_test")
+    logger.setLevel(logging.WARNING)
+    rng = random.Random(args.seed)
+
+    engines = []
+    if args.mode == "remote" and args.core == "fake":
+        engines = [
+            FakeEngineServer(query_cost=args.query_cost, synthesis_cost=args.synthesis_cost)
+            for _ in range(args.engines)
+        ]
+        for engine in engines:
+            await engine.start()
+
+    bot = FakeBot(make_config(args, [engine.url for engine in engines]), logger)
+    started = time.perf_counter()
+    cog = voicevox.VoiceVox(bot)
+    await cog.cog_load()
+    await cog.engine_task  # the engine is built and its models preloaded in the background
+    startup = time.perf_counter() - started
+
+    ttff = []
+    guilds = []
+    for index in range(args.guilds):
+        guild = FakeGuild(1000 + index)
+        channel = FakeChannel(2000 + index)
+        voice_client = FakeVoiceClient(playback_speed=args.playback_speed)
+        session = cog._create_session(guild.id, voice_client, channel, None)
+
+        # the cog's own hook keeps timing the playback stages
+        def on_play(job, voice_client=voice_client, cog_on_play=session.audio_queue.on_play):
+            cog_on_play(job)
+            created_at = job.created_at
+            voice_client.on_first_frame = lambda: ttff.append(time.monotonic() - created_at)
+
+        session.audio_queue.on_play = on_play
+        authors = [FakeAuthor(10_000 * (index + 1) + author) for author in range(args.authors)]
+        guilds.append((guild, channel, authors))
+
+    depths = []
+    rss = []
+
+    async def sample() -> None:
+        from utils.models import resident_memory
+
+        while True:
+            queues = [session.audio_queue for session in cog.sessions]
+            depths.append({
+                "t": round(time.perf_counter() - load_started, 2),
+                "total": sum(len(queue) for queue in queues),
+                "max": max((len(queue) for queue in queues), default=0),
+            })
+            memory = resident_memory()
+            if memory is not None:
+                rss.append(memory)
+            await asyncio.sleep(args.sample_interval)
+
+    async def send() -> int:
+        sent = 0
+        deadline = time.perf_counter() + args.duration
+        while True:
+            await asyncio.sleep(rng.expovariate(args.rate))
+            if time.perf_counter() >= deadline:
+                return sent
+            guild, channel, authors = rng.choice(guilds)
+            await cog.on_message(FakeMessage(rng.choice(MESSAGES), rng.choice(authors), guild, channel))
+            sent += 1
+
+    def busy() -> bool:
+        return any(len(session.audio_queue) or session.audio_queue.playing for session in cog.sessions)
+
+    load_started = time.perf_counter()
+    cpu_started = time.process_time()
+    sampler = asyncio.ensure_future(sample())
+    sent = await send()
+    drain_deadline = time.perf_counter() + args.drain
+    while busy() and time.perf_counter() < drain_deadline:
+        await asyncio.sleep(0.1)
+    await asyncio.sleep(0.2)  # the last utterances are read out
+    elapsed = time.perf_counter() - load_started
+    cpu = time.process_time() - cpu_started
+    sampler.cancel()
+
+    queues = [session.audio_queue for session in cog.sessions]
+    results = {
+        "startup_seconds": round(startup, 3),
+        "startup_phases": bot.startup.summary(),
+        "messages_sent": sent,
+        "utterances_played": len(ttff),
+        "messages_coalesced": sum(queue.coalesced for queue in queues),
+        "messages_dropped": sum(queue.dropped for queue in queues),
+        "drained": not busy(),
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_per_second": round(len(ttff) / elapsed, 3),
+        "ttff_seconds": {
+            "mean": round(sum(ttff) / len(ttff), 4) if ttff else None,
+            "p50": percentile(ttff, 0.50),
+            "p95": percentile(ttff, 0.95),
+            "p99": percentile(ttff, 0.99),
+            "max": round(max(ttff), 4) if ttff else None,
+        },
+        "queue_depth": {
+            "mean_total": round(sum(sample["total"] for sample in depths) / len(depths), 2) if depths else 0,
+            "max_total": max((sample["total"] for sample in depths), default=0),
+            "max_per_guild": max((sample["max"] for sample in depths), default=0),
+            "series": depths,
+        },
+        "cpu_percent": round(100 * cpu / elapsed, 1),
+        "rss_mb": {
+            "mean": round(sum(rss) / len(rss) / 1024 / 1024, 1) if rss else None,
+            "max": round(max(rss) / 1024 / 1024, 1) if rss else None,
+        },
+        "stages": cog.metrics.summary(),
+        "audio_cache": cog.audio_cache.stats(),
+    }
+    await cog.cog_unload()
+    for engine in engines:
+        await engine.stop()
+    return results
+
+
+COMPARED = [
+    ("ttff p50 (s)", ("ttff_seconds", "p50")),
+    ("ttff p95 (s)", ("ttff_seconds", "p95")),
+    ("ttff p99 (s)", ("ttff_seconds", "p99")),
+    ("throughput (/s)", ("throughput_per_second",)),
+    ("max queue depth", ("queue_depth", "max_total")),
+    ("dropped", ("messages_dropped",)),
+    ("cpu (%)", ("cpu_percent",)),
+    ("max rss (MB)", ("rss_mb", "max")),
+]
+
+
+def compare(previous: dict, current: dict) -> str:
+    lines = [f"{'':<18}{previous.get('commit') or 'before':>12}{current.get('commit') or 'after':>12}{'change':>10}"]
+    for label, path in COMPARED:
+        before, after = previous["results"], current["results"]
+        for key in path:
+            before, after = before.get(key) if before else None, after.get(key) if after else None
+        change = f"{(after - before) / before:+.1%}" if before and after is not None else ""
+        before = f"{before:.4g}" if before is not None else "-"
+        after = f"{after:.4g}" if after is not None else "-"
+        lines.append(f"{label:<18}{before:>12}{after:>12}{change:>10}")
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--guilds", type=int, default=10, help="number of simulated guilds")
+    parser.add_argument("--rate", type=float, default=5.0, help="messages per second, over all guilds")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of message traffic")
+    parser.add_argument("--authors", type=int, default=3, help="authors per guild")
+    parser.add_argument("--drain", type=float, default=60.0, help="seconds allowed to empty the queues afterwards")
+    parser.add_argument("--core", choices=("fake", "real"), default="fake")
+    parser.add_argument("--mode", choices=("thread", "process", "remote"), default="thread")
+    parser.add_argument("--engines", type=int, default=2, help="remote mode with the fake core: stub engines")
+    parser.add_argument("--no-cache", action="store_true", help="disable the in-memory audio cache")
+    parser.add_argument("--playback-speed", type=float, default=1.0, help="0 plays the audio as fast as possible")
+    parser.add_argument("--query-cost", type=float, default=0.001, help="fake core: seconds per character")
+    parser.add_argument("--synthesis-cost", type=float, default=0.004, help="fake core: seconds per character")
+    parser.add_argument("--load-cost", type=float, default=0.5, help="fake core: seconds to load a model")
+    parser.add_argument("--sample-interval", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the report to this JSON file")
+    parser.add_argument("--compare", help="compare with a report written by a previous run")
+    args = parser.parse_args()
+    if args.mode == "process" and args.core == "fake":
+        parser.error("--mode process needs --core real: the worker processes import the installed voicevox_core")
+
+    report = {
+        "commit": git_commit(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "args": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "results": asyncio.run(run(args)),
+    }
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    summary = {key: value for key, value in report["results"].items() if key not in ("queue_depth", "stages")}
+    print(json.dumps(summary, indent=2))
+    if args.compare:
+        with open(args.compare) as file:
+            print(compare(json.load(file), report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""
+Tests of custom_setting.json (utils.settings) and of the rendering of custom stickers and emojis by the cog.
+
+Run with ``pytest benchmarks``.
+"""
+
+import argparse
+import asyncio
+import importlib
+import sys
+
+from utils.settings import parse_custom_settings
+
+from .fakes import FakeBot, install_fake_voicevox_core
+from .load_test import make_config
+
+
+def test_renders_an_entry_without_a_filename(monkeypatch) -> None:
+    settings = parse_custom_settings({
+        "custom_sticker": {"1": {"content": "スタンプです"}},
+        "custom_emoji": {"2": {"filename": None, "content": "えもじ"}},
+    })
+    # the fake replaces voicevox_core for this test only
+    monkeypatch.setitem(sys.modules, "voicevox_core", None)
+    install_fake_voicevox_core(load_cost=0.0)
+    voicevox = importlib.import_module("cogs.voicevox")
+
+    async def run():
+        cog = voicevox.VoiceVox(FakeBot(make_config(argparse.Namespace(mode="thread", no_cache=False))))
+        await cog.cog_load()
+        await cog.engine_task
+        try:
+            return [
+                await cog._render_custom_audio(1000, setting, 3)
+                for setting in (settings.custom_sticker[1], settings.custom_emoji[2])
+            ]
+        finally:
+            await cog.cog_unload()
+
+    sources = asyncio.run(run())
+    assert all(source.read() for source in sources)
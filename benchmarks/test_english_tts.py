@@ -0,0 +1,31 @@
+"""
+Tests of the English engines (utils.english_tts) that run offline.
+
+Run with ``pytest benchmarks``.
+"""
+
+import asyncio
+import json
+import sys
+
+from utils.english_tts import EspeakBackend
+
+# records its arguments and echoes its standard input, in place of espeak-ng
+FAKE_ESPEAK = """
+import json, sys
+with open(sys.argv[0] + ".args", "w") as file:
+    json.dump(sys.argv[1:], file)
+sys.stdout.buffer.write(sys.stdin.buffer.read())
+"""
+
+
+def test_espeak_reads_the_text_from_stdin(tmp_path) -> None:
+    command = tmp_path / "espeak-ng"
+    command.write_text(f"#!{sys.executable}\n{FAKE_ESPEAK}")
+    command.chmod(0o755)
+    text = "-wconfig.json hello"
+
+    data = asyncio.run(EspeakBackend(command=str(command)).synthesize(text))
+
+    assert data == text.encode("utf-8")
+    assert json.loads((tmp_path / "espeak-ng.args").read_text()) == ["-v", "en-us", "--stdout", "--stdin"]
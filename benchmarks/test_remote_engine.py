@@ -0,0 +1,90 @@
+"""
+Tests of the remote synthesis backend (utils.remote_engine) against stub VOICEVOX engines on localhost.
+
+Run with ``pytest benchmarks``.
+"""
+
+import asyncio
+
+import pytest
+
+from utils.remote_engine import RemoteEngine, RemoteEngineUnavailable
+
+from .fakes import FakeEngineServer
+
+
+async def start_engines(count: int, health_interval: float = 30.0):
+    servers = [FakeEngineServer() for _ in range(count)]
+    for server in servers:
+        await server.start()
+    engine = RemoteEngine([server.url for server in servers], timeout=5.0, health_interval=health_interval)
+    engine.start()
+    return servers, engine
+
+
+async def stop_engines(servers, engine) -> None:
+    await engine.close()
+    for server in servers:
+        await server.stop()
+
+
+def test_routes_to_the_least_busy_engine() -> None:
+    async def run():
+        servers, engine = await start_engines(2)
+        try:
+            results = await asyncio.gather(*(engine.synthesize(f"テスト{index}", 3) for index in range(8)))
+        finally:
+            await stop_engines(servers, engine)
+        return servers, results
+
+    servers, results = asyncio.run(run())
+    assert all(wav.startswith(b"RIFF") for wav, _ in results)
+    # every text needs an audio_query and a synthesis on one engine; the health checks add one request each
+    synthesis_requests = [server.requests - 1 for server in servers]
+    assert sum(synthesis_requests) == 16
+    assert max(synthesis_requests) - min(synthesis_requests) <= 4
+
+
+def test_fails_over_to_a_healthy_engine() -> None:
+    async def run():
+        servers, engine = await start_engines(2)
+        servers[0].down = True
+        try:
+            wav, stages = await engine.synthesize("こんにちは", 3)
+            healthy = [endpoint.healthy for endpoint in engine.endpoints]
+            await asyncio.sleep(0.1)
+            servers[1].down = True
+            with pytest.raises(RemoteEngineUnavailable):
+                await engine.synthesize("こんばんは", 3)
+        finally:
+            await stop_engines(servers, engine)
+        return wav, stages, healthy
+
+    wav, stages, healthy = asyncio.run(run())
+    assert wav.startswith(b"RIFF")
+    assert set(stages) == {"audio_query", "synthesis"}
+    assert healthy == [False, True]
+
+
+def test_health_check_brings_an_engine_back() -> None:
+    async def run():
+        servers, engine = await start_engines(2, health_interval=0.05)
+        try:
+            servers[0].down = True
+            await asyncio.sleep(0.2)
+            down = engine.endpoints[0].healthy
+            servers[0].down = False
+            await asyncio.sleep(0.2)
+            up = engine.endpoints[0].healthy
+            # once it is back, it takes its share of the requests again
+            before = servers[0].requests
+            await asyncio.gather(*(engine.synthesize(f"復帰{index}", 3) for index in range(4)))
+            served = servers[0].requests - before
+        finally:
+            await stop_engines(servers, engine)
+        return down, up, served
+
+    down, up, served = asyncio.run(run())
+    assert not down
+    assert up
+    assert served >= 4
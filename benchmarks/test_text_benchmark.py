@@ -0,0 +1,77 @@
+"""
+Micro-benchmarks of the per-message text normalization (utils.text).
+
+Run with ``pytest benchmarks`` (requires pytest-benchmark), and compare between commits with
+``--benchmark-autosave`` / ``--benchmark-compare``.
+"""
+
+import re
+import unicodedata
+
+import pytest
+
+from utils.text import clean_text, is_english, remove_mentions, split_sentences, to_reading
+
+from .corpus import MESSAGES
+
+pytest.importorskip("pytest_benchmark")
+
+
+def normalize_all() -> None:
+    for message in MESSAGES:
+        text = clean_text(remove_mentions(message))
+        if not is_english(text):
+            to_reading(text)
+
+
+def legacy_normalize_all() -> None:
+    # the pipeline that used to be inlined in VoiceVox.on_message, kept as a reference point
+    for message in MESSAGES:
+        text = re.sub(r"<@\d+>", "", message)
+        text = text.replace("　", " ")
+        text = text.replace("\n", " ")
+        text = re.sub(r"\s+", " ", text)
+        text = re.compile(r"<a?:.+?:\d+>").sub("", text)
+        text = "".join(c for c in text if unicodedata.category(c) not in ["So", "Sk", "Sm", "Cn"])
+        original = text
+        text = f"{text!r}"
+        text = re.sub("^.(.*).$", r"\1", text)
+        text = text.replace("w", "わら")
+        text = text.replace("ｗ", "わら")
+        text = text.replace("W", "わら")
+        text = re.sub(r"笑+$", lambda m: "わら" * len(m.group()), text)
+        (bool(re.match(r"^[^一-鿿぀-ゟ゠-ヿ]+$", original))
+         and not bool(re.fullmatch(r"[wWｗ]+", original))
+         and not bool(re.fullmatch(r"[｡-ﾟ]+", original)))
+
+
+@pytest.mark.benchmark(group="pipeline")
+def test_normalize_corpus(benchmark):
+    benchmark(normalize_all)
+
+
+@pytest.mark.benchmark(group="pipeline")
+def test_legacy_normalize_corpus(benchmark):
+    benchmark(legacy_normalize_all)
+
+
+@pytest.mark.benchmark(group="stages")
+def test_clean_text(benchmark):
+    benchmark(lambda: [clean_text(message) for message in MESSAGES])
+
+
+@pytest.mark.benchmark(group="stages")
+def test_to_reading(benchmark):
+    texts = [clean_text(message) for message in MESSAGES]
+    benchmark(lambda: [to_reading(text) for text in texts])
+
+
+@pytest.mark.benchmark(group="stages")
+def test_is_english(benchmark):
+    texts = [clean_text(message) for message in MESSAGES]
+    benchmark(lambda: [is_english(text) for text in texts])
+
+
+@pytest.mark.benchmark(group="stages")
+def test_split_sentences(benchmark):
+    benchmark(lambda: [split_sentences(message) for message in MESSAGES])
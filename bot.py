@@ -6,6 +6,7 @@ Version: 6.1.0
 Modified by z4kky - https://github.com/z4kkyy
 """
 
+import asyncio
 import ctypes
 import os
 import sys
@@ -13,16 +14,18 @@ import json
 import logging
 import platform
 import random
+import time
 # import requests
 from dotenv import load_dotenv
 from pathlib import Path
+from typing import List, Optional
 
-import aiosqlite
 import discord
 from discord.ext import commands, tasks
 from discord.ext.commands import Context
 
-from database import DatabaseManager
+from database import DatabaseManager, connect, init_database
+from utils import StartupTimer
 
 
 if not os.path.isfile(f"{os.path.realpath(os.path.dirname(__file__))}/config.json"):
@@ -74,31 +77,43 @@ class LoggingFormatter(logging.Formatter):
 logger = logging.getLogger("discord_bot")
 logger.setLevel(logging.INFO)
 
-# Console handler
-console_handler = logging.StreamHandler(sys.stdout)
-console_handler.setFormatter(LoggingFormatter())
-# File handler
-file_handler = logging.FileHandler(filename="discord.log", encoding="utf-8", mode="w")
-file_handler_formatter = logging.Formatter(
-    "[{asctime}] [{levelname:<8}] {name}: {message}", "%Y-%m-%d %H:%M:%S", style="{"
-)
-file_handler.setFormatter(file_handler_formatter)
 
-# Add the handlers
-logger.addHandler(console_handler)
-logger.addHandler(file_handler)
+def setup_logging(log_file: str = "discord.log") -> None:
+    """
+    Attach the console and file handlers. Only done in the bot process itself, so that
+    helper processes (e.g. synthesis workers) do not truncate the log file.
+
+    :param log_file: The log file, one per process when running as a cluster (see launcher.py).
+    """
+    # Console handler
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(LoggingFormatter())
+    # File handler
+    file_handler = logging.FileHandler(filename=log_file, encoding="utf-8", mode="w")
+    file_handler_formatter = logging.Formatter(
+        "[{asctime}] [{levelname:<8}] {name}: {message}", "%Y-%m-%d %H:%M:%S", style="{"
+    )
+    file_handler.setFormatter(file_handler_formatter)
+
+    # Add the handlers
+    logger.addHandler(console_handler)
+    logger.addHandler(file_handler)
 
 
 class DiscordBot(commands.Bot):
-    def __init__(self) -> None:
+    def __init__(self, cluster_id: Optional[int] = None, **options) -> None:
         super().__init__(
             command_prefix=commands.when_mentioned_or(config["prefix"]),
             intents=intents,
             help_command=None,
+            **options,
         )
         #  So that we can access these variables in cogs more easily
         self.logger = logger
         self.config = config
+        self.cluster_id = cluster_id  # the process of launcher.py running this bot, if any
+        self.startup = StartupTimer(logger)  # cogs mark their own phases ("engine ready", "first utterance")
+        self.startup.mark("bot created")
         self.database = None
         self.download_dir = os.getcwd() + "/download"  # exclusive to Hiro
         self.driver = None  # exclusive to Hiro
@@ -111,30 +126,43 @@ class DiscordBot(commands.Bot):
             print(f"Failed to load library: {e}")
 
     async def init_db(self) -> None:
-        async with aiosqlite.connect(
-            f"{os.path.realpath(os.path.dirname(__file__))}/database/database.db"
-        ) as db:
-            with open(
-                f"{os.path.realpath(os.path.dirname(__file__))}/database/schema.sql"
-            ) as file:
-                await db.executescript(file.read())
-            await db.commit()
+        """
+        Opens the database, migrates it to the current schema and sets up the database manager.
+        The cogs read their saved settings from it, so this runs before they are loaded.
+        """
+        connection = await connect(f"{os.path.realpath(os.path.dirname(__file__))}/database/database.db")
+        with open(
+            f"{os.path.realpath(os.path.dirname(__file__))}/database/schema.sql"
+        ) as file:
+            await init_database(connection, file.read())
+        self.database = DatabaseManager(connection=connection)
 
     async def load_cogs(self) -> None:
         """
         The code in this function is executed whenever the bot will start.
+        The extensions are loaded concurrently; slow setup (e.g. the VOICEVOX engine) runs in the background.
+        """
+        extensions = [
+            file[:-3] for file in os.listdir(f"{os.path.realpath(os.path.dirname(__file__))}/cogs")
+            if file.endswith(".py")
+        ]
+        await asyncio.gather(*(self.load_cog(extension) for extension in extensions))
+
+    async def load_cog(self, extension: str) -> None:
         """
-        for file in os.listdir(f"{os.path.realpath(os.path.dirname(__file__))}/cogs"):
-            if file.endswith(".py"):
-                extension = file[:-3]
-                try:
-                    await self.load_extension(f"cogs.{extension}")
-                    self.logger.info(f"Loaded extension '{extension}'")
-                except Exception as e:
-                    exception = f"{type(e).__name__}: {e}"
-                    self.logger.error(
-                        f"Failed to load extension {extension}\n{exception}"
-                    )
+        Loads one extension of the cogs folder.
+
+        :param extension: The name of the extension.
+        """
+        started = time.perf_counter()
+        try:
+            await self.load_extension(f"cogs.{extension}")
+            self.logger.info(f"Loaded extension '{extension}' in {time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            exception = f"{type(e).__name__}: {e}"
+            self.logger.error(
+                f"Failed to load extension {extension}\n{exception}"
+            )
 
     @tasks.loop(minutes=1.0)
     async def status_task(self) -> None:
@@ -163,13 +191,10 @@ class DiscordBot(commands.Bot):
         )
         self.logger.info("---------------------------------------------------------")
         await self.init_db()
+        self.startup.mark("database ready")
         await self.load_cogs()
+        self.startup.mark("cogs loaded")
         self.status_task.start()
-        self.database = DatabaseManager(
-            connection=await aiosqlite.connect(
-                f"{os.path.realpath(os.path.dirname(__file__))}/database/database.db"
-            )
-        )
 
         # check VOICEVOX API connection
         # try:
@@ -185,6 +210,12 @@ class DiscordBot(commands.Bot):
 
         self.logger.info("Successfully setup the bot")
 
+    async def on_ready(self) -> None:
+        """
+        The code in this event is executed every time the bot is connected and its cache is filled.
+        """
+        self.startup.mark("gateway ready")
+
     async def on_message(self, message: discord.Message) -> None:
         """
         The code in this event is executed every time someone sends a message, with or without the prefix
@@ -270,7 +301,35 @@ class DiscordBot(commands.Bot):
             raise error
 
 
-load_dotenv()
+class ShardedDiscordBot(DiscordBot, commands.AutoShardedBot):
+    """
+    The bot over several gateway shards in one process. launcher.py starts one per range of shards.
+    """
+
+
+def create_bot(
+    cluster_id: Optional[int] = None, shard_ids: Optional[List[int]] = None, shard_count: Optional[int] = None
+) -> DiscordBot:
+    """
+    Creates the bot, sharded if the "sharding" section of config.json enables it or if it is given shards.
+
+    :param cluster_id: The process of launcher.py running the bot, if any.
+    :param shard_ids: The shards run by this process. Defaults to all of them.
+    :param shard_count: The total number of shards. Defaults to the one recommended by Discord.
+    """
+    sharding = config.get("sharding", {})
+    if shard_ids is None and not sharding.get("enabled", False):
+        return DiscordBot()
+    return ShardedDiscordBot(
+        cluster_id=cluster_id,
+        shard_ids=shard_ids,
+        shard_count=shard_count or sharding.get("shard_count"),
+    )
+
+
+if __name__ == "__main__":  # synthesis worker processes and launcher.py re-import this module
+    setup_logging()
+    load_dotenv()
 
-bot = DiscordBot()
-bot.run(os.getenv("TOKEN"))
+    bot = create_bot()
+    bot.run(os.getenv("TOKEN"))
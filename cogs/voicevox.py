@@ -7,25 +7,58 @@ Modified by z4kky - https://github.com/z4kkyy
 """
 
 import asyncio
-import json
+import functools
+import importlib.metadata
 import os
+import io
 import re
 import subprocess
-import tempfile
-import unicodedata
-# import time
-from collections import defaultdict
-from datetime import datetime
+import sys
+import time
 from pathlib import Path
+from typing import Optional
 
+import aiosqlite
 import discord
-import requests
-from discord.ext import commands
-# from discord.ext import tasks
+from discord import app_commands
+from discord.ext import commands, tasks
 from discord.ext.commands import Context
 from dotenv import load_dotenv
-from gtts import gTTS
-from voicevox_core import VoicevoxCore
+
+from utils import (
+    ENGLISH_TTS_BACKENDS,
+    AdaptiveSpeechRate,
+    AudioCache,
+    AudioQueryCache,
+    ClipStore,
+    CustomSettingStore,
+    EnglishSpeech,
+    FairScheduler,
+    FirstFrameAudio,
+    GuildSession,
+    GuildSettingsStore,
+    Metrics,
+    MetricsServer,
+    ModelManager,
+    OpusClipAudio,
+    PCMBytesAudio,
+    PlaybackQueue,
+    QueryHistory,
+    RemoteEngine,
+    RemoteEngineUnavailable,
+    SessionRegistry,
+    SpeechJob,
+    SynthesisExecutor,
+    SynthesisWorkerPool,
+    VoiceParams,
+    WARMUP_TEXT,
+    clean_text,
+    is_english,
+    remove_mentions,
+    split_sentences,
+    staged_synthesis,
+    to_reading,
+)
 
 # from selenium.webdriver.common.by import By
 # from selenium.webdriver.common.keys import Keys
@@ -74,19 +107,23 @@ class SelectSpeakerView(discord.ui.View):
         self.waiter.set()
 
 
+DEFAULT_SPEAKER = (3, "ずんだもん（ノーマル）")
+
+
 class VoiceVox(commands.Cog, name="voicevox"):
     def __init__(self, bot) -> None:
         self.bot = bot
-        self.server_to_voice_client = defaultdict(lambda: None)
-        self.server_to_if_connected = defaultdict(lambda: None)
-        self.server_to_text_input_channel = defaultdict(lambda: None)
-        self.server_to_speaker_id = defaultdict(lambda: 3)
-        self.server_to_speaker = defaultdict(lambda: "ずんだもん（ノーマル）")
-        self.server_to_user_channel = defaultdict(lambda: None)
-        self.server_to_audio_queue = defaultdict(asyncio.Queue)
-        self.server_to_if_playing = defaultdict(lambda: False)
-
-        self.server_to_expected_disconnection = defaultdict(lambda: False)  # for unexpected disconnection
+        # voice state only exists for guilds the bot is connected in, see _create_session
+        self.sessions = SessionRegistry()
+        self.session_idle_timeout = self.bot.config.get("session_idle_timeout", 1800)
+        # the speaker (/change), voice (/voice) and channels (/join) of every guild, saved in the database
+        guild_settings_config = self.bot.config.get("guild_settings", {})
+        self.guild_settings = GuildSettingsStore(
+            self.bot.database,
+            flush_interval=guild_settings_config.get("flush_interval", 5.0),
+            logger=self.bot.logger,
+        )
+        self.rejoin = guild_settings_config.get("rejoin", False)
         self.POST_URL = os.getenv("NGROK_URL")
 
         lib_path = Path(__file__).parent.parent / "onnxruntime-linux-x64-1.13.1/lib"
@@ -95,129 +132,864 @@ class VoiceVox(commands.Cog, name="voicevox"):
         os.environ['ONNXRUNTIME_PROVIDERS_PATH'] = str(lib_path)
 
         self.JTALK_DICT_DIR = Path(__file__).parent.parent.absolute() / "open_jtalk_dic_utf_8-1.11"
-        self.voicevox_core = VoicevoxCore(open_jtalk_dict_dir=self.JTALK_DICT_DIR)
-        self.voicevox_core.load_model(3)
+        synthesis_config = self.bot.config.get("synthesis", {})
+        models_config = self.bot.config.get("models", {})
+        self.preload_speakers = models_config.get("preload", [3])
+        self.voicevox_core = None
+        self.model_manager = None
+        # the engine is built and warmed up in the background by cog_load, so the bot connects right away;
+        # messages that arrive meanwhile wait in their voice queue (see _wait_for_engine)
+        self.engine_state = "loading"  # then "ready" or "failed"
+        self.engine_ready = asyncio.Event()
+        self.engine_ready_at = None  # when the engine state left "loading", queued messages only age from then
+        self.engine_task = None
+        self.local_core = False
+        self.worker_pool = None
+        self.remote_engine = None
+        mode = synthesis_config.get("mode", "thread")
+        remote_config = self.bot.config.get("remote_engine", {})
+        if mode == "remote":
+            # synthesis runs on dedicated VOICEVOX engines, the local core is only a fallback
+            urls = remote_config.get("urls") or ([self.POST_URL] if self.POST_URL else [])
+            if not urls:
+                raise ValueError(
+                    "The remote synthesis mode needs the engine URLs in remote_engine.urls (config.json) "
+                    "or the NGROK_URL environment variable"
+                )
+            self.remote_engine = RemoteEngine(
+                urls=urls,
+                timeout=remote_config.get("timeout", 10.0),
+                health_interval=remote_config.get("health_interval", 30.0),
+                max_connections=remote_config.get("max_connections", 16),
+                query_cache_size=synthesis_config.get("query_cache_size", 1024),
+                logger=self.bot.logger,
+            )
+        if mode == "process":
+            # every worker process owns its VoicevoxCore, so the bot process does not need one
+            self.worker_pool = SynthesisWorkerPool(
+                jtalk_dict_dir=self.JTALK_DICT_DIR,
+                lib_path=lib_path,
+                processes=synthesis_config.get("processes"),
+                speakers=self.preload_speakers,
+                timeout=synthesis_config.get("timeout", 30.0),
+                query_cache_size=synthesis_config.get("query_cache_size", 1024),
+                logger=self.bot.logger,
+            )
+        elif self.remote_engine is None or remote_config.get("fallback", True):
+            self.local_core = True  # see _build_core
+        # the text analysis is cached apart from the waveform, so voice tweaks only redo the vocoder
+        self.query_cache = AudioQueryCache(synthesis_config.get("query_cache_size", 1024))
+
+        # VOICEVOX inference runs on worker threads so that the event loop never blocks on it
+        self.synthesis_executor = SynthesisExecutor(
+            max_workers=synthesis_config.get("workers", 2),
+            timeout=synthesis_config.get("timeout", 30.0),
+            max_pending=synthesis_config.get("max_pending"),
+        )
+
+        # synthesized audio is content-addressed, so repeated phrases skip inference entirely
+        cache_config = self.bot.config.get("cache", {})
+        disk_dir = cache_config.get("disk_dir", "cache")
+        self.engine_version = self._engine_version()
+        self.audio_cache = AudioCache(
+            memory_budget=int(cache_config.get("memory_mb", 64) * 1024 * 1024),
+            disk_dir=str(Path(__file__).resolve().parent.parent / disk_dir) if disk_dir else None,
+            disk_budget=int(cache_config.get("disk_mb", 512) * 1024 * 1024),
+        )
+
+        self.background_tasks = set()
+
+        # sticker/emoji files and hot phrases are Opus-encoded once, then played without ffmpeg or the encoder
+        clips_config = self.bot.config.get("clips", {})
+        self.clips = None
+        if clips_config.get("enabled", True):
+            clips_dir = clips_config.get("disk_dir", "cache/clips")
+            self.clips = ClipStore(
+                memory_budget=int(clips_config.get("memory_mb", 32) * 1024 * 1024),
+                disk_dir=str(Path(__file__).resolve().parent.parent / clips_dir) if clips_dir else None,
+                disk_budget=int(clips_config.get("disk_mb", 128) * 1024 * 1024),
+                hot_threshold=clips_config.get("hot_threshold", 3),
+                map_threshold=int(clips_config.get("map_threshold_kb", 256) * 1024),
+                max_mapped=clips_config.get("max_mapped", 64),
+                logger=self.bot.logger,
+            )
+
+        self.prefetch = synthesis_config.get("prefetch", 2)
+
+        # English messages are read out by a swappable engine, cached like the VOICEVOX audio
+        english_config = self.bot.config.get("english_tts", {})
+        english_backend = english_config.get("backend", "gtts")
+        self.english_speech = EnglishSpeech(
+            # the options of each backend live in a section named after it
+            ENGLISH_TTS_BACKENDS[english_backend](**english_config.get(english_backend, {})),
+            cache=self.audio_cache,
+            timeout=english_config.get("timeout", 10.0),
+            concurrency=english_config.get("concurrency", 4),
+        )
+
+        # cache misses of all guilds share the engine through a deficit round-robin scheduler
+        scheduler_config = self.bot.config.get("scheduler", {})
+        if self.worker_pool is not None:
+            concurrency = len(self.worker_pool.workers)
+        elif self.remote_engine is not None:
+            concurrency = len(self.remote_engine.endpoints) * remote_config.get("concurrency_per_engine", 2)
+        else:
+            concurrency = self.synthesis_executor.max_workers
+        self.scheduler = FairScheduler(
+            concurrency=scheduler_config.get("concurrency") or concurrency,
+            quantum=scheduler_config.get("quantum", 100),
+            max_in_flight=scheduler_config.get("max_in_flight_per_guild", 1),
+        )
+
+        # bursts are absorbed by bounding, expiring and coalescing the voice queues
+        queue_config = self.bot.config.get("queue", {})
+        self.queue_max_depth = queue_config.get("max_depth", 20)
+        self.queue_overflow = queue_config.get("overflow", "drop_oldest")
+        self.queue_max_age = queue_config.get("max_age", 60.0)
+        self.queue_coalesce = queue_config.get("coalesce", True)
+
+        # the speech speeds up with the backlog of the guild, so bursts drain without skipping messages
+        rate_config = self.bot.config.get("speech_rate", {})
+        self.speech_rate = None
+        if rate_config.get("adaptive", True):
+            self.speech_rate = AdaptiveSpeechRate(
+                min_speed=rate_config.get("min_speed", 1.0),
+                max_speed=rate_config.get("max_speed", 1.5),
+                depth_start=rate_config.get("depth_start", 2),
+                depth_full=rate_config.get("depth_full", 8),
+                age_start=rate_config.get("age_start", 5.0),
+                age_full=rate_config.get("age_full", 30.0),
+                step=rate_config.get("step", 0.1),
+            )
+        self.shorten_pauses = rate_config.get("shorten_pauses", True)
+
+        self.streaming = synthesis_config.get("streaming", True)
+        self.stream_threshold = synthesis_config.get("stream_threshold", 40)
+        self.stream_chunk_length = synthesis_config.get("stream_chunk_length", 30)
+
+        # custom_setting.json is parsed once and reloaded by watch_custom_settings when it changes
+        self.custom_settings = CustomSettingStore(
+            str(Path(__file__).resolve().parent.parent) + "/custom_setting.json", logger=self.bot.logger
+        )
+
+        # every stage of an utterance is timed, see /stats and the optional Prometheus endpoint
+        metrics_config = self.bot.config.get("metrics", {})
+        self.metrics = Metrics(export_guilds=metrics_config.get("export_guilds", False))
+        self.metrics.gauge("voicevox_sessions", "Connected voice sessions.", lambda: len(self.sessions))
+        self.metrics.gauge(
+            "voicevox_queued_messages", "Messages waiting in the voice queues.",
+            lambda: sum(len(session.audio_queue) for session in self.sessions),
+        )
+        self.metrics.gauge(
+            "voicevox_dropped_messages", "Messages dropped from the current voice queues.",
+            lambda: sum(session.audio_queue.dropped for session in self.sessions),
+        )
+        self.metrics.gauge("voicevox_scheduler_pending", "Synthesis requests waiting for the engine.", self.scheduler.pending)
+        self.metrics.gauge("voicevox_audio_cache_hit_rate", "Hit rate of the audio cache.",
+                           lambda: self.audio_cache.stats()["hit_rate"])
+        self.metrics.gauge("voicevox_ready", "Whether the gateway connection is ready.", lambda: int(self.bot.is_ready()))
+        self.metrics.gauge("voicevox_guilds", "Guilds seen by this process.", lambda: len(self.bot.guilds))
+        self.metrics.gauge("voicevox_gateway_latency_seconds", "Gateway heartbeat latency.", lambda: self.bot.latency)
+        self.metrics_server = None
+        if metrics_config.get("enabled", False):
+            # every process of a cluster (see launcher.py) listens on its own port
+            cluster_id = getattr(self.bot, "cluster_id", None) or 0
+            self.metrics_server = MetricsServer(
+                self.metrics,
+                host=metrics_config.get("host", "127.0.0.1"),
+                port=metrics_config.get("port", 9108) + cluster_id,
+                health=self._health,
+                logger=self.bot.logger,
+            )
 
-    def _post_audio_query(self, text: str, speaker: int) -> str:
+        # every utterance is recorded in the query_history table, in batches by a background task
+        history_config = self.bot.config.get("history", {})
+        self.query_history = QueryHistory(
+            self.bot.database,
+            batch_size=history_config.get("batch_size", 50),
+            flush_interval=history_config.get("flush_interval", 5.0),
+            logger=self.bot.logger,
+        )
+        self.history_retention_days = history_config.get("retention_days", 90)
+
+        # the most frequent phrases of each connected guild are synthesized ahead while it is idle
+        prewarm_config = self.bot.config.get("prewarm", {})
+        self.prewarm = prewarm_config.get("enabled", True) and self.bot.database is not None
+        self.prewarm_interval = prewarm_config.get("interval", 300.0)
+        self.prewarm_phrases = prewarm_config.get("phrases", 20)
+        self.prewarm_days = prewarm_config.get("days", 30)
+        self.prewarm_min_count = prewarm_config.get("min_count", 3)
+
+    async def cog_load(self) -> None:
+        self.watch_custom_settings.start()
+        self.evict_idle_sessions.start()
+        self.query_history.start()
+        if self.bot.database is not None and self.history_retention_days:
+            self._in_background(self._prune_history())
+        if self.prewarm:
+            self.prewarm_cache.change_interval(seconds=self.prewarm_interval)
+            self.prewarm_cache.start()
+        if self.metrics_server is not None:
+            await self.metrics_server.start()
+        if self.remote_engine is not None:
+            self.remote_engine.start()
+        # the saved speakers are preloaded along with the configured ones
+        saved = await self.guild_settings.load()
+        self.guild_settings.start()
+        self.engine_task = asyncio.create_task(self._start_engine(
+            [settings.speaker[0] for settings in saved.values() if settings.speaker is not None]
+        ))
+        if self.rejoin:
+            self._in_background(self._rejoin_voice_channels(saved))
+        self._encode_custom_clips()
+
+    async def cog_unload(self) -> None:
+        if self.engine_task is not None:
+            self.engine_task.cancel()
+        self.watch_custom_settings.cancel()
+        self.evict_idle_sessions.cancel()
+        self.prewarm_cache.cancel()
+        for session in self.sessions:
+            self.sessions.remove(session.guild_id)
+        self.synthesis_executor.shutdown()
+        if self.worker_pool is not None:
+            self.worker_pool.shutdown()
+        if self.remote_engine is not None:
+            await self.remote_engine.close()
+        if self.metrics_server is not None:
+            await self.metrics_server.close()
+        await self.query_history.close()
+        await self.guild_settings.close()
+
+    @staticmethod
+    def _engine_version() -> str:
+        """
+        Returns the version of voicevox_core for the cache keys, without importing it unless it already is.
         """
-        Posts a query to the VoiceVox API and returns the audio URL.
+        module = sys.modules.get("voicevox_core")
+        if module is not None:
+            return getattr(module, "__version__", "unknown")
+        try:
+            return importlib.metadata.version("voicevox_core")
+        except importlib.metadata.PackageNotFoundError:
+            return "unknown"
 
-        :param text: The text to post to the API.
-        :param speaker: The speaker ID to use.
+    def _build_core(self) -> None:
         """
-        post_url = self.POST_URL + "/audio_query"
-        post_data = {
-            "text": text,
-            "speaker": speaker,
+        Builds the local VoicevoxCore and its model manager. Blocking, runs on a worker thread.
+        """
+        # imported here: loading the ONNX runtime and the dictionary is the slowest part of the startup
+        from voicevox_core import VoicevoxCore
+
+        models_config = self.bot.config.get("models", {})
+        voicevox_core = VoicevoxCore(open_jtalk_dict_dir=self.JTALK_DICT_DIR)
+        # models are preloaded by _start_engine, and unloaded when over budget
+        memory_budget = models_config.get("memory_budget_mb")
+        self.model_manager = ModelManager(
+            voicevox_core,
+            memory_budget=int(memory_budget * 1024 * 1024) if memory_budget is not None else None,
+            max_models=models_config.get("max_models"),
+            warmup=models_config.get("warmup", True),
+            logger=self.bot.logger,
+        )
+        self.voicevox_core = voicevox_core
+
+    async def _start_engine(self, saved_speakers: list) -> None:
+        """
+        Builds the synthesis engine and preloads its models in the background, then marks it ready.
+
+        :param saved_speakers: The speakers saved by /change in the guilds, preloaded after the configured ones.
+        """
+        if self.remote_engine is not None:
+            # the local core, if any, is only a fallback of the remote engines: it is not waited for
+            self._set_engine_state("ready")
+        try:
+            if self.worker_pool is not None:
+                await self.worker_pool.start()
+                for speaker in dict.fromkeys(saved_speakers):
+                    if speaker not in self.preload_speakers:
+                        await self.worker_pool.tts(WARMUP_TEXT, speaker)
+                self.bot.startup.mark("models preloaded")
+            elif self.local_core:
+                await asyncio.to_thread(self._build_core)
+            if self.engine_state == "loading":
+                self._set_engine_state("ready")
+            if self.model_manager is not None:
+                # speakers set up in custom_setting.json are used without any /change, so they are preloaded too
+                speakers = list(dict.fromkeys(
+                    self.preload_speakers
+                    + [setting["speaker_id"] for setting in self.custom_settings.current.custom_speaker.values()]
+                    + saved_speakers
+                ))
+                await asyncio.to_thread(self.model_manager.preload, speakers)
+                self.bot.startup.mark("models preloaded")
+        except Exception as e:
+            self.bot.logger.error(f"Failed to start the VOICEVOX engine: {type(e).__name__}: {e}")
+            if self.engine_state == "loading":
+                self._set_engine_state("failed")
+
+    async def _rejoin_voice_channels(self, saved: dict) -> None:
+        """
+        Rejoins the voice channels the bot was connected to before the restart, where someone is still listening.
+
+        :param saved: The saved settings of every guild.
+        """
+        await self.bot.wait_until_ready()
+        rejoined = 0
+        for guild_id, settings in saved.items():
+            if settings.voice_channel_id is None or self.sessions.get(guild_id) is not None:
+                continue
+            # with sharding, only the guilds of this process are found
+            if self.bot.get_guild(guild_id) is None:
+                continue
+            channel = self.bot.get_channel(settings.voice_channel_id)
+            text_channel = self.bot.get_channel(settings.text_channel_id) if settings.text_channel_id else None
+            if (
+                not isinstance(channel, discord.VoiceChannel)
+                or text_channel is None
+                or not any(not member.bot for member in channel.members)
+            ):
+                self.guild_settings.update(guild_id, voice_channel_id=None)
+                continue
+            try:
+                voice_client = await channel.connect()
+            except (discord.ClientException, asyncio.TimeoutError) as e:
+                self.bot.logger.warning(f"Failed to rejoin {channel.id} (guild id: {guild_id}): {e}")
+                continue
+            self._create_session(guild_id, voice_client, text_channel, channel)
+            rejoined += 1
+        self.bot.logger.info(f"Rejoined {rejoined} voice channels")
+        self.bot.startup.mark("voice channels rejoined")
+
+    def _set_engine_state(self, state: str) -> None:
+        self.engine_state = state
+        self.engine_ready_at = time.monotonic()
+        self.engine_ready.set()
+        if state == "ready":
+            self.bot.startup.mark("engine ready")
+
+    async def _wait_for_engine(self) -> None:
+        """
+        Waits until the synthesis engine has started.
+
+        :raises RuntimeError: If the engine failed to start.
+        """
+        await self.engine_ready.wait()
+        if self.engine_state == "failed":
+            raise RuntimeError("The VOICEVOX engine failed to start")
+
+    def _health(self) -> dict:
+        """
+        Returns the health of this process, served on /health by the metrics server.
+        """
+        return {
+            "cluster": getattr(self.bot, "cluster_id", None),
+            "ready": self.bot.is_ready() and self.engine_state == "ready",
+            "engine": self.engine_state,
+            "startup": self.bot.startup.summary(),
+            "guilds": len(self.bot.guilds),
+            "sessions": len(self.sessions),
+            "latency": self.bot.latency,
+            # AutoShardedBot only: the heartbeat latency of every shard
+            "shards": {shard_id: latency for shard_id, latency in getattr(self.bot, "latencies", [])},
         }
-        response = requests.post(post_url, params=post_data)
-        return response.json()
 
-    def _post_synthesis(self, data: dict, speaker: int) -> bytes:
+    @tasks.loop(seconds=5.0)
+    async def watch_custom_settings(self) -> None:
         """
-        Posts a synthesis to the VoiceVox API and returns the audio URL.
+        Reloads custom_setting.json when the file has been modified.
+        """
+        if await asyncio.to_thread(self.custom_settings.reload_if_changed):
+            self._encode_custom_clips()
 
-        :param data: The data to post to the API.
+    def _encode_custom_clips(self) -> None:
+        """
+        Encodes the audio files of the custom stickers and emojis into clips in the background.
+        """
+        if self.clips is None:
+            return
+        settings = self.custom_settings.current
+        paths = list(dict.fromkeys(
+            str(Path(__file__).resolve().parent.parent) + "/audio/" + setting["filename"]
+            for setting in (*settings.custom_sticker.values(), *settings.custom_emoji.values())
+            if setting.get("filename") is not None
+        ))
+
+        def encode() -> None:
+            for path in paths:
+                if not self.clips.enabled:
+                    return
+                self.clips.encode_file(path)
+
+        if paths:
+            self._in_background(asyncio.to_thread(encode))
+
+    def _in_background(self, coroutine) -> None:
+        # keeps a reference, so that the task is not garbage collected while it runs
+        task = asyncio.ensure_future(coroutine)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+
+    @tasks.loop(minutes=5.0)
+    async def prewarm_cache(self) -> None:
+        """
+        Synthesizes the most frequent phrases of the connected guilds ahead, while they are idle.
+        The interval is set from config.json by cog_load.
+        """
+        for session in list(self.sessions):
+            await self._prewarm_guild(session.guild_id)
+
+    @prewarm_cache.before_loop
+    async def before_prewarm_cache(self) -> None:
+        await self.engine_ready.wait()
+
+    def _is_idle(self, guild_id: int) -> bool:
+        session = self.sessions.get(guild_id)
+        return (
+            session is not None
+            and len(session.audio_queue) == 0
+            and not session.audio_queue.playing
+            and self.scheduler.pending() == 0
+        )
+
+    async def _prewarm_guild(self, guild_id: int) -> None:
+        """
+        Puts the phrases read out most often in a guild in the audio cache, for its current speaker and voice.
+        Stops as soon as the guild or the engine has something else to do.
+
+        :param guild_id: The ID of the guild.
+        """
+        speaker = self._get_speaker(guild_id)[0]
+        try:
+            phrases = await self.bot.database.get_frequent_queries(
+                guild_id, self.prewarm_days, self.prewarm_phrases, self.prewarm_min_count
+            )
+        except aiosqlite.Error as e:
+            self.bot.logger.error(f"Failed to read the frequent phrases (guild id: {guild_id}): {e}")
+            return
+        warmed = 0
+        for text, _ in phrases:
+            if not self._is_idle(guild_id):
+                break
+            key, voice, speed = self._audio_key(guild_id, text, speaker)
+            if await asyncio.to_thread(self.audio_cache.contains, key):
+                continue
+            try:
+                await self._synthesize(guild_id, text, speaker, key, voice, speed)
+            except Exception as e:
+                self.bot.logger.warning(f"Failed to prewarm a phrase (guild id: {guild_id}): {type(e).__name__}: {e}")
+                break
+            warmed += 1
+        if warmed:
+            self.bot.logger.info(f"Prewarmed {warmed} frequent phrases (guild id: {guild_id})")
+
+    async def _prune_history(self) -> None:
+        try:
+            removed = await self.bot.database.prune_queries(self.history_retention_days)
+        except aiosqlite.Error as e:
+            self.bot.logger.error(f"Failed to prune the query history: {e}")
+            return
+        if removed:
+            self.bot.logger.info(f"Removed {removed} queries older than {self.history_retention_days} days")
+
+    @tasks.loop(minutes=1.0)
+    async def evict_idle_sessions(self) -> None:
+        """
+        Leaves the voice channels where nothing has been read out for a while.
+        """
+        for session in self.sessions.idle(self.session_idle_timeout):
+            self.bot.logger.info(f"Leaving the idle voice session (guild id: {session.guild_id})")
+            await self._end_session(session.guild_id)
+
+    def _audio_key(self, guild_id: int, text: str, speaker: int) -> tuple:
+        """
+        Returns the cache key of an utterance in a guild, with the voice and the backlog speed it is synthesized with.
+
+        :param guild_id: The ID of the guild the text comes from.
+        :param text: The text to synthesize.
         :param speaker: The speaker ID to use.
         """
-        post_url = self.POST_URL + "/synthesis"
-        post_data = {
-            "speaker": speaker,
-        }
-        response = requests.post(post_url, params=post_data, json=data)
-        return response.content
+        voice = self.guild_settings.cached(guild_id).voice
+        speed = self._speech_speed(guild_id)
+        key = AudioCache.make_key(
+            text,
+            f"{speaker}@{voice.speed * speed:.2f}:{voice.pitch:.2f}:{voice.intonation:.2f}:{voice.volume:.2f}",
+            self.engine_version,
+        )
+        return key, voice, speed
 
-    def _generate_audio_file(self, text: str, speaker: int) -> str:
+    async def _synthesize(
+        self, guild_id: int, text: str, speaker: int, key: str, voice: VoiceParams, speed: float
+    ) -> tuple:
         """
-        Generates an audio file using the specified speaker.
+        Synthesizes the text with VOICEVOX and returns the WAV bytes, with the seconds the engine
+        spent on it (None when the audio came from the cache).
+        Synthesis runs on the worker pool, the remote engines or the synthesis executor, so this never blocks the event loop.
 
-        :param text: The text to generate the audio file from.
+        :param guild_id: The ID of the guild the text comes from, for fair scheduling.
+        :param text: The text to synthesize.
         :param speaker: The speaker ID to use.
+        :param key: The cache key, voice and speed from _audio_key.
+        """
+        started = time.perf_counter()
+        audio_data = self.audio_cache.get_memory(key)
+        if audio_data is None:
+            audio_data = await asyncio.to_thread(self.audio_cache.get, key)
+        self.metrics.observe("cache_lookup", time.perf_counter() - started, guild_id, speaker)
+        if audio_data is not None:
+            return audio_data, None
+        await self._wait_for_engine()
+
+        # cache misses wait for the turn of their guild, so one busy guild cannot starve the others
+        if self.worker_pool is not None:
+            render = functools.partial(self.worker_pool.synthesize, text, speaker, voice, speed, self.shorten_pauses)
+        elif self.remote_engine is not None:
+            render = functools.partial(self._remote_tts, text, speaker, voice, speed)
+        else:
+            render = functools.partial(self.synthesis_executor.run, self._tts, text, speaker, voice, speed)
+        started = time.perf_counter()
+        audio_data, stages = await self.scheduler.run(guild_id, len(text), render)
+        for stage, seconds in stages.items():
+            self.metrics.observe(stage, seconds, guild_id, speaker)
+        # the time spent waiting for the scheduler, the executor or the worker process
+        self.metrics.observe("engine_wait", max(0.0, time.perf_counter() - started - sum(stages.values())), guild_id, speaker)
+        await asyncio.to_thread(self.audio_cache.put, key, audio_data)
+        return audio_data, sum(stages.values())
+
+    def _speech_speed(self, guild_id: int) -> float:
+        """
+        Returns the speed scale for the next utterance of a guild, from the backlog of its voice queue.
+
+        :param guild_id: The ID of the guild.
+        """
+        session = self.sessions.get(guild_id)
+        if self.speech_rate is None or session is None:
+            return 1.0
+        queue = session.audio_queue
+        return self.speech_rate.speed(len(queue), queue.oldest_age())
+
+    def _tts(self, text: str, speaker: int, voice: VoiceParams, speed: float = 1.0):
+        """
+        Synthesizes the text with the local VoicevoxCore. Blocking, runs on a synthesis thread.
+        Returns the WAV bytes and the durations of the pipeline stages.
+
+        :param text: The text to synthesize.
+        :param speaker: The speaker ID to use.
+        :param voice: The voice settings of the guild.
+        :param speed: The speed factor from the backlog.
+        """
+        with self.model_manager.use(speaker):  # NOTE: use VoiceVoxCore instead of the API (24.5.7~)
+            # the two-stage API lets the voice be set between the text analysis and the vocoder
+            return staged_synthesis(
+                self.voicevox_core, self.query_cache, text, speaker, voice, speed, self.shorten_pauses
+            )
+
+    async def _remote_tts(self, text: str, speaker: int, voice: VoiceParams, speed: float = 1.0):
+        """
+        Synthesizes the text on the remote engines, or with the local VoicevoxCore when none of them is available.
+
+        :param text: The text to synthesize.
+        :param speaker: The speaker ID to use.
+        :param voice: The voice settings of the guild.
+        :param speed: The speed factor from the backlog.
+        """
+        if self.model_manager is not None and not self.remote_engine.healthy():
+            # every engine is down; the health checks bring them back
+            return await self.synthesis_executor.run(self._tts, text, speaker, voice, speed)
+        try:
+            return await self.remote_engine.synthesize(text, speaker, voice, speed, self.shorten_pauses)
+        except RemoteEngineUnavailable as e:
+            if self.model_manager is None:
+                raise
+            self.bot.logger.warning(f"Falling back to the local VOICEVOX core: {e}")
+            return await self.synthesis_executor.run(self._tts, text, speaker, voice, speed)
+
+    async def _prepare_speaker(self, speaker: int) -> None:
+        """
+        Loads and warms up the model of a speaker ahead of its first message.
+
+        :param speaker: The speaker ID to prepare.
+        """
+        if self.remote_engine is not None:
+            return  # the engines load their models themselves
+        try:
+            await self._wait_for_engine()
+            if self.worker_pool is not None:
+                # the worker that runs this keeps the model, and is picked for the speaker from now on
+                await self.worker_pool.tts(WARMUP_TEXT, speaker)
+            else:
+                await asyncio.to_thread(self.model_manager.ensure_loaded, speaker)
+        except Exception as e:
+            self.bot.logger.error(f"Failed to prepare the model of speaker {speaker}: {type(e).__name__}: {e}")
+
+    async def _generate_audio_source(
+        self, guild_id: int, text: str, speaker: int, author_id: Optional[int] = None
+    ) -> discord.AudioSource:
+        """
+        Generates an in-memory audio source using the specified speaker, and records it in the query history.
+
+        :param guild_id: The ID of the guild the text comes from.
+        :param text: The text to generate the audio from.
+        :param speaker: The speaker ID to use.
+        :param author_id: The ID of the author of the message, if any.
         """
         # if speaker == 100:  # hiro
         #     file_path = self._generate_hiro_audio(text)
         #     return file_path
         # else:
 
-        # print(f"Generating audio file for '{text}' with speaker ID {speaker}.")
+        # print(f"Generating audio for '{text}' with speaker ID {speaker}.")
+
+        key, voice, speed = self._audio_key(guild_id, text, speaker)
+        if self.clips is not None:
+            clip = self.clips.get(key)
+            if clip is None and self.clips.on_disk(key):
+                clip = await asyncio.to_thread(self.clips.load, key)
+            if clip is not None:
+                self.query_history.record(guild_id, author_id, speaker, text, True)
+                return OpusClipAudio(clip)
+
+        audio_data, synthesis_seconds = await self._synthesize(guild_id, text, speaker, key, voice, speed)
+        self.query_history.record(guild_id, author_id, speaker, text, synthesis_seconds is None, synthesis_seconds)
+
+        # resampling to 48 kHz stereo is vectorized, but still cheaper off the loop
+        started = time.perf_counter()
+        source = await asyncio.to_thread(PCMBytesAudio, audio_data)
+        self.metrics.observe("encode", time.perf_counter() - started, guild_id, speaker)
+        if self.clips is not None and self.clips.hit(key):
+            # a hot phrase: its next plays skip the resampling and the Opus encoding
+            self._in_background(asyncio.to_thread(self.clips.encode_wav, key, audio_data))
+        return source
+
+    async def _generate_audio_source_en(
+        self, guild_id: int, text: str, author_id: Optional[int] = None
+    ) -> discord.AudioSource:
+        """
+        Generates an audio source with the English engine (gTTS by default, see english_tts in config.json),
+        and records it in the query history without a speaker.
 
-        if not self.voicevox_core.is_model_loaded(speaker):  # NOTE: use VoiceVoxCore instead of the API (24.5.7~)
-            self.voicevox_core.load_model(speaker)
-        audio_data = self.voicevox_core.tts(text, speaker)
+        :param guild_id: The ID of the guild the text comes from.
+        :param text: The text to generate the audio from.
+        :param author_id: The ID of the author of the message, if any.
+        """
+        audio_data, synthesis_seconds = await self.english_speech.synthesize(text)
+        self.query_history.record(guild_id, author_id, None, text, synthesis_seconds is None, synthesis_seconds)
+        if self.english_speech.backend.format == "wav":
+            return await asyncio.to_thread(PCMBytesAudio, audio_data)
+        with open(os.devnull, 'wb') as devnull:
+            return discord.FFmpegPCMAudio(io.BytesIO(audio_data), pipe=True, options='-vn -ac 2', stderr=devnull)
+
+    async def _render_message(
+        self, guild_id: int, text: str, original_text: str, speaker: int, author_id: Optional[int] = None
+    ):
+        """
+        Renders a message, in English with the English engine or in Japanese with VOICEVOX.
 
-        # # past implementation
-        # text_data = self._post_audio_query(text, speaker)
-        # audio_data = self._post_synthesis(text_data, speaker)
+        :param guild_id: The ID of the guild the message comes from.
+        :param text: The preprocessed text to read out with VOICEVOX.
+        :param original_text: The text before the Japanese-specific replacements (see utils.text).
+        :param speaker: The speaker ID to use.
+        :param author_id: The ID of the author of the message.
+        """
+        if is_english(original_text):
+            # the English engine has its own concurrency limit, so it never holds a VOICEVOX slot
+            return await self._generate_audio_source_en(guild_id, original_text, author_id)
+        return await self._generate_audio_source(guild_id, text, speaker, author_id)
+
+    def _render_message_job(
+        self, guild_id: int, text: str, original_text: str, speaker: int, author_id: Optional[int] = None
+    ):
+        """
+        Returns the render function of a (coalesced) message for its SpeechJob.
+        """
+        return functools.partial(self._render_message, guild_id, text, original_text, speaker, author_id)
 
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as f:
-            f.write(audio_data)
-            file_path = f.name
-        return file_path
+    async def _render_custom_audio(self, guild_id: int, setting: dict, speaker: int, author_id: Optional[int] = None):
+        """
+        Renders a custom sticker or emoji: its audio file if it has one, otherwise its content.
+        An audio file is recorded in the query history by its filename, without a speaker.
 
-    def _generate_audio_file_en(self, text: str) -> str:
+        :param guild_id: The ID of the guild the sticker or emoji comes from.
+        :param setting: The custom sticker or emoji setting.
+        :param speaker: The speaker ID to use.
+        :param author_id: The ID of the author of the message, if any.
+        """
+        if setting.get("filename") is None:
+            return await self._generate_audio_source(guild_id, setting["content"], speaker, author_id)
+        path = str(Path(__file__).resolve().parent.parent) + "/audio/" + setting["filename"]
+        if self.clips is not None and self.clips.enabled:
+            clip = await asyncio.to_thread(self.clips.encode_file, path)
+            if clip is not None:
+                self.query_history.record(guild_id, author_id, None, setting["filename"], True)
+                return OpusClipAudio(clip)
+        self.query_history.record(guild_id, author_id, None, setting["filename"], False)
+        return path  # decoded by ffmpeg, see _make_source
+
+    @staticmethod
+    def _make_source(audio) -> discord.AudioSource:
         """
-        Generates an audio file using the specified speaker.
+        Returns a playable source for a queued item.
 
-        :param text: The text to generate the audio file from.
+        :param audio: Either an audio source or the path of an audio file to decode with ffmpeg.
+        """
+        if isinstance(audio, discord.AudioSource):
+            return audio
+        with open(os.devnull, 'wb') as devnull:
+            ffmpeg_options = {
+                'options': '-vn -ac 2',
+                'stderr': devnull
+            }
+            return discord.FFmpegPCMAudio(audio, **ffmpeg_options)
+
+    @staticmethod
+    def _discard_audio(audio) -> None:
         """
-        tts = gTTS(text=text, lang='en-us')
-        with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as f:
-            tts.save(f.name)
-            file_path = f.name
-        return file_path
+        Frees rendered audio once it has been played or dropped.
+        Audio files are the custom stickers and emojis of the guilds, which are kept.
 
-    def _create_after_callback(self, guild_id, previous_path) -> callable:
-        # create recursive callback function
-        def after_callback(error):
-            async def play_next():
-                if error:
-                    self.bot.logger.error(f"Error: {error}")
-                self.server_to_if_playing[guild_id] = False
-
-                # remove the previous audio file
-                if not re.search(r'[^/]+$', previous_path).group().startswith("CUSTOMSTICKER"):
-                    os.remove(previous_path)
-
-                if not self.server_to_audio_queue[guild_id].empty():
-                    next_audio_path = await self.server_to_audio_queue[guild_id].get()
-                    self.server_to_if_playing[guild_id] = True
-                    with open(os.devnull, 'wb') as devnull:
-                        ffmpeg_options = {
-                            'options': '-vn -ac 2',
-                            'stderr': devnull
-                        }
-                        source = discord.FFmpegPCMAudio(next_audio_path, **ffmpeg_options)
-                        voice_client = self.server_to_voice_client[guild_id]
-                        voice_client.play(source, after=self._create_after_callback(guild_id, next_audio_path))  # recursive call
-                else:
-                    pass
+        :param audio: An audio source or the path of an audio file.
+        """
+        if isinstance(audio, discord.AudioSource):
+            audio.cleanup()
 
-            # schedule the coroutine to be run on the event loop
-            asyncio.run_coroutine_threadsafe(play_next(), self.bot.loop)
+    def _get_speaker(self, guild_id: int) -> tuple:
+        """
+        Returns the (speaker id, speaker name) chosen with /change in the guild.
+        """
+        return self.guild_settings.cached(guild_id).speaker or DEFAULT_SPEAKER
 
-        return after_callback
+    def _create_session(self, guild_id: int, voice_client, text_channel, user_channel) -> GuildSession:
+        """
+        Starts the voice session of a guild, replacing the previous one.
+        """
+        previous = self.sessions.get(guild_id)
+        session = GuildSession(
+            guild_id,
+            voice_client,
+            text_channel,
+            user_channel,
+            PlaybackQueue(
+                play=lambda audio: self._play(guild_id, audio),
+                discard=self._discard_audio,
+                prefetch=self.prefetch,
+                max_depth=self.queue_max_depth,
+                overflow=self.queue_overflow,
+                max_age=self.queue_max_age,
+                coalesce=self.queue_coalesce,
+                on_play=lambda job: self._on_play(guild_id, job),
+                ready_since=lambda: self.engine_ready_at,
+                logger=self.bot.logger,
+            ),
+        )
+        if previous is not None:
+            # the disconnection of the previous voice client may not have been reported yet
+            session.expected_disconnection = previous.expected_disconnection
+        self.sessions.add(session)
+        if self.prewarm and self.engine_state == "ready":
+            self._in_background(self._prewarm_guild(guild_id))
+        return session
+
+    async def _end_session(self, guild_id: int) -> None:
+        """
+        Disconnects from the voice channel of a guild and drops its session.
+        """
+        session = self.sessions.remove(guild_id)
+        self.metrics.forget_guild(guild_id)
+        # the bot left on purpose: it does not rejoin after a restart
+        if self.guild_settings.cached(guild_id).voice_channel_id is not None:
+            self.guild_settings.update(guild_id, voice_channel_id=None)
+        if session is not None and session.voice_client is not None:
+            session.expected_disconnection = True
+            await session.voice_client.disconnect()
+
+    async def _connect(self, context: Context, channel) -> bool:
+        """
+        Connects to a voice channel and starts the session of the guild.
 
-    async def _add_to_queue(self, path: str, guild_id: str) -> None:
+        :param context: The application command context.
+        :param channel: The voice channel to connect to.
+        :return: Whether the bot was already connected in the guild.
         """
-        Adds an audio file to the queue.
+        reconnected = False
+        session = self.sessions.get(context.guild.id)
+        if session is not None and session.voice_client is not None:
+            if session.voice_client.is_connected() is True:
+                session.expected_disconnection = True
+                await session.voice_client.disconnect()
+                reconnected = True
+
+        # set the server settings
+        voice_client = await channel.connect()
+        self._create_session(context.guild.id, voice_client, context.channel, channel)
+        self.guild_settings.update(context.guild.id, text_channel_id=context.channel.id, voice_channel_id=channel.id)
+        return reconnected
 
-        :param path: The path of the audio file to add.
-        :param guild_id: The ID of the guild to add the audio file to.
+    def _on_play(self, guild_id: int, job: SpeechJob) -> None:
         """
-        voice_client = self.server_to_voice_client[guild_id]
-        if voice_client is None:
+        Called by the voice queue right before a job is played.
+        """
+        session = self.sessions.get(guild_id)
+        if session is not None:
+            session.playing_since = job.created_at
+        if job.rendered_at is not None:
+            # how long the rendered audio waited for the previous utterances
+            self.metrics.observe("queue_wait", time.monotonic() - job.rendered_at, guild_id)
+
+    async def _play(self, guild_id: int, audio) -> None:
+        """
+        Plays rendered audio in the guild and waits until playback ends.
+
+        :param guild_id: The ID of the guild to play the audio in.
+        :param audio: An in-memory audio source, or the path of an audio file.
+        """
+        session = self.sessions.get(guild_id)
+        try:
+            if session is None or session.voice_client is None or not session.voice_client.is_connected():
+                return
+            voice_client = session.voice_client
+            loop = asyncio.get_running_loop()
+            finished = asyncio.Event()
+            received_at = session.playing_since
+
+            def after_callback(error):
+                if error:
+                    self.bot.logger.error(f"Error: {error}")
+                # called from the voice thread
+                loop.call_soon_threadsafe(finished.set)
+
+            source = self._make_source(audio)
+            if received_at is not None:
+                # the latency users perceive: from their message to the first frame sent to Discord
+                def on_first_frame():
+                    self.metrics.observe("first_frame", time.monotonic() - received_at, guild_id)
+                    self.bot.startup.mark("first utterance")
+
+                source = FirstFrameAudio(source, on_first_frame)
+            voice_client.play(source, after=after_callback)
+            try:
+                await finished.wait()
+            except asyncio.CancelledError:
+                voice_client.stop()
+                raise
+            if received_at is not None:
+                self.metrics.observe("playback_end", time.monotonic() - received_at, guild_id)
+        finally:
+            self._discard_audio(audio)
+            if session is not None:
+                session.touch()
+
+    async def _add_to_queue(self, job: SpeechJob, guild_id: int) -> None:
+        """
+        Adds a synthesis job to the voice queue. The job is rendered ahead of its turn.
+
+        :param job: The job that renders the audio to play.
+        :param guild_id: The ID of the guild to add the job to.
+        """
+        session = self.sessions.get(guild_id)
+        if session is None or session.voice_client is None:
             return
-        if self.server_to_if_playing[guild_id]:
-            await self.server_to_audio_queue[guild_id].put(path)
-        else:
-            self.server_to_if_playing[guild_id] = True
-            with open(os.devnull, 'wb') as devnull:
-                ffmpeg_options = {
-                    'options': '-vn -ac 2',
-                    'stderr': devnull
-                }
-                source = discord.FFmpegPCMAudio(path, **ffmpeg_options)
-                voice_client.play(source, after=self._create_after_callback(guild_id, path))
+        session.touch()
+        session.audio_queue.put(job)
 
     @commands.Cog.listener()
     async def on_message(self, message) -> None:
@@ -226,9 +998,11 @@ class VoiceVox(commands.Cog, name="voicevox"):
 
         :param message: The message sent.
         """
-        if message.author.bot:
+        received = time.perf_counter()
+        if message.author.bot or message.guild is None:
             return
-        if message.channel != self.server_to_text_input_channel[message.guild.id]:
+        session = self.sessions.get(message.guild.id)
+        if session is None or message.channel != session.text_channel:
             return
         if message.content.startswith(self.bot.config["prefix"]):
             return
@@ -243,56 +1017,38 @@ class VoiceVox(commands.Cog, name="voicevox"):
 
         message_content = message.content
         guild_id = message.guild.id
-        speaker_to_use = self.server_to_speaker_id[message.guild.id]
-
-        json_path = str(Path(__file__).resolve().parent.parent) + "/custom_setting.json"
-
-        # load custom settings
-        with open(json_path, "r") as file:
-            custom_setting = json.load(file)
+        self.metrics.observe("filter", time.perf_counter() - received, guild_id)
 
         # remove user mentions
-        message_content = re.sub(r"<@\d+>", "", message_content)
-        message_content = message_content.replace("\u3000", " ")
-        message_content = message_content.replace("\n", " ")
-        message_content = re.sub(r'\s+', ' ', message_content)
-
-        # remove emojis
-        def is_emoji(char):
-            return unicodedata.category(char) in ['So', 'Sk', 'Sm', 'Cn']
-
-        def clean_emoji(message_content):
-            custom_emoji_pattern = re.compile(r'<a?:.+?:\d+>')
-            message_content = custom_emoji_pattern.sub('', message_content)
-
-            cleaned_content = ''.join(c for c in message_content if not is_emoji(c))
-
-            return cleaned_content
-
-        message_content = clean_emoji(message_content)
+        started = time.perf_counter()
+        message_content = remove_mentions(message_content)
+        raw_message_content = message_content  # line breaks are kept for splitting long messages
+        message_content = clean_text(message_content)
         original_message_content = message_content
+        normalize_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        speaker_to_use, _ = self._get_speaker(guild_id)
+        custom_setting = self.custom_settings.current
 
         #  get custom setting dict. key: emoji_id, sticker_id, author_id
-        custom_emoji = {int(key): val for key, val in custom_setting.get("custom_emoji").items()}
-        custom_sticker = {int(key): val for key, val in custom_setting.get("custom_sticker").items()}
-        custom_speaker = {int(key): val for key, val in custom_setting.get("custom_speaker").items()}
+        custom_emoji = custom_setting.custom_emoji
+        custom_sticker = custom_setting.custom_sticker
+        custom_speaker = custom_setting.custom_speaker
 
         # check if the message author has a specific speaker setting
         if message.author.id in custom_speaker.keys():
             speaker_to_use = custom_speaker[message.author.id]["speaker_id"]  # int
+        self.metrics.observe("settings", time.perf_counter() - started, guild_id, speaker_to_use)
 
         # check if the message has stickers and if they are the specific ones
         if len(message.stickers) > 0:
             sticker_id = message.stickers[0].id
             if sticker_id in custom_sticker.keys():  # at most 1 sticker for each message
-                if custom_sticker[sticker_id]["filename"] is None:
-                    content = custom_sticker[sticker_id]["content"]
-                    path = self._generate_audio_file(content, speaker_to_use)
-                else:
-                    filename = custom_sticker[sticker_id]["filename"]
-                    path = str(Path(__file__).resolve().parent.parent) + "/audio/" + filename
-
-                await self._add_to_queue(path=path, guild_id=message.guild.id)
+                job = SpeechJob(functools.partial(
+                    self._render_custom_audio, guild_id, custom_sticker[sticker_id], speaker_to_use, message.author.id
+                ))
+                await self._add_to_queue(job=job, guild_id=message.guild.id)
                 return
             else:
                 return
@@ -303,50 +1059,47 @@ class VoiceVox(commands.Cog, name="voicevox"):
             for emoji in contained_emoji:
                 emoji_id = int(re.findall(r'\d+', emoji)[0])
                 if emoji_id in custom_emoji.keys():
-                    if custom_emoji[emoji_id]["filename"] is None:
-                        content = custom_emoji[emoji_id]["content"]
-                        path = self._generate_audio_file(content, speaker_to_use)
-                    else:
-                        filename = custom_sticker[sticker_id]["filename"]
-                        path = str(Path(__file__).resolve().parent.parent) + "/audio/" + filename
-
-                    await self._add_to_queue(path=path, guild_id=message.guild.id)
+                    job = SpeechJob(functools.partial(
+                        self._render_custom_audio, guild_id, custom_emoji[emoji_id], speaker_to_use, message.author.id
+                    ))
+                    await self._add_to_queue(job=job, guild_id=message.guild.id)
             return
 
-        message_content = f"{message_content!r}"
-        message_content = re.sub('^.(.*).$', r'\1', message_content)
-
-        self.bot.logger.info(f'New input message: "{message_content}" (guild id: {guild_id})')
-
-        # replace "w" with "わら"
-        message_content = message_content.replace("w", "わら")
-        message_content = message_content.replace("ｗ", "わら")
-        message_content = message_content.replace("W", "わら")
-        # replace successive "笑" in the end with "わら"
-        message_content = re.sub(r'笑+$', lambda m: 'わら' * len(m.group()), message_content)
+        self.bot.logger.info(f'New input message: "{original_message_content}" (guild id: {guild_id})')
+        started = time.perf_counter()
+        message_content = to_reading(message_content)
+        self.metrics.observe("normalize", normalize_seconds + time.perf_counter() - started, guild_id, speaker_to_use)
 
         # print(message_content)
-        # generate audio file
-        if (bool(re.match(r'^[^\u4E00-\u9FFF\u3040-\u309F\u30A0-\u30FF]+$', original_message_content))
-                and not bool(re.fullmatch(r'[wWｗ]+', original_message_content))
-                and not bool(re.fullmatch(r'[\uFF61-\uFF9F]+', original_message_content))):
-            path = self._generate_audio_file_en(original_message_content)
+        # the audio is generated by the voice queue, ahead of its turn
+        if (self.streaming and len(message_content) >= self.stream_threshold
+                and not is_english(original_message_content)):
+            # long messages are synthesized sentence by sentence, so the first one starts speaking right away
+            texts = [to_reading(clean_text(chunk)) for chunk in split_sentences(raw_message_content, self.stream_chunk_length)]
+            jobs = [
+                SpeechJob(functools.partial(self._generate_audio_source, guild_id, text, speaker_to_use, message.author.id))
+                for text in texts if text.strip()
+            ]
         else:
-            path = self._generate_audio_file(message_content, speaker_to_use)
-        self.bot.logger.info(f"Successfully generated. path: {path} (guild id: {guild_id})")
-
+            english = is_english(original_message_content)
+            jobs = [SpeechJob(
+                functools.partial(
+                    self._render_message, guild_id, message_content, original_message_content, speaker_to_use, message.author.id
+                ),
+                # consecutive messages of an author are read out together while they wait in the queue
+                key=(message.author.id, speaker_to_use, english),
+                texts=(message_content, original_message_content),
+                build=functools.partial(self._render_message_job, guild_id, speaker=speaker_to_use, author_id=message.author.id),
+                separator=". " if english else "。",
+            )]
         try:
-            await self._add_to_queue(path=path, guild_id=guild_id)
+            for job in jobs:
+                await self._add_to_queue(job=job, guild_id=guild_id)
         except Exception as e:
             self.bot.logger.error(f"Error during message handling: {e} (guild id: {guild_id})")
 
         # show logs
         self.bot.logger.info(f'Preprocessed text: "{message_content}" by {message.author}  (guild id: {guild_id})')
-        query_hist_path = str(Path(__file__).resolve().parent.parent) + "/query_hist.txt"
-        with open(query_hist_path, 'a') as file:
-            file.write(
-                f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [INFO] discord_bot: VOICEVOX query: '{message.content}' by {message.author} (ID: {message.author.id}) \n"
-            )
 
     @commands.Cog.listener()
     async def on_voice_state_update(self, member, before, after) -> None:
@@ -361,13 +1114,15 @@ class VoiceVox(commands.Cog, name="voicevox"):
         if member.id == self.bot.user.id:
             guild_id = member.guild.id
             if before.channel is not None and after.channel is None:
-                if self.server_to_expected_disconnection[guild_id]:
+                session = self.sessions.get(guild_id)
+                if session is None or session.expected_disconnection:
                     self.bot.logger.info("Detected normal disconnection.")
-                    self.server_to_expected_disconnection[guild_id] = False
+                    if session is not None:
+                        session.expected_disconnection = False
                 else:
                     self.bot.logger.info("Detected unexpected disconnection. Check the close code.")
                     # reconnect to the voice channel
-                    self.server_to_voice_client[guild_id] = await before.channel.connect()
+                    session.voice_client = await before.channel.connect()
 
     @commands.hybrid_command(
         name="join",
@@ -380,7 +1135,6 @@ class VoiceVox(commands.Cog, name="voicevox"):
         :param context: The application command context.
         """
         user = context.author
-        if_send_embed = True
 
         if user.voice is None:
             embed = discord.Embed(
@@ -388,24 +1142,13 @@ class VoiceVox(commands.Cog, name="voicevox"):
             )
             await context.reply(embed=embed)
             return
-        if self.server_to_voice_client[context.guild.id] is not None:
-            if self.server_to_voice_client[context.guild.id].is_connected() is True:
-                self. server_to_expected_disconnection[context.guild.id] = True
-                await self.server_to_voice_client[context.guild.id].disconnect()
-                self.server_to_voice_client[context.guild.id] = None
-                if_send_embed = False
-
-        # set the server settings
-        self.server_to_text_input_channel[context.guild.id] = context.channel
-        self.server_to_voice_client[context.guild.id] = await user.voice.channel.connect()
-        self.server_to_if_connected[context.guild.id] = True
-        self.server_to_user_channel[context.guild.id] = user.voice.channel
+        if_send_embed = not await self._connect(context, user.voice.channel)
 
         # send logs to the text channel
         latency = self.bot.latency * 1000
         if if_send_embed:
             embed = discord.Embed(
-                title=f"VoiceVox Bot: {self.server_to_speaker[context.guild.id]}",
+                title=f"VoiceVox Bot: {self._get_speaker(context.guild.id)[1]}",
                 description=(f"Joined {user.voice.channel.mention} (Ping: {latency:.0f}ms)"),
                 color=0x00FF00,
             )
@@ -428,7 +1171,6 @@ class VoiceVox(commands.Cog, name="voicevox"):
         :param channel_id: The ID of the voice channel to join.
         """
         channel = discord.utils.get(context.guild.voice_channels, id=int(channel_id))
-        if_send_embed = True
 
         if channel is None:
             embed = discord.Embed(
@@ -436,25 +1178,13 @@ class VoiceVox(commands.Cog, name="voicevox"):
             )
             await context.reply(embed=embed)
             return
-
-        if self.server_to_voice_client[context.guild.id] is not None:
-            if self.server_to_voice_client[context.guild.id].is_connected() is True:
-                self. server_to_expected_disconnection[context.guild.id] = True
-                await self.server_to_voice_client[context.guild.id].disconnect()
-                self.server_to_voice_client[context.guild.id] = None
-                if_send_embed = False
-
-        # set the server settings
-        self.server_to_text_input_channel[context.guild.id] = context.channel
-        self.server_to_voice_client[context.guild.id] = await channel.connect()
-        self.server_to_if_connected[context.guild.id] = True
-        self.server_to_user_channel[context.guild.id] = channel
+        if_send_embed = not await self._connect(context, channel)
 
         # send logs to the text channel
         latency = self.bot.latency * 1000
         if if_send_embed:
             embed = discord.Embed(
-                title=f"VoiceVox Bot: {self.server_to_speaker[context.guild.id]}",
+                title=f"VoiceVox Bot: {self._get_speaker(context.guild.id)[1]}",
                 description=(f"Joined {channel.mention} (Ping: {latency:.0f}ms)"),
                 color=0x00FF00,
             )
@@ -475,8 +1205,8 @@ class VoiceVox(commands.Cog, name="voicevox"):
 
         :param context: The application command context.
         """
-        voice_client = self.server_to_voice_client[context.guild.id]
-        if voice_client is None:
+        session = self.sessions.get(context.guild.id)
+        if session is None or session.voice_client is None:
             embed = discord.Embed(
                 description="VoiceVox Bot is not connected to a voice channel.", color=0xE02B2B
             )
@@ -484,19 +1214,12 @@ class VoiceVox(commands.Cog, name="voicevox"):
             return
         else:
             embed = discord.Embed(
-                description=f"Leaving {voice_client.channel.mention} 👋", color=0xE02B2B
+                description=f"Leaving {session.voice_client.channel.mention} 👋", color=0xE02B2B
             )
             await context.send(embed=embed)
-            self. server_to_expected_disconnection[context.guild.id] = True
-            await voice_client.disconnect()
 
             # reset the server settings
-            self.server_to_voice_client[context.guild.id] = None
-            self.server_to_if_connected[context.guild.id] = False
-            self.server_to_text_input_channel[context.guild.id] = None
-            self.server_to_user_channel[context.guild.id] = None
-            self.server_to_audio_queue[context.guild.id] = asyncio.Queue()
-            self.server_to_if_playing[context.guild.id] = False
+            await self._end_session(context.guild.id)
 
     @commands.hybrid_command(
         name="hardreset",
@@ -513,16 +1236,7 @@ class VoiceVox(commands.Cog, name="voicevox"):
         )
         await context.send(embed=embed)
 
-        guild_id = context.guild.id
-        voice_client = self.server_to_voice_client[guild_id]
-        if voice_client is not None:
-            await voice_client.disconnect()
-        self.server_to_voice_client[guild_id] = None
-        self.server_to_if_connected[guild_id] = False
-        self.server_to_text_input_channel[guild_id] = None
-        self.server_to_user_channel[guild_id] = None
-        self.server_to_audio_queue[guild_id] = asyncio.Queue()
-        self.server_to_if_playing[guild_id] = False
+        await self._end_session(context.guild.id)
 
     @commands.hybrid_command(
         name="change",
@@ -542,8 +1256,139 @@ class VoiceVox(commands.Cog, name="voicevox"):
             )
         await context.send(view=view)
         await view.waiter.wait()
-        self.server_to_speaker_id[context.guild.id] = view.selected_speaker_id
-        self.server_to_speaker[context.guild.id] = view.selected_speaker
+        self.guild_settings.update(context.guild.id, speaker=(view.selected_speaker_id, view.selected_speaker))
+        await self._prepare_speaker(view.selected_speaker_id)
+
+    @commands.hybrid_command(
+        name="cachestats",
+        description="Shows the synthesized audio cache statistics.",
+    )
+    @commands.is_owner()
+    async def cachestats(self, context: Context) -> None:
+        """
+        Shows the hit/miss/eviction counters of the synthesized audio cache.
+
+        :param context: The application command context.
+        """
+        stats = self.audio_cache.stats()
+        embed = discord.Embed(
+            title="VoiceVox Bot: cache",
+            description=(
+                f"Hit rate: {stats['hit_rate']:.1%}\n"
+                f"Hits: {stats['memory_hits']} (memory) / {stats['disk_hits']} (disk), misses: {stats['misses']}\n"
+                f"Evictions: {stats['memory_evictions']} (memory) / {stats['disk_evictions']} (disk)\n"
+                f"Memory: {stats['memory_entries']} entries, {stats['memory_bytes'] / 1024 / 1024:.1f} MB\n"
+                f"Disk: {stats['disk_entries']} entries, {stats['disk_bytes'] / 1024 / 1024:.1f} MB"
+            ),
+            color=0xBEBEFE,
+        )
+        if self.clips is not None:
+            clip_stats = self.clips.stats()
+            embed.add_field(
+                name="Opus clips",
+                value=(
+                    f"{clip_stats['clips']} clips ({clip_stats['memory_bytes'] / 1024 / 1024:.1f} MB in memory, "
+                    f"{clip_stats['disk_bytes'] / 1024 / 1024:.1f} MB mapped), "
+                    f"{clip_stats['hits']} plays, {clip_stats['encoded']} encoded"
+                    + ("" if clip_stats["enabled"] else " (disabled: libopus is missing)")
+                ),
+            )
+        await context.send(embed=embed)
+
+    @commands.hybrid_command(
+        name="stats",
+        description="Shows the latency of each stage of the speech pipeline.",
+    )
+    @app_commands.describe(
+        scope="`all` (default), `guild` for this server only, or `speaker` with a speaker ID",
+        speaker="The speaker ID, with the `speaker` scope",
+    )
+    @commands.is_owner()
+    async def stats(self, context: Context, scope: str = "all", speaker: Optional[int] = None) -> None:
+        """
+        Shows the count, mean and p50/p95/p99 latency of each stage of the speech pipeline.
+
+        :param context: The application command context.
+        :param scope: All utterances, those of this guild, or those of a speaker.
+        :param speaker: The speaker ID, with the speaker scope.
+        """
+        if scope == "guild" and context.guild is not None:
+            summary = self.metrics.summary(guild_id=context.guild.id)
+        elif scope == "speaker" and speaker is not None:
+            summary = self.metrics.summary(speaker=speaker)
+        else:
+            summary = self.metrics.summary()
+        lines = [
+            f"{stage}: n={stats['count']}, mean {stats['mean'] * 1000:.1f}ms, "
+            f"p50 {stats['p50'] * 1000:.1f}ms, p95 {stats['p95'] * 1000:.1f}ms, p99 {stats['p99'] * 1000:.1f}ms"
+            for stage, stats in summary.items()
+        ]
+        if self.worker_pool is None:
+            # in remote mode the AudioQuery results come from the engines, the local cache only serves the fallback
+            query_cache = self.remote_engine.queries if self.remote_engine is not None else self.query_cache
+            query_stats = query_cache.stats()
+            lines.append(f"AudioQuery cache: {query_stats['entries']} entries, hit rate {query_stats['hit_rate']:.1%}")
+        lines.append(
+            f"Sessions: {len(self.sessions)}, queued messages: {sum(len(session.audio_queue) for session in self.sessions)}"
+        )
+        embed = discord.Embed(
+            title=f"VoiceVox Bot: stats ({scope})",
+            description="\n".join(lines),
+            color=0xBEBEFE,
+        )
+        await context.send(embed=embed)
+
+    @commands.hybrid_command(
+        name="voice",
+        description="Changes the speed, pitch, intonation and volume of the voice in this server.",
+    )
+    @app_commands.describe(
+        speed="Speed scale, from 0.5 to 2.0 (default 1.0)",
+        pitch="Pitch shift, from -0.15 to 0.15 (default 0.0)",
+        intonation="Intonation scale, from 0.0 to 2.0 (default 1.0)",
+        volume="Volume scale, from 0.0 to 2.0 (default 1.0)",
+    )
+    async def voice(
+        self,
+        context: Context,
+        speed: Optional[float] = None,
+        pitch: Optional[float] = None,
+        intonation: Optional[float] = None,
+        volume: Optional[float] = None,
+    ) -> None:
+        """
+        Changes the voice settings of the server. Omitted values are kept.
+
+        :param context: The application command context.
+        :param speed: The speed scale.
+        :param pitch: The pitch shift.
+        :param intonation: The intonation scale.
+        :param volume: The volume scale.
+        """
+        voice = self.guild_settings.cached(context.guild.id).voice
+        voice = voice._replace(**{
+            name: value
+            for name, value in (("speed", speed), ("pitch", pitch), ("intonation", intonation), ("volume", volume))
+            if value is not None
+        })
+        if not (0.5 <= voice.speed <= 2.0 and -0.15 <= voice.pitch <= 0.15
+                and 0.0 <= voice.intonation <= 2.0 and 0.0 <= voice.volume <= 2.0):
+            embed = discord.Embed(
+                description="The value is out of range.",
+                color=0xE02B2B,
+            )
+            await context.send(embed=embed)
+            return
+        self.guild_settings.update(context.guild.id, voice=voice)
+        embed = discord.Embed(
+            title="VoiceVox Bot: voice",
+            description=(
+                f"Speed: {voice.speed:.2f}, pitch: {voice.pitch:.2f}, "
+                f"intonation: {voice.intonation:.2f}, volume: {voice.volume:.2f}"
+            ),
+            color=0x00FF00,
+        )
+        await context.send(embed=embed)
 
     @commands.hybrid_command(
         name="speaker",
@@ -558,7 +1403,7 @@ class VoiceVox(commands.Cog, name="voicevox"):
         user = context.author
         latency = self.bot.latency * 1000
         embed = discord.Embed(
-            title=f"VoiceVox Bot: {self.server_to_speaker[context.guild.id]}",
+            title=f"VoiceVox Bot: {self._get_speaker(context.guild.id)[1]}",
             description=(f"Joined {user.voice.channel.mention} (Ping: {latency:.0f}ms)"),
             color=0x00FF00,
         )
@@ -6,9 +6,143 @@ Version: 6.1.0
 Modified by z4kky - https://github.com/z4kkyy
 """
 
+from typing import Iterable, Optional
 
 import aiosqlite
 
+# applied to every connection: WAL lets readers run while a write commits, and with WAL a
+# NORMAL synchronous level only syncs at checkpoints while staying safe against corruption
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16384",  # 16 MiB
+    "PRAGMA mmap_size=268435456",  # 256 MiB
+)
+
+# the version stored in PRAGMA user_version once the migrations below have run
+SCHEMA_VERSION = 2
+
+
+async def connect(path: str) -> aiosqlite.Connection:
+    """
+    Opens the database with the pragmas above.
+
+    :param path: The path of the database file.
+    """
+    connection = await aiosqlite.connect(path)
+    for pragma in PRAGMAS:
+        await connection.execute(pragma)
+    return connection
+
+
+async def _migrate_warns_key(connection: aiosqlite.Connection) -> None:
+    """
+    Version 1: the warns table gets its (server_id, user_id, id) key. Duplicated ids, which the
+    previous read-then-insert could allocate, are given new ids after the last one of the user.
+    """
+    rows = await connection.execute("PRAGMA table_info(warns)")
+    async with rows as cursor:
+        columns = await cursor.fetchall()
+    if not columns or any(column[5] for column in columns):  # no table yet, or it already has a key
+        return
+    await connection.execute("ALTER TABLE warns RENAME TO warns_v0")
+    await connection.execute(
+        """
+        CREATE TABLE warns (
+          `id` int(11) NOT NULL,
+          `user_id` varchar(20) NOT NULL,
+          `server_id` varchar(20) NOT NULL,
+          `moderator_id` varchar(20) NOT NULL,
+          `reason` varchar(255) NOT NULL,
+          `created_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+          PRIMARY KEY (`server_id`, `user_id`, `id`)
+        ) WITHOUT ROWID
+        """
+    )
+    await connection.execute(
+        "INSERT OR IGNORE INTO warns(id, user_id, server_id, moderator_id, reason, created_at) "
+        "SELECT id, user_id, server_id, moderator_id, reason, created_at FROM warns_v0 ORDER BY rowid"
+    )
+    # the rows that lost to an earlier row with the same id
+    rows = await connection.execute(
+        """
+        SELECT user_id, server_id, moderator_id, reason, created_at FROM warns_v0 AS old
+        WHERE rowid > (SELECT MIN(rowid) FROM warns_v0
+                       WHERE user_id=old.user_id AND server_id=old.server_id AND id=old.id)
+        ORDER BY rowid
+        """
+    )
+    async with rows as cursor:
+        duplicates = await cursor.fetchall()
+    for user_id, server_id, moderator_id, reason, created_at in duplicates:
+        await connection.execute(
+            "INSERT INTO warns(id, user_id, server_id, moderator_id, reason, created_at) "
+            "SELECT COALESCE(MAX(id), 0) + 1, ?, ?, ?, ?, ? FROM warns WHERE server_id=? AND user_id=?",
+            (user_id, server_id, moderator_id, reason, created_at, server_id, user_id),
+        )
+    await connection.execute("DROP TABLE warns_v0")
+
+
+async def _migrate_query_history_speaker(connection: aiosqlite.Connection) -> None:
+    """
+    Version 2: the speaker of the query history becomes optional, for the English messages and the
+    audio files, and the frequent phrases index only covers the rows with a speaker. The index is
+    dropped with the old table and created again by schema.sql.
+    """
+    rows = await connection.execute("PRAGMA table_info(query_history)")
+    async with rows as cursor:
+        columns = {column[1]: column for column in await cursor.fetchall()}
+    if "speaker_id" not in columns or not columns["speaker_id"][3]:  # no table yet, or already optional
+        return
+    await connection.execute("ALTER TABLE query_history RENAME TO query_history_v1")
+    await connection.execute(
+        """
+        CREATE TABLE query_history (
+          `id` integer PRIMARY KEY,
+          `guild_id` varchar(20) NOT NULL,
+          `author_id` varchar(20),
+          `speaker_id` int(11),
+          `text` text NOT NULL,
+          `cache_hit` boolean NOT NULL,
+          `synthesis_ms` real,
+          `created_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    await connection.execute("INSERT INTO query_history SELECT * FROM query_history_v1")
+    await connection.execute("DROP TABLE query_history_v1")
+
+
+MIGRATIONS = (_migrate_warns_key, _migrate_query_history_speaker)
+
+
+async def init_database(connection: aiosqlite.Connection, schema: str) -> None:
+    """
+    Migrates an existing database to the current schema, then creates what is missing.
+    Every migration runs in its own transaction, so an interrupted one is run again at the next startup.
+
+    :param connection: The connection to the database.
+    :param schema: The content of schema.sql.
+    """
+    rows = await connection.execute("PRAGMA user_version")
+    async with rows as cursor:
+        (version,) = await cursor.fetchone()
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        await connection.execute("BEGIN")
+        try:
+            await migration(connection)
+            await connection.execute(f"PRAGMA user_version={number}")
+            await connection.commit()
+        except BaseException:
+            await connection.rollback()
+            raise
+    await connection.executescript(schema)
+    await connection.commit()
+    # keep the query planner statistics fresh for the indexes
+    await connection.execute("PRAGMA optimize")
+
 
 class DatabaseManager:
     def __init__(self, *, connection: aiosqlite.Connection) -> None:
@@ -20,31 +154,29 @@ class DatabaseManager:
         """
         This function will add a warn to the database.
 
+        The id is allocated by the INSERT itself, from the key of the table, so concurrent warns
+        of the same user never share an id.
+
         :param user_id: The ID of the user that should be warned.
         :param reason: The reason why the user should be warned.
         """
         rows = await self.connection.execute(
-            "SELECT id FROM warns WHERE user_id=? AND server_id=? ORDER BY id DESC LIMIT 1",
+            "INSERT INTO warns(id, user_id, server_id, moderator_id, reason) "
+            "SELECT COALESCE(MAX(id), 0) + 1, ?, ?, ?, ? FROM warns WHERE server_id=? AND user_id=? "
+            "RETURNING id",
             (
                 user_id,
                 server_id,
+                moderator_id,
+                reason,
+                server_id,
+                user_id,
             ),
         )
         async with rows as cursor:
             result = await cursor.fetchone()
-            warn_id = result[0] + 1 if result is not None else 1
-            await self.connection.execute(
-                "INSERT INTO warns(id, user_id, server_id, moderator_id, reason) VALUES (?, ?, ?, ?, ?)",
-                (
-                    warn_id,
-                    user_id,
-                    server_id,
-                    moderator_id,
-                    reason,
-                ),
-            )
-            await self.connection.commit()
-            return warn_id
+        await self.connection.commit()
+        return result[0]
 
     async def remove_warn(self, warn_id: int, user_id: int, server_id: int) -> int:
         """
@@ -55,24 +187,25 @@ class DatabaseManager:
         :param server_id: The ID of the server where the user has been warned
         """
         await self.connection.execute(
-            "DELETE FROM warns WHERE id=? AND user_id=? AND server_id=?",
+            "DELETE FROM warns WHERE server_id=? AND user_id=? AND id=?",
             (
-                warn_id,
-                user_id,
                 server_id,
+                user_id,
+                warn_id,
             ),
         )
-        await self.connection.commit()
+        # counted in the same transaction as the delete, from the key of the table
         rows = await self.connection.execute(
-            "SELECT COUNT(*) FROM warns WHERE user_id=? AND server_id=?",
+            "SELECT COUNT(*) FROM warns WHERE server_id=? AND user_id=?",
             (
-                user_id,
                 server_id,
+                user_id,
             ),
         )
         async with rows as cursor:
             result = await cursor.fetchone()
-            return result[0] if result is not None else 0
+        await self.connection.commit()
+        return result[0] if result is not None else 0
 
     async def get_warnings(self, user_id: int, server_id: int) -> list:
         """
@@ -83,10 +216,11 @@ class DatabaseManager:
         :return: A list of all the warnings of the user.
         """
         rows = await self.connection.execute(
-            "SELECT user_id, server_id, moderator_id, reason, strftime('%s', created_at), id FROM warns WHERE user_id=? AND server_id=?",
+            "SELECT user_id, server_id, moderator_id, reason, strftime('%s', created_at), id FROM warns "
+            "WHERE server_id=? AND user_id=? ORDER BY id",
             (
-                user_id,
                 server_id,
+                user_id,
             ),
         )
         async with rows as cursor:
@@ -95,3 +229,99 @@ class DatabaseManager:
             for row in result:
                 result_list.append(row)
             return result_list
+
+    async def get_guild_settings(self, guild_id: Optional[int] = None) -> list:
+        """
+        This function will get the saved settings of a guild, or of every guild.
+
+        :param guild_id: The ID of the guild, or None for every guild.
+        :return: A list of (guild_id, speaker_id, speaker_name, text_channel_id, voice_channel_id,
+            speed, pitch, intonation, volume) rows.
+        """
+        query = (
+            "SELECT guild_id, speaker_id, speaker_name, text_channel_id, voice_channel_id, "
+            "speed, pitch, intonation, volume FROM guild_settings"
+        )
+        if guild_id is None:
+            rows = await self.connection.execute(query)
+        else:
+            rows = await self.connection.execute(query + " WHERE guild_id=?", (guild_id,))
+        async with rows as cursor:
+            return list(await cursor.fetchall())
+
+    async def save_guild_settings(self, settings: Iterable[tuple]) -> None:
+        """
+        This function will insert or update the settings of several guilds in one transaction.
+
+        :param settings: (guild_id, speaker_id, speaker_name, text_channel_id, voice_channel_id,
+            speed, pitch, intonation, volume) rows.
+        """
+        await self.connection.executemany(
+            """
+            INSERT INTO guild_settings(guild_id, speaker_id, speaker_name, text_channel_id, voice_channel_id,
+                                       speed, pitch, intonation, volume)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(guild_id) DO UPDATE SET
+                speaker_id=excluded.speaker_id,
+                speaker_name=excluded.speaker_name,
+                text_channel_id=excluded.text_channel_id,
+                voice_channel_id=excluded.voice_channel_id,
+                speed=excluded.speed,
+                pitch=excluded.pitch,
+                intonation=excluded.intonation,
+                volume=excluded.volume,
+                updated_at=CURRENT_TIMESTAMP
+            """,
+            settings,
+        )
+        await self.connection.commit()
+
+    async def add_queries(self, queries: Iterable[tuple]) -> None:
+        """
+        This function will add several read out texts to the query history in one transaction.
+
+        :param queries: (guild_id, author_id, speaker_id, text, cache_hit, synthesis_ms) rows.
+        """
+        await self.connection.executemany(
+            "INSERT INTO query_history(guild_id, author_id, speaker_id, text, cache_hit, synthesis_ms) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            queries,
+        )
+        await self.connection.commit()
+
+    async def get_frequent_queries(self, guild_id: int, days: float, limit: int, min_count: int = 2) -> list:
+        """
+        This function will get the texts read out most often in a guild recently with VOICEVOX.
+
+        :param guild_id: The ID of the guild.
+        :param days: How many days of history to count.
+        :param limit: The maximum number of texts.
+        :param min_count: How many times a text must have been read out.
+        :return: A list of (text, count) rows, most frequent first.
+        """
+        rows = await self.connection.execute(
+            "SELECT text, COUNT(*) AS count FROM query_history "
+            "WHERE guild_id=? AND speaker_id IS NOT NULL AND created_at >= datetime('now', ?) "
+            "GROUP BY text HAVING count >= ? ORDER BY count DESC LIMIT ?",
+            (
+                guild_id,
+                f"-{days} days",
+                min_count,
+                limit,
+            ),
+        )
+        async with rows as cursor:
+            return list(await cursor.fetchall())
+
+    async def prune_queries(self, days: float) -> int:
+        """
+        This function will remove the query history older than the given number of days.
+
+        :param days: How many days of history to keep.
+        :return: The number of removed rows.
+        """
+        cursor = await self.connection.execute(
+            "DELETE FROM query_history WHERE created_at < datetime('now', ?)", (f"-{days} days",)
+        )
+        await self.connection.commit()
+        return cursor.rowcount
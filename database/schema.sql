@@ -1,8 +1,40 @@
+-- the warns of a user are numbered per server; the key also serves every lookup of warns
 CREATE TABLE IF NOT EXISTS `warns` (
   `id` int(11) NOT NULL,
   `user_id` varchar(20) NOT NULL,
   `server_id` varchar(20) NOT NULL,
   `moderator_id` varchar(20) NOT NULL,
   `reason` varchar(255) NOT NULL,
+  `created_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`server_id`, `user_id`, `id`)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS `guild_settings` (
+  `guild_id` varchar(20) NOT NULL PRIMARY KEY,
+  `speaker_id` int(11),
+  `speaker_name` varchar(255),
+  `text_channel_id` varchar(20),
+  `voice_channel_id` varchar(20),
+  `speed` real NOT NULL DEFAULT 1.0,
+  `pitch` real NOT NULL DEFAULT 0.0,
+  `intonation` real NOT NULL DEFAULT 1.0,
+  `volume` real NOT NULL DEFAULT 1.0,
+  `updated_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS `query_history` (
+  `id` integer PRIMARY KEY,
+  `guild_id` varchar(20) NOT NULL,
+  `author_id` varchar(20),
+  `speaker_id` int(11),
+  `text` text NOT NULL,
+  `cache_hit` boolean NOT NULL,
+  `synthesis_ms` real,
   `created_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP
-);
\ No newline at end of file
+);
+
+-- covers the frequent phrases of a guild (see get_frequent_queries); the rows without a speaker
+-- (English messages, audio files) are never synthesized by VOICEVOX, so they are left out
+CREATE INDEX IF NOT EXISTS `query_history_guild_text`
+  ON `query_history` (`guild_id`, `text`, `created_at`, `speaker_id`) WHERE `speaker_id` IS NOT NULL;
+CREATE INDEX IF NOT EXISTS `query_history_created_at` ON `query_history` (`created_at`);
\ No newline at end of file
@@ -0,0 +1,158 @@
+"""
+Copyright © Krypton 2019-2023 - https://github.com/kkrypt0nn (https://krypton.ninja)
+
+Version: 6.1.0
+
+Modified by z4kky - https://github.com/z4kkyy
+"""
+
+import json
+import logging
+import math
+import multiprocessing
+import os
+import sys
+import time
+import urllib.request
+from typing import List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+GATEWAY_URL = "https://discord.com/api/v10/gateway/bot"
+# Discord allows max_concurrency shards to identify every 5 seconds
+IDENTIFY_INTERVAL = 5.0
+
+logger = logging.getLogger("launcher")
+
+
+def gateway_info(token: str) -> Tuple[int, int]:
+    """
+    Returns the number of shards recommended by Discord and how many of them may identify at once.
+
+    :param token: The token of the bot.
+    """
+    request = urllib.request.Request(
+        GATEWAY_URL, headers={"Authorization": f"Bot {token}", "User-Agent": "DiscordBot (launcher.py)"}
+    )
+    with urllib.request.urlopen(request, timeout=10) as response:
+        data = json.load(response)
+    return data["shards"], data["session_start_limit"]["max_concurrency"]
+
+
+def shard_ranges(shard_count: int, processes: int) -> List[List[int]]:
+    """
+    Splits the shards into contiguous ranges of nearly equal size, one per process.
+
+    :param shard_count: The total number of shards.
+    :param processes: The number of processes.
+    """
+    processes = max(1, min(processes, shard_count))
+    size, extra = divmod(shard_count, processes)
+    ranges = []
+    start = 0
+    for index in range(processes):
+        end = start + size + (index < extra)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+def run_cluster(cluster_id: int, shard_ids: List[int], shard_count: int) -> None:
+    """
+    The entry point of a cluster process: runs the bot over its range of shards.
+    """
+    import bot
+
+    bot.setup_logging(f"discord-{cluster_id}.log")
+    load_dotenv()
+    bot.logger.info(f"Cluster {cluster_id}: shards {shard_ids[0]}-{shard_ids[-1]} of {shard_count}")
+    bot.create_bot(cluster_id=cluster_id, shard_ids=shard_ids, shard_count=shard_count).run(os.getenv("TOKEN"))
+
+
+class Launcher:
+    """
+    Starts one process per range of shards and restarts the processes that exit.
+
+    :param shard_count: The total number of shards.
+    :param processes: How many processes share them.
+    :param max_concurrency: How many shards may identify at once.
+    :param restart_delay: Seconds to wait before restarting a process that exited.
+    """
+
+    def __init__(self, shard_count: int, processes: int, max_concurrency: int = 1, restart_delay: float = 10.0) -> None:
+        self.shard_count = shard_count
+        self.clusters = shard_ranges(shard_count, processes)
+        self.max_concurrency = max(1, max_concurrency)
+        self.restart_delay = restart_delay
+        # spawn: every cluster starts from a clean interpreter, with its own event loop and voice threads
+        self.context = multiprocessing.get_context("spawn")
+        self.processes = {}  # cluster id -> Process
+
+    def _start(self, cluster_id: int) -> None:
+        process = self.context.Process(
+            target=run_cluster,
+            args=(cluster_id, self.clusters[cluster_id], self.shard_count),
+            name=f"cluster-{cluster_id}",
+        )
+        process.start()
+        self.processes[cluster_id] = process
+        logger.info(f"Started cluster {cluster_id} (pid {process.pid}) with shards {self.clusters[cluster_id]}")
+
+    def _identify_delay(self, cluster_id: int) -> float:
+        # the shards of a cluster identify one bucket of max_concurrency after another
+        return IDENTIFY_INTERVAL * math.ceil(len(self.clusters[cluster_id]) / self.max_concurrency)
+
+    def run(self) -> None:
+        for cluster_id in range(len(self.clusters)):
+            self._start(cluster_id)
+            if cluster_id < len(self.clusters) - 1:
+                time.sleep(self._identify_delay(cluster_id))
+        try:
+            self._supervise()
+        except KeyboardInterrupt:
+            logger.info("Stopping the clusters")
+        finally:
+            self.stop()
+
+    def _supervise(self) -> None:
+        exited = {}  # cluster id -> when it exited
+        while True:
+            time.sleep(1.0)
+            for cluster_id, process in self.processes.items():
+                if process.is_alive() or cluster_id in exited:
+                    continue
+                logger.warning(f"Cluster {cluster_id} (pid {process.pid}) exited with code {process.exitcode}")
+                exited[cluster_id] = time.monotonic()
+            for cluster_id, since in list(exited.items()):
+                if time.monotonic() - since >= self.restart_delay:
+                    del exited[cluster_id]
+                    self._start(cluster_id)
+
+    def stop(self) -> None:
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in self.processes.values():
+            process.join(timeout=10)
+
+
+def main(shard_count: Optional[int] = None) -> None:
+    logging.basicConfig(level=logging.INFO, format="[{asctime}] [{levelname:<8}] {name}: {message}", style="{")
+    load_dotenv()
+    with open(f"{os.path.realpath(os.path.dirname(__file__))}/config.json") as file:
+        sharding = json.load(file).get("sharding", {})
+
+    recommended, max_concurrency = gateway_info(os.getenv("TOKEN"))
+    shard_count = shard_count or sharding.get("shard_count") or recommended
+    processes = sharding.get("processes", 1)
+    logger.info(f"Running {shard_count} shards over {min(processes, shard_count)} processes")
+    Launcher(
+        shard_count,
+        processes,
+        max_concurrency=max_concurrency,
+        restart_delay=sharding.get("restart_delay", 10.0),
+    ).run()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else None)
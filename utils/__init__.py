@@ -0,0 +1,73 @@
+""""
+Copyright © Krypton 2019-2023 - https://github.com/kkrypt0nn (https://krypton.ninja)
+
+Version: 6.1.0
+
+Modified by z4kky - https://github.com/z4kkyy
+"""
+
+from .audio import FirstFrameAudio, PCMBytesAudio
+from .audio_cache import AudioCache
+from .clips import ClipStore, OpusClip, OpusClipAudio
+from .english_tts import BACKENDS as ENGLISH_TTS_BACKENDS
+from .english_tts import EnglishSpeech, EnglishTTSBackend, EspeakBackend, GTTSBackend, SilentBackend
+from .executor import SynthesisExecutor
+from .guild_settings import GuildSettings, GuildSettingsStore
+from .history import QueryHistory
+from .metrics import Metrics, MetricsServer
+from .models import WARMUP_TEXT, ModelManager
+from .playback import PlaybackQueue, SpeechJob
+from .query_cache import AudioQueryCache, staged_synthesis
+from .remote_engine import RemoteEngine, RemoteEngineUnavailable
+from .scheduler import FairScheduler
+from .session import GuildSession, SessionRegistry
+from .settings import CustomSettings, CustomSettingStore
+from .speech_rate import AdaptiveSpeechRate, VoiceParams, apply_speed, apply_voice
+from .startup import StartupTimer
+from .text import clean_text, is_english, remove_mentions, split_sentences, to_reading
+from .worker_pool import SynthesisWorkerPool
+
+__all__ = [
+    "AdaptiveSpeechRate",
+    "AudioCache",
+    "AudioQueryCache",
+    "ClipStore",
+    "CustomSettings",
+    "CustomSettingStore",
+    "ENGLISH_TTS_BACKENDS",
+    "EnglishSpeech",
+    "EnglishTTSBackend",
+    "EspeakBackend",
+    "FairScheduler",
+    "FirstFrameAudio",
+    "GTTSBackend",
+    "GuildSession",
+    "GuildSettings",
+    "GuildSettingsStore",
+    "Metrics",
+    "MetricsServer",
+    "ModelManager",
+    "OpusClip",
+    "OpusClipAudio",
+    "PCMBytesAudio",
+    "PlaybackQueue",
+    "QueryHistory",
+    "RemoteEngine",
+    "RemoteEngineUnavailable",
+    "SessionRegistry",
+    "SilentBackend",
+    "SpeechJob",
+    "StartupTimer",
+    "SynthesisExecutor",
+    "SynthesisWorkerPool",
+    "VoiceParams",
+    "WARMUP_TEXT",
+    "apply_speed",
+    "apply_voice",
+    "clean_text",
+    "is_english",
+    "remove_mentions",
+    "split_sentences",
+    "staged_synthesis",
+    "to_reading",
+]
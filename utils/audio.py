@@ -0,0 +1,108 @@
+"""
+Copyright © Krypton 2019-2023 - https://github.com/kkrypt0nn (https://krypton.ninja)
+
+Version: 6.1.0
+
+Modified by z4kky - https://github.com/z4kkyy
+"""
+
+import io
+import wave
+
+import discord
+import numpy as np
+from discord.opus import Encoder as OpusEncoder
+
+# discord.py expects 48 kHz, 16-bit, stereo PCM in frames of 20 ms
+SAMPLING_RATE = OpusEncoder.SAMPLING_RATE
+CHANNELS = OpusEncoder.CHANNELS
+FRAME_SIZE = OpusEncoder.FRAME_SIZE
+
+
+def wav_to_pcm(data: bytes) -> bytes:
+    """
+    Converts 16-bit WAV bytes (VOICEVOX outputs 24 kHz mono) to the 48 kHz stereo s16le PCM
+    that discord.py sends, padded to a whole number of frames.
+
+    :param data: The WAV bytes.
+    """
+    with wave.open(io.BytesIO(data), "rb") as wav:
+        if wav.getsampwidth() != 2:
+            raise ValueError(f"Unsupported sample width: {wav.getsampwidth() * 8} bits")
+        rate = wav.getframerate()
+        channels = wav.getnchannels()
+        samples = np.frombuffer(wav.readframes(wav.getnframes()), dtype="<i2").reshape(-1, channels)
+
+    if rate != SAMPLING_RATE and len(samples) > 0:
+        # vectorized linear interpolation, one column per channel
+        length = len(samples) * SAMPLING_RATE // rate
+        positions = np.arange(length) * (rate / SAMPLING_RATE)
+        source_positions = np.arange(len(samples))
+        samples = np.column_stack([
+            np.interp(positions, source_positions, samples[:, channel]) for channel in range(channels)
+        ])
+        samples = np.clip(np.rint(samples), -32768, 32767).astype("<i2")
+
+    if channels == 1:
+        samples = np.repeat(samples, CHANNELS, axis=1)
+    elif channels != CHANNELS:
+        samples = samples[:, :CHANNELS]
+
+    pcm = np.ascontiguousarray(samples, dtype="<i2").tobytes()
+    remainder = len(pcm) % FRAME_SIZE
+    if remainder:
+        pcm += b"\x00" * (FRAME_SIZE - remainder)
+    return pcm
+
+
+class PCMBytesAudio(discord.AudioSource):
+    """
+    Plays synthesized WAV bytes straight from memory, without a temporary file or an ffmpeg process.
+
+    :param data: The WAV bytes to play.
+    """
+
+    def __init__(self, data: bytes) -> None:
+        self._buffer = memoryview(wav_to_pcm(data))
+        self._offset = 0
+
+    def read(self) -> bytes:
+        frame = self._buffer[self._offset:self._offset + FRAME_SIZE]
+        if len(frame) < FRAME_SIZE:
+            return b""
+        self._offset += FRAME_SIZE
+        # the buffer is sliced without copying; the opus encoder needs a bytes object per frame
+        return frame.tobytes()
+
+    def is_opus(self) -> bool:
+        return False
+
+    def cleanup(self) -> None:
+        self._buffer = memoryview(b"")
+
+
+class FirstFrameAudio(discord.AudioSource):
+    """
+    Wraps an audio source and calls ``on_first_frame`` when the voice client reads its first frame.
+    The callback runs on the voice thread.
+
+    :param source: The audio source to play.
+    :param on_first_frame: The function to call.
+    """
+
+    def __init__(self, source: discord.AudioSource, on_first_frame) -> None:
+        self.source = source
+        self.on_first_frame = on_first_frame
+
+    def read(self) -> bytes:
+        frame = self.source.read()
+        if frame and self.on_first_frame is not None:
+            on_first_frame, self.on_first_frame = self.on_first_frame, None
+            on_first_frame()
+        return frame
+
+    def is_opus(self) -> bool:
+        return self.source.is_opus()
+
+    def cleanup(self) -> None:
+        self.source.cleanup()
@@ -0,0 +1,195 @@
+"""
+Copyright © Krypton 2019-2023 - https://github.com/kkrypt0nn (https://krypton.ninja)
+
+Version: 6.1.0
+
+Modified by z4kky - https://github.com/z4kkyy
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+
+
+class AudioCache:
+    """
+    A two-tier cache of synthesized audio: an in-memory LRU with a byte budget in front of an
+    on-disk store with size-based eviction.
+
+    Entries are content-addressed by ``make_key``. All methods are thread-safe; the disk tier does
+    blocking I/O, so ``get`` and ``put`` should be called off the event loop. ``get_memory`` only
+    touches memory and is safe to call on the loop.
+    """
+
+    def __init__(
+        self, memory_budget: int = 64 * 1024 * 1024, disk_dir: Optional[str] = None, disk_budget: int = 512 * 1024 * 1024
+    ) -> None:
+        self.memory_budget = memory_budget
+        self.disk_dir = disk_dir
+        self.disk_budget = disk_budget
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = OrderedDict()  # key -> size, least recently used first
+        self._disk_bytes = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.memory_evictions = 0
+        self.disk_evictions = 0
+
+        if disk_dir is not None:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._scan_disk()
+
+    @staticmethod
+    def make_key(text: str, speaker, version: str) -> str:
+        """
+        Returns the cache key of an utterance.
+
+        :param text: The text that is synthesized. Width and whitespace variants share a key.
+        :param speaker: The speaker ID (or any other voice identifier).
+        :param version: The engine/model version, so that upgrades do not serve stale audio.
+        """
+        normalized = re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+        return hashlib.sha256(f"{version}\0{speaker}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], key + ".wav")
+
+    def _scan_disk(self) -> None:
+        entries = []
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                if name.endswith(".wav"):
+                    stat = os.stat(os.path.join(root, name))
+                    entries.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+        self._evict_disk()
+
+    def get_memory(self, key: str) -> Optional[bytes]:
+        """
+        Looks the key up in the memory tier only. Does not count a miss.
+        """
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+            return data
+
+    def contains(self, key: str) -> bool:
+        """
+        Returns whether the key is in either tier, without counting a hit or a miss.
+        """
+        with self._lock:
+            return key in self._memory or key in self._disk
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Looks the key up in both tiers. Disk hits are promoted to memory.
+        """
+        data = self.get_memory(key)
+        if data is not None:
+            return data
+        if self.disk_dir is not None:
+            with self._lock:
+                on_disk = key in self._disk
+            if on_disk:
+                try:
+                    with open(self._path(key), "rb") as file:
+                        data = file.read()
+                    os.utime(self._path(key))
+                except OSError:
+                    # removed behind our back (e.g. by another process sharing the directory), so put can write it again
+                    data = None
+                    with self._lock:
+                        size = self._disk.pop(key, None)
+                        if size is not None:
+                            self._disk_bytes -= size
+            if data is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                    if key in self._disk:
+                        self._disk.move_to_end(key)
+                self._put_memory(key, data)
+                return data
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, data: bytes) -> None:
+        """
+        Stores the audio in both tiers.
+        """
+        self._put_memory(key, data)
+        if self.disk_dir is None or len(data) > self.disk_budget:
+            return
+        with self._lock:
+            if key in self._disk:
+                return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first so that readers never see a partial entry
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix=".tmp", delete=False) as file:
+            file.write(data)
+        os.replace(file.name, path)
+        with self._lock:
+            # another thread may have written the same entry meanwhile
+            if key in self._disk:
+                return
+            self._disk[key] = len(data)
+            self._disk_bytes += len(data)
+            self._evict_disk()
+
+    def _put_memory(self, key: str, data: bytes) -> None:
+        if len(data) > self.memory_budget:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return
+            self._memory[key] = data
+            self._memory_bytes += len(data)
+            while self._memory_bytes > self.memory_budget:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+                self.memory_evictions += 1
+
+    def _evict_disk(self) -> None:
+        # must be called with the lock held
+        while self._disk_bytes > self.disk_budget:
+            key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            self.disk_evictions += 1
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        """
+        Returns the hit/miss/eviction counters and the current size of both tiers.
+        """
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "memory_evictions": self.memory_evictions,
+                "disk_evictions": self.disk_evictions,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+            }
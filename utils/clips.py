@@ -0,0 +1,418 @@
+"""
+Copyright © Krypton 2019-2023 - https://github.com/kkrypt0nn (https://krypton.ninja)
+
+Version: 6.1.0
+
+Modified by z4kky - https://github.com/z4kkyy
+"""
+
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import subprocess
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Tuple
+
+import discord
+from discord.opus import Encoder as OpusEncoder
+from discord.opus import OpusNotLoaded
+
+from .audio import CHANNELS, FRAME_SIZE, SAMPLING_RATE, wav_to_pcm
+
+# a clip is a sequence of 20 ms Opus packets, each prefixed with its length
+_LENGTH = struct.Struct("<H")
+
+
+def _index(buffer) -> List[Tuple[int, int]]:
+    packets = []
+    offset = 0
+    while offset + _LENGTH.size <= len(buffer):
+        (length,) = _LENGTH.unpack_from(buffer, offset)
+        offset += _LENGTH.size
+        packets.append((offset, offset + length))
+        offset += length
+    return packets
+
+
+class OpusClip:
+    """
+    Pre-encoded audio: the Opus packets of every 20 ms frame, in a bytes buffer or a memory-mapped file.
+    Clips are immutable and can be played by several guilds at once.
+
+    A mapping holds a file descriptor until ``close`` is called; it is closed once the last
+    OpusClipAudio playing it is cleaned up.
+    """
+
+    __slots__ = ("buffer", "packets", "_lock", "_readers", "_closing")
+
+    def __init__(self, buffer) -> None:
+        self.buffer = buffer
+        self.packets = _index(buffer)
+        self._lock = threading.Lock()
+        self._readers = 0
+        self._closing = False
+
+    @classmethod
+    def from_packets(cls, packets: Iterable[bytes]) -> "OpusClip":
+        return cls(b"".join(_LENGTH.pack(len(packet)) + packet for packet in packets))
+
+    @classmethod
+    def from_file(cls, path: str, map_threshold: int = 0) -> "OpusClip":
+        """
+        Reads a clip written by ``ClipStore``. Clips larger than ``map_threshold`` bytes are memory-mapped:
+        their pages are shared with the OS page cache, not held on the heap.
+        """
+        with open(path, "rb") as file:
+            if os.fstat(file.fileno()).st_size <= map_threshold:
+                return cls(file.read())
+            # the mapping stays valid after the file is closed (or removed)
+            return cls(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    @property
+    def size(self) -> int:
+        return len(self.buffer)
+
+    @property
+    def mapped(self) -> bool:
+        return isinstance(self.buffer, mmap.mmap)
+
+    @property
+    def closed(self) -> bool:
+        return self.mapped and self.buffer.closed
+
+    def acquire(self) -> None:
+        with self._lock:
+            self._readers += 1
+
+    def release(self) -> None:
+        with self._lock:
+            self._readers -= 1
+            if self._closing and self._readers == 0:
+                self.buffer.close()
+
+    def close(self) -> None:
+        """
+        Closes the mapping of the clip, as soon as nothing plays it anymore.
+        """
+        with self._lock:
+            if not self.mapped or self._closing:
+                return
+            self._closing = True
+            if self._readers == 0:
+                self.buffer.close()
+
+    def __len__(self) -> int:
+        return len(self.packets)
+
+    def packet(self, index: int) -> bytes:
+        start, end = self.packets[index]
+        return bytes(self.buffer[start:end])
+
+
+class OpusClipAudio(discord.AudioSource):
+    """
+    Plays an OpusClip. The packets are sent as they are, so playback needs neither ffmpeg nor libopus.
+
+    :param clip: The clip to play.
+    """
+
+    def __init__(self, clip: OpusClip) -> None:
+        self.clip = clip
+        self._index = 0
+        self._released = False
+        clip.acquire()
+
+    def read(self) -> bytes:
+        if self._index >= len(self.clip) or self.clip.closed:
+            return b""
+        packet = self.clip.packet(self._index)
+        self._index += 1
+        return packet
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self) -> None:
+        # the clip is shared, only this playback ends
+        self._index = len(self.clip)
+        if not self._released:
+            self._released = True
+            self.clip.release()
+
+
+def encode_pcm(pcm: bytes) -> List[bytes]:
+    """
+    Encodes 48 kHz stereo s16le PCM into Opus packets of 20 ms, with the settings of discord.py's voice client.
+
+    :raises discord.opus.OpusNotLoaded: If libopus is not available.
+    """
+    encoder = OpusEncoder()
+    remainder = len(pcm) % FRAME_SIZE
+    if remainder:
+        pcm += b"\x00" * (FRAME_SIZE - remainder)
+    return [
+        encoder.encode(pcm[offset:offset + FRAME_SIZE], OpusEncoder.SAMPLES_PER_FRAME)
+        for offset in range(0, len(pcm), FRAME_SIZE)
+    ]
+
+
+def decode_file(path: str, command: str = "ffmpeg") -> bytes:
+    """
+    Decodes an audio file into the 48 kHz stereo s16le PCM that discord.py sends.
+
+    :raises subprocess.CalledProcessError: If ffmpeg failed.
+    """
+    return subprocess.run(
+        [command, "-loglevel", "error", "-i", path, "-vn", "-f", "s16le",
+         "-ar", str(SAMPLING_RATE), "-ac", str(CHANNELS), "pipe:1"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        check=True,
+    ).stdout
+
+
+class ClipStore:
+    """
+    Opus-encoded clips of audio that is played over and over: the audio files of custom stickers
+    and emojis, and synthesized phrases once they were rendered ``hot_threshold`` times. Each clip
+    is decoded and encoded once, so replaying it costs no ffmpeg process and no Opus encoding.
+
+    Clips are kept in memory within ``memory_budget`` bytes, or, with ``disk_dir``, written there
+    (within ``disk_budget`` bytes) and read back. Clips larger than ``map_threshold`` bytes are
+    memory-mapped instead of read; at most ``max_mapped`` mappings, and so file descriptors, are
+    kept open. Without libopus the store disables itself and the callers keep their regular path. All methods are thread-safe; ``get`` and ``hit`` only
+    touch memory and are safe to call on the event loop, the others block.
+    """
+
+    def __init__(
+        self,
+        memory_budget: int = 32 * 1024 * 1024,
+        disk_dir: Optional[str] = None,
+        disk_budget: int = 128 * 1024 * 1024,
+        hot_threshold: int = 3,
+        map_threshold: int = 256 * 1024,
+        max_mapped: int = 64,
+        max_tracked: int = 4096,
+        ffmpeg: str = "ffmpeg",
+        logger: Optional[logging.Logger] = None,
+    ) -> None:
+        self.memory_budget = memory_budget
+        self.disk_dir = disk_dir
+        self.disk_budget = disk_budget
+        self.hot_threshold = hot_threshold
+        self.map_threshold = map_threshold
+        self.max_mapped = max_mapped
+        self.max_tracked = max_tracked
+        self.ffmpeg = ffmpeg
+        self.logger = logger or logging.getLogger(__name__)
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._clips = OrderedDict()  # key -> OpusClip, least recently used first
+        self._memory_bytes = 0
+        self._mapped = 0
+        self._disk = OrderedDict()  # key -> size, least recently used first
+        self._disk_bytes = 0
+        self._plays = OrderedDict()  # key -> renders, of the phrases that are not clips yet
+        self.hits = 0
+        self.encoded = 0
+
+        if disk_dir is not None:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._scan_disk()
+
+    @staticmethod
+    def file_key(path: str) -> str:
+        """
+        Returns the key of an audio file, which changes when the file is modified.
+        """
+        stat = os.stat(path)
+        return hashlib.sha256(f"file\0{path}\0{stat.st_mtime_ns}\0{stat.st_size}".encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], key + ".opus")
+
+    def _scan_disk(self) -> None:
+        entries = []
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                if name.endswith(".opus"):
+                    stat = os.stat(os.path.join(root, name))
+                    entries.append((stat.st_mtime, name[:-5], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+        self._evict()
+
+    def get(self, key: str) -> Optional[OpusClip]:
+        """
+        Returns the clip if it is in memory or already mapped.
+        """
+        with self._lock:
+            clip = self._clips.get(key)
+            if clip is not None:
+                self._clips.move_to_end(key)
+                self.hits += 1
+            return clip
+
+    def on_disk(self, key: str) -> bool:
+        with self._lock:
+            return key in self._disk
+
+    def load(self, key: str) -> Optional[OpusClip]:
+        """
+        Returns the clip, mapping it from the disk if needed.
+        """
+        clip = self.get(key)
+        if clip is not None or self.disk_dir is None or not self.on_disk(key):
+            return clip
+        try:
+            clip = OpusClip.from_file(self._path(key), self.map_threshold)
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            self.hits += 1
+            if key in self._disk:
+                self._disk.move_to_end(key)
+            return self._add(key, clip)
+
+    def hit(self, key: str) -> bool:
+        """
+        Counts a render of a synthesized phrase. Returns True once, when the phrase becomes hot
+        and should be encoded (see ``encode_wav``).
+        """
+        if not self.enabled:
+            return False
+        with self._lock:
+            if key in self._clips or key in self._disk:
+                return False
+            plays = self._plays.pop(key, 0) + 1
+            if plays >= self.hot_threshold:
+                return True
+            self._plays[key] = plays
+            if len(self._plays) > self.max_tracked:
+                self._plays.popitem(last=False)
+            return False
+
+    def encode_wav(self, key: str, data: bytes) -> Optional[OpusClip]:
+        """
+        Encodes synthesized WAV bytes into a clip.
+        """
+        return self._encode(key, lambda: wav_to_pcm(data))
+
+    def encode_file(self, path: str) -> Optional[OpusClip]:
+        """
+        Returns the clip of an audio file, decoding and encoding it the first time (or after it changed).
+        """
+        try:
+            key = self.file_key(path)
+        except OSError:
+            return None
+        clip = self.load(key)
+        if clip is not None:
+            return clip
+        return self._encode(key, lambda: decode_file(path, self.ffmpeg))
+
+    def _encode(self, key: str, pcm) -> Optional[OpusClip]:
+        if not self.enabled:
+            return None
+        try:
+            clip = OpusClip.from_packets(encode_pcm(pcm()))
+        except OpusNotLoaded as e:
+            # without libopus, every clip would fail the same way
+            self.enabled = False
+            self.logger.warning(f"Opus clips are disabled ({type(e).__name__}: {e}), audio is encoded on every play.")
+            return None
+        except (OSError, ValueError, subprocess.CalledProcessError) as e:
+            self.logger.error(f"Failed to encode an Opus clip: {type(e).__name__}: {e}")
+            return None
+        if not len(clip):
+            return None
+        if self.disk_dir is not None and clip.size <= self.disk_budget:
+            try:
+                clip = self._write(key, clip)
+            except (OSError, ValueError) as e:
+                # e.g. a full disk: the clip is still played from memory
+                self.logger.error(f"Failed to write an Opus clip: {type(e).__name__}: {e}")
+        with self._lock:
+            self.encoded += 1
+            return self._add(key, clip)
+
+    def _add(self, key: str, clip: OpusClip) -> OpusClip:
+        # must be called with the lock held; a clip added meanwhile by another thread wins
+        existing = self._clips.get(key)
+        if existing is not None:
+            clip.close()
+            return existing
+        self._clips[key] = clip
+        if clip.mapped:
+            self._mapped += 1
+        else:
+            self._memory_bytes += clip.size
+        self._evict()
+        return clip
+
+    def _remove(self, key: str) -> None:
+        # must be called with the lock held
+        clip = self._clips.pop(key)
+        if clip.mapped:
+            self._mapped -= 1
+            clip.close()
+        else:
+            self._memory_bytes -= clip.size
+
+    def _write(self, key: str, clip: OpusClip) -> OpusClip:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first so that readers never map a partial clip
+        file = tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix=".tmp", delete=False)
+        try:
+            with file:
+                file.write(clip.buffer)
+            os.replace(file.name, path)
+        except OSError:
+            try:
+                os.remove(file.name)
+            except OSError:
+                pass
+            raise
+        with self._lock:
+            if key not in self._disk:
+                self._disk[key] = clip.size
+                self._disk_bytes += clip.size
+        return OpusClip.from_file(path, self.map_threshold)
+
+    def _evict(self) -> None:
+        # must be called with the lock held; clips that are playing keep their buffer or mapping alive
+        for key in list(self._clips):
+            if self._memory_bytes <= self.memory_budget and self._mapped <= self.max_mapped:
+                break
+            clip = self._clips[key]
+            if (self._mapped > self.max_mapped) if clip.mapped else (self._memory_bytes > self.memory_budget):
+                self._remove(key)
+        while self._disk_bytes > self.disk_budget:
+            key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            clip = self._clips.get(key)
+            if clip is not None and clip.mapped:
+                self._remove(key)
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "encoded": self.encoded,
+                "clips": len(self._clips),
+                "memory_bytes": self._memory_bytes,
+                "mapped": self._mapped,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+            }
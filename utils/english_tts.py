@@ -0,0 +1,172 @@
+"""
+Copyright © Krypton 2019-2023 - https://github.com/kkrypt0nn (https://krypton.ninja)
+
+Version: 6.1.0
+
+Modified by z4kky - https://github.com/z4kkyy
+"""
+
+import asyncio
+import io
+import time
+import wave
+from abc import ABC, abstractmethod
+from typing import Optional, Tuple
+
+from .audio_cache import AudioCache
+
+
+class EnglishTTSBackend(ABC):
+    """
+    The interface of an English speech engine. ``synthesize`` returns the encoded audio,
+    in the container given by ``format`` ("mp3" or "wav").
+    """
+
+    name = "base"
+    format = "wav"
+
+    @abstractmethod
+    async def synthesize(self, text: str) -> bytes:
+        """
+        Returns the speech of the text, encoded in ``format``.
+        """
+
+
+class GTTSBackend(EnglishTTSBackend):
+    """
+    Google Translate's text-to-speech through gTTS. The HTTP requests of gTTS are blocking,
+    so they run on a worker thread.
+
+    :param lang: The language of the voice.
+    :param tld: The Google Translate domain, which selects the accent.
+    :param timeout: Seconds allowed for each HTTP request of gTTS.
+    """
+
+    name = "gtts"
+    format = "mp3"
+
+    def __init__(self, lang: str = "en", tld: str = "us", timeout: Optional[float] = 10.0) -> None:
+        self.lang = lang
+        self.tld = tld
+        self.timeout = timeout
+        self.name = f"gtts-{lang}-{tld}"
+
+    def _synthesize(self, text: str) -> bytes:
+        from gtts import gTTS
+
+        buffer = io.BytesIO()
+        gTTS(text=text, lang=self.lang, tld=self.tld, timeout=self.timeout).write_to_fp(buffer)
+        return buffer.getvalue()
+
+    async def synthesize(self, text: str) -> bytes:
+        return await asyncio.to_thread(self._synthesize, text)
+
+
+class EspeakBackend(EnglishTTSBackend):
+    """
+    An offline engine: the espeak-ng command line, which writes WAV to its standard output.
+    The text is written to its standard input, so a message that starts with a dash is never read as an option.
+
+    :param voice: The espeak voice.
+    :param command: The espeak executable.
+    """
+
+    format = "wav"
+
+    def __init__(self, voice: str = "en-us", command: str = "espeak-ng") -> None:
+        self.voice = voice
+        self.command = command
+        self.name = f"espeak-{voice}"
+
+    async def synthesize(self, text: str) -> bytes:
+        process = await asyncio.create_subprocess_exec(
+            self.command, "-v", self.voice, "--stdout", "--stdin",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        try:
+            data, _ = await process.communicate(text.encode("utf-8"))
+        except asyncio.CancelledError:
+            process.kill()
+            raise
+        if process.returncode != 0:
+            raise RuntimeError(f"{self.command} exited with status {process.returncode}")
+        return data
+
+
+class SilentBackend(EnglishTTSBackend):
+    """
+    A stub that returns silence, 50 ms per character, for tests and for running without network.
+    """
+
+    name = "silent"
+    format = "wav"
+
+    async def synthesize(self, text: str) -> bytes:
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(24000)
+            wav.writeframes(b"\x00\x00" * 1200 * len(text))
+        return buffer.getvalue()
+
+
+BACKENDS = {
+    "gtts": GTTSBackend,
+    "espeak": EspeakBackend,
+    "silent": SilentBackend,
+}
+
+
+class EnglishSpeech:
+    """
+    Renders English messages with a backend, off the event loop, with a timeout and a cache
+    keyed on the text. Requests to the backend are limited to ``concurrency`` at a time; they do
+    not go through the VOICEVOX scheduler, so a slow backend never holds the Japanese synthesis.
+
+    :param backend: The English engine.
+    :param cache: The audio cache to share, or None to disable caching.
+    :param timeout: Seconds to wait for the backend.
+    :param concurrency: How many requests may run at the same time.
+    """
+
+    def __init__(
+        self,
+        backend: EnglishTTSBackend,
+        cache: Optional[AudioCache] = None,
+        timeout: Optional[float] = 10.0,
+        concurrency: int = 4,
+    ) -> None:
+        self.backend = backend
+        self.cache = cache
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self._semaphore = None
+
+    async def synthesize(self, text: str) -> Tuple[bytes, Optional[float]]:
+        """
+        Returns the encoded audio of the text, in the format of the backend, with the seconds the
+        backend spent on it (None when the audio came from the cache).
+
+        :raises asyncio.TimeoutError: If the backend did not answer in time.
+        """
+        key = None
+        if self.cache is not None:
+            key = AudioCache.make_key(text, self.backend.name, f"english-{self.backend.format}")
+            data = self.cache.get_memory(key)
+            if data is None:
+                data = await asyncio.to_thread(self.cache.get, key)
+            if data is not None:
+                return data, None
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            started = time.perf_counter()
+            data = await asyncio.wait_for(self.backend.synthesize(text), self.timeout)
+            seconds = time.perf_counter() - started
+        if key is not None:
+            await asyncio.to_thread(self.cache.put, key, data)
+        return data, seconds
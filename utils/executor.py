@@ -0,0 +1,69 @@
+"""
+Copyright © Krypton 2019-2023 - https://github.com/kkrypt0nn (https://krypton.ninja)
+
+Version: 6.1.0
+
+Modified by z4kky - https://github.com/z4kkyy
+"""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+
+class SynthesisExecutor:
+    """
+    A bounded thread pool for blocking synthesis calls (VoicevoxCore inference, model loading, ...).
+
+    Jobs are awaited from the event loop, so the gateway loop never blocks on ONNX inference.
+    At most ``max_pending`` jobs are handed to the pool at once; the rest wait on the loop
+    where they can still be cancelled for free.
+    """
+
+    def __init__(
+        self, max_workers: int = 2, timeout: Optional[float] = 30.0, max_pending: Optional[int] = None
+    ) -> None:
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_pending = max_pending or max_workers * 4
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="synthesis")
+        self._slots = None
+
+    async def run(self, func: Callable[..., Any], *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        """
+        Runs a blocking function on the pool and waits for its result.
+
+        :param func: The blocking function to run.
+        :param timeout: Seconds to wait for the job, queueing included. Defaults to the executor timeout.
+        :raises asyncio.TimeoutError: If the job did not finish in time.
+        """
+        loop = asyncio.get_running_loop()
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        timeout = self.timeout if timeout is None else timeout
+        return await asyncio.wait_for(self._submit(loop, functools.partial(func, *args, **kwargs)), timeout)
+
+    async def _submit(self, loop: asyncio.AbstractEventLoop, job: Callable[[], Any]) -> Any:
+        await self._slots.acquire()
+        try:
+            future = self._pool.submit(job)
+        except BaseException:
+            self._slots.release()
+            raise
+        # a job that already started cannot be interrupted, so the slot is only given back once the thread is done
+        future.add_done_callback(lambda _: self._release(loop))
+        # cancelling the wrapper also cancels the job if it has not started yet
+        return await asyncio.wrap_future(future, loop=loop)
+
+    def _release(self, loop: asyncio.AbstractEventLoop) -> None:
+        try:
+            loop.call_soon_threadsafe(self._slots.release)
+        except RuntimeError:  # the loop is already closed
+            pass
+
+    def shutdown(self) -> None:
+        """
+        Stops the pool. Queued jobs are cancelled, running jobs are left to finish in the background.
+        """
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,145 @@
+"""
+Copyright © Krypton 2019-2023 - https://github.com/kkrypt0nn (https://krypton.ninja)
+
+Version: 6.1.0
+
+Modified by z4kky - https://github.com/z4kkyy
+"""
+
+import asyncio
+import logging
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import aiosqlite
+
+from .speech_rate import VoiceParams
+
+
+class GuildSettings(NamedTuple):
+    """
+    The saved settings of a guild: its speaker from /change, the channels of its last /join
+    (the voice channel is cleared when the bot leaves) and its voice from /voice.
+    """
+
+    speaker: Optional[Tuple[int, str]] = None
+    text_channel_id: Optional[int] = None
+    voice_channel_id: Optional[int] = None
+    voice: VoiceParams = VoiceParams()
+
+
+DEFAULT_GUILD_SETTINGS = GuildSettings()
+
+
+def _optional_int(value) -> Optional[int]:
+    return int(value) if value is not None else None
+
+
+def settings_from_row(row: tuple) -> Tuple[int, GuildSettings]:
+    guild_id, speaker_id, speaker_name, text_channel_id, voice_channel_id, speed, pitch, intonation, volume = row
+    return int(guild_id), GuildSettings(
+        speaker=(int(speaker_id), speaker_name) if speaker_id is not None else None,
+        text_channel_id=_optional_int(text_channel_id),
+        voice_channel_id=_optional_int(voice_channel_id),
+        voice=VoiceParams(speed, pitch, intonation, volume),
+    )
+
+
+def settings_to_row(guild_id: int, settings: GuildSettings) -> tuple:
+    speaker_id, speaker_name = settings.speaker if settings.speaker is not None else (None, None)
+    return (guild_id, speaker_id, speaker_name, settings.text_channel_id, settings.voice_channel_id, *settings.voice)
+
+
+class GuildSettingsStore:
+    """
+    The settings of every guild, cached in memory in front of the guild_settings table.
+
+    Reads only touch the cache, which ``load`` fills with every saved guild at startup: a guild
+    that is not cached has no saved settings. ``update`` only changes the cache and marks the
+    guild dirty; a background task writes the dirty guilds in one transaction every
+    ``flush_interval`` seconds, and ``close`` writes what is left. Without a database the
+    settings only live in memory.
+
+    :param database: The DatabaseManager of the bot, or None.
+    :param flush_interval: Seconds between two writes of the dirty guilds.
+    """
+
+    def __init__(self, database=None, flush_interval: float = 5.0, logger: Optional[logging.Logger] = None) -> None:
+        self.database = database
+        self.flush_interval = flush_interval
+        self.logger = logger or logging.getLogger(__name__)
+        self._settings: Dict[int, GuildSettings] = {}
+        self._dirty = set()
+        self._task = None
+
+    def start(self) -> None:
+        if self.database is not None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def load(self) -> Dict[int, GuildSettings]:
+        """
+        Reads the settings of every saved guild into the cache and returns them.
+        """
+        if self.database is not None:
+            try:
+                rows = await self.database.get_guild_settings()
+            except aiosqlite.Error as e:
+                self.logger.error(f"Failed to load the guild settings: {e}")
+                rows = []
+            for row in rows:
+                guild_id, settings = settings_from_row(row)
+                # changes made since the startup win over the saved ones
+                self._settings.setdefault(guild_id, settings)
+        return dict(self._settings)
+
+    def cached(self, guild_id: int) -> GuildSettings:
+        """
+        Returns the cached settings of a guild, or the defaults. Never touches the database.
+        """
+        return self._settings.get(guild_id, DEFAULT_GUILD_SETTINGS)
+
+    def update(self, guild_id: int, **changes) -> GuildSettings:
+        """
+        Changes some settings of a guild. Never blocks: the change is written by the background task.
+
+        :param guild_id: The ID of the guild.
+        :param changes: The GuildSettings fields to change.
+        """
+        settings = self._settings[guild_id] = self.cached(guild_id)._replace(**changes)
+        self._dirty.add(guild_id)
+        return settings
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self) -> None:
+        """
+        Writes the settings of the dirty guilds. Failed writes are retried on the next flush.
+        """
+        if not self._dirty or self.database is None:
+            return
+        dirty, self._dirty = self._dirty, set()
+        rows = [settings_to_row(guild_id, self._settings[guild_id]) for guild_id in dirty]
+        try:
+            await self.database.save_guild_settings(rows)
+        except aiosqlite.Error as e:
+            self.logger.error(f"Failed to save the settings of {len(rows)} guilds: {e}")
+            self._dirty |= dirty
+        except asyncio.CancelledError:
+            # cancelled by close while writing: the rows are upserted, so writing them again is safe
+            self._dirty |= dirty
+            raise
+
+    async def close(self) -> None:
+        """
+        Stops the background task and writes the pending changes.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
@@ -0,0 +1,114 @@
+"""
+Copyright © Krypton 2019-2023 - https://github.com/kkrypt0nn (https://krypton.ninja)
+
+Version: 6.1.0
+
+Modified by z4kky - https://github.com/z4kkyy
+"""
+
+import asyncio
+import logging
+from typing import Optional
+
+import aiosqlite
+
+
+class QueryHistory:
+    """
+    Records every text read out with VOICEVOX in the query_history table, from a background
+    task, so that the event loop never waits on the database.
+
+    Rows are buffered in memory and inserted in one transaction once ``batch_size`` rows are
+    pending or ``flush_interval`` seconds have passed. Without a database nothing is recorded.
+
+    :param database: The DatabaseManager of the bot, or None.
+    :param batch_size: How many rows trigger an early flush.
+    :param flush_interval: Seconds between two flushes.
+    :param max_pending: How many rows are kept while the database fails; the oldest are dropped.
+    """
+
+    def __init__(
+        self,
+        database=None,
+        batch_size: int = 50,
+        flush_interval: float = 5.0,
+        max_pending: int = 10000,
+        logger: Optional[logging.Logger] = None,
+    ) -> None:
+        self.database = database
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.logger = logger or logging.getLogger(__name__)
+        self._buffer = []
+        self._wakeup = None
+        self._task = None
+        self._closing = False
+
+    def start(self) -> None:
+        if self.database is None:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+    def record(
+        self,
+        guild_id: int,
+        author_id: Optional[int],
+        speaker: Optional[int],
+        text: str,
+        cache_hit: bool,
+        synthesis_seconds: Optional[float] = None,
+    ) -> None:
+        """
+        Queues a row. Never blocks.
+
+        :param guild_id: The ID of the guild the text was read out in.
+        :param author_id: The ID of the author of the message, if known.
+        :param speaker: The speaker ID, or None if the audio did not come from VOICEVOX (the English
+            engine, or the audio file of a custom sticker or emoji).
+        :param text: The normalized text, as it was synthesized (and keyed in the audio cache), or the
+            filename of the audio file.
+        :param cache_hit: Whether the audio came from a cache.
+        :param synthesis_seconds: How long the synthesis took, on a cache miss.
+        """
+        if self.database is None:
+            return
+        synthesis_ms = synthesis_seconds * 1000 if synthesis_seconds is not None else None
+        self._buffer.append((guild_id, author_id, speaker, text, cache_hit, synthesis_ms))
+        if len(self._buffer) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        """
+        Inserts every buffered row. Failed rows are retried on the next flush.
+        """
+        if not self._buffer:
+            return
+        rows, self._buffer = self._buffer, []
+        try:
+            await self.database.add_queries(rows)
+        except aiosqlite.Error as e:
+            self.logger.error(f"Failed to record {len(rows)} queries: {e}")
+            self._buffer = (rows + self._buffer)[-self.max_pending:]
+
+    async def close(self) -> None:
+        """
+        Stops the background task and inserts what is left in the buffer.
+        The task is not cancelled: a flush in progress could lose its rows.
+        """
+        if self._task is not None:
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
@@ -0,0 +1,210 @@
+"""
+Copyright © Krypton 2019-2023 - https://github.com/kkrypt0nn (https://krypton.ninja)
+
+Version: 6.1.0
+
+Modified by z4kky - https://github.com/z4kkyy
+"""
+
+import bisect
+import logging
+import threading
+from typing import Callable, Dict, Optional, Sequence
+
+from aiohttp import web
+
+# from 100 µs (text processing) to a minute (a backed up voice queue)
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """
+    A latency histogram with fixed bucket bounds in seconds, as exposed by Prometheus.
+    """
+
+    __slots__ = ("bounds", "counts", "count", "sum")
+
+    def __init__(self, bounds: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, fraction: float) -> Optional[float]:
+        """
+        Estimates a quantile by linear interpolation within its bucket, like histogram_quantile().
+        """
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                if index == len(self.bounds):
+                    return self.bounds[-1]
+                lower = self.bounds[index - 1] if index else 0.0
+                return lower + (self.bounds[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.bounds[-1]
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Metrics:
+    """
+    Latency histograms of every stage of the speech pipeline, overall, per guild and per speaker,
+    plus gauges that are read when the metrics are rendered. Thread-safe, since playback is timed
+    from the voice threads.
+
+    :param buckets: The bucket bounds of the histograms, in seconds.
+    :param export_guilds: Whether the per-guild histograms are exported to Prometheus as well
+        (one series per guild and stage). Only the guilds with a voice session are kept, see
+        forget_guild(); the per-speaker series are bounded by the number of VOICEVOX speakers.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS, export_guilds: bool = False) -> None:
+        self.buckets = tuple(buckets)
+        self.export_guilds = export_guilds
+        self.stages = {}  # stage -> Histogram
+        self.guilds = {}  # (stage, guild id) -> Histogram
+        self.speakers = {}  # (stage, speaker id) -> Histogram
+        self.gauges = {}  # name -> (help, function)
+        self._lock = threading.Lock()
+
+    def _histogram(self, histograms: dict, key) -> Histogram:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(self.buckets)
+        return histogram
+
+    def observe(self, stage: str, seconds: float, guild_id: Optional[int] = None, speaker: Optional[int] = None) -> None:
+        """
+        Records the duration of a stage.
+
+        :param stage: The name of the stage.
+        :param seconds: The duration.
+        :param guild_id: The guild the utterance belongs to, if known.
+        :param speaker: The speaker of the utterance, if known.
+        """
+        with self._lock:
+            self._histogram(self.stages, stage).observe(seconds)
+            if guild_id is not None:
+                self._histogram(self.guilds, (stage, guild_id)).observe(seconds)
+            if speaker is not None:
+                self._histogram(self.speakers, (stage, speaker)).observe(seconds)
+
+    def forget_guild(self, guild_id: int) -> None:
+        """
+        Drops the histograms of a guild, once its voice session has ended.
+        """
+        with self._lock:
+            for key in [key for key in self.guilds if key[1] == guild_id]:
+                del self.guilds[key]
+
+    def gauge(self, name: str, help: str, function: Callable[[], float]) -> None:
+        """
+        Registers a value that is read each time the metrics are rendered.
+        """
+        self.gauges[name] = (help, function)
+
+    def summary(self, guild_id: Optional[int] = None, speaker: Optional[int] = None) -> Dict[str, Dict[str, float]]:
+        """
+        Returns the count, mean and estimated p50/p95/p99 in seconds of every stage, overall or
+        for one guild or one speaker.
+        """
+        with self._lock:
+            if guild_id is not None:
+                histograms = {stage: histogram for (stage, key), histogram in self.guilds.items() if key == guild_id}
+            elif speaker is not None:
+                histograms = {stage: histogram for (stage, key), histogram in self.speakers.items() if key == speaker}
+            else:
+                histograms = dict(self.stages)
+            return {stage: histogram.summary() for stage, histogram in histograms.items()}
+
+    @staticmethod
+    def _render_histogram(lines: list, name: str, labels: str, histogram: Histogram) -> None:
+        cumulative = 0
+        for bound, count in zip(histogram.bounds, histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+        lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+        lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+    def render_prometheus(self) -> str:
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            families = [
+                ("voicevox_stage_seconds", "Duration of each stage of the speech pipeline.",
+                 {stage: f'stage="{stage}"' for stage in self.stages}, self.stages),
+                ("voicevox_speaker_stage_seconds", "Duration of each stage of the speech pipeline per speaker.",
+                 {key: f'stage="{key[0]}",speaker="{key[1]}"' for key in self.speakers}, self.speakers),
+            ]
+            if self.export_guilds:
+                families.append(
+                    ("voicevox_guild_stage_seconds", "Duration of each stage of the speech pipeline per guild.",
+                     {key: f'stage="{key[0]}",guild="{key[1]}"' for key in self.guilds}, self.guilds)
+                )
+            for name, help, labels, histograms in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in histograms.items():
+                    self._render_histogram(lines, name, labels[key], histogram)
+        for name, (help, function) in self.gauges.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {function()}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """
+    Serves the metrics to Prometheus on ``/metrics``, and the health of the process as JSON on
+    ``/health``: ``health`` returns a dict whose "ready" entry selects a 200 or a 503 status.
+    Meant to listen on a local or private address only.
+    """
+
+    def __init__(self, metrics: Metrics, host: str = "127.0.0.1", port: int = 9108,
+                 health: Optional[Callable[[], dict]] = None, logger: Optional[logging.Logger] = None) -> None:
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.health = health
+        self.logger = logger or logging.getLogger(__name__)
+        self._runner = None
+
+    async def _serve_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.metrics.render_prometheus(), content_type="text/plain")
+
+    async def _serve_health(self, request: web.Request) -> web.Response:
+        health = self.health() if self.health is not None else {"ready": True}
+        return web.json_response(health, status=200 if health.get("ready", True) else 503)
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/metrics", self._serve_metrics)
+        app.router.add_get("/health", self._serve_health)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self.logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,128 @@
+"""
+Copyright © Krypton 2019-2023 - https://github.com/kkrypt0nn (https://krypton.ninja)
+
+Version: 6.1.0
+
+Modified by z4kky - https://github.com/z4kkyy
+"""
+
+import contextlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Iterator, Optional
+
+WARMUP_TEXT = "テスト"
+
+
+def resident_memory() -> Optional[int]:
+    """
+    Returns the resident memory of the process in bytes, or None where /proc is unavailable.
+    """
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class ModelManager:
+    """
+    Tracks the speaker models loaded in a VoicevoxCore: preloads and warms them up, records
+    when each was last used, and unloads the least recently used ones when the resident memory
+    goes over ``memory_budget`` bytes (or when more than ``max_models`` are loaded).
+
+    All methods are blocking and thread-safe; call them from the synthesis executor. A model is
+    loaded under a lock of its own speaker, so loading a new speaker never holds up the synthesis
+    with the models that are already loaded.
+    """
+
+    def __init__(
+        self,
+        core,
+        memory_budget: Optional[int] = None,
+        max_models: Optional[int] = None,
+        warmup: bool = True,
+        logger: Optional[logging.Logger] = None,
+    ) -> None:
+        self.core = core
+        self.memory_budget = memory_budget
+        self.max_models = max_models
+        self.warmup = warmup
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._last_used = OrderedDict()  # speaker -> monotonic time, least recently used first
+        self._in_use = {}
+        self._loading = {}  # speaker -> the lock held while its model loads
+        # voicevox_core 0.15 cannot unload models; newer bindings expose unload_model
+        self._can_unload = hasattr(core, "unload_model")
+        if (memory_budget is not None or max_models is not None) and not self._can_unload:
+            self.logger.warning("This voicevox_core cannot unload models, the model memory budget is ignored.")
+
+    def preload(self, speakers: Iterable[int]) -> None:
+        """
+        Loads the models of the speakers and runs a warmup inference on each.
+        """
+        for speaker in speakers:
+            start = time.perf_counter()
+            with self.use(speaker):
+                if self.warmup:
+                    self.core.tts(WARMUP_TEXT, speaker)
+            self.logger.info(f"Preloaded the model of speaker {speaker} in {time.perf_counter() - start:.2f}s")
+
+    def ensure_loaded(self, speaker: int) -> None:
+        """
+        Loads the model of the speaker if needed, e.g. right after /change.
+        """
+        with self.use(speaker):
+            pass
+
+    @contextlib.contextmanager
+    def use(self, speaker: int) -> Iterator[None]:
+        """
+        Loads the model of the speaker if needed and keeps it loaded while the block runs.
+        """
+        with self._lock:
+            # in use from now on, so that it cannot be unloaded right after it was loaded
+            self._in_use[speaker] = self._in_use.get(speaker, 0) + 1
+            loading = self._loading.setdefault(speaker, threading.Lock())
+        try:
+            with loading:
+                if not self.core.is_model_loaded(speaker):
+                    self.core.load_model(speaker)
+            with self._lock:
+                self._last_used[speaker] = time.monotonic()
+                self._last_used.move_to_end(speaker)
+            yield
+        finally:
+            with self._lock:
+                self._in_use[speaker] -= 1
+                self._evict()
+
+    def _over_budget(self) -> bool:
+        if self.max_models is not None and len(self._last_used) > self.max_models:
+            return True
+        if self.memory_budget is not None:
+            memory = resident_memory()
+            return memory is not None and memory > self.memory_budget
+        return False
+
+    def _evict(self) -> None:
+        # must be called with the lock held
+        if not self._can_unload:
+            return
+        for speaker in list(self._last_used):
+            if not self._over_budget():
+                return
+            if self._in_use.get(speaker, 0) > 0 or len(self._last_used) == 1:
+                continue
+            self.core.unload_model(speaker)
+            del self._last_used[speaker]
+            self._in_use.pop(speaker, None)
+            self.logger.info(f"Unloaded the model of speaker {speaker} (least recently used)")
+
+    def loaded_speakers(self) -> list:
+        with self._lock:
+            return list(self._last_used)
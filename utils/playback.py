@@ -0,0 +1,234 @@
+"""
+Copyright © Krypton 2019-2023 - https://github.com/kkrypt0nn (https://krypton.ninja)
+
+Version: 6.1.0
+
+Modified by z4kky - https://github.com/z4kkyy
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Hashable, Optional, Tuple
+
+
+class SpeechJob:
+    """
+    A queued utterance. ``render`` is a coroutine function that produces the audio to play;
+    it is only started once the job is within the prefetch window of its queue.
+
+    Jobs that share a ``key`` (e.g. the author and the speaker) and were built from ``texts``
+    with ``build`` can be coalesced into one utterance while they are waiting; their texts
+    are then joined with ``separator``.
+    """
+
+    __slots__ = ("render", "task", "created_at", "rendered_at", "key", "texts", "build", "separator")
+
+    def __init__(
+        self,
+        render: Callable[[], Awaitable[Any]],
+        key: Optional[Hashable] = None,
+        texts: Optional[Tuple[str, ...]] = None,
+        build: Optional[Callable[..., Callable[[], Awaitable[Any]]]] = None,
+        separator: str = "。",
+    ) -> None:
+        self.render = render
+        self.task = None
+        self.created_at = time.monotonic()
+        self.rendered_at = None
+        self.key = key
+        self.texts = texts
+        self.build = build
+        self.separator = separator
+
+    def can_absorb(self, other: "SpeechJob") -> bool:
+        return (
+            self.task is None
+            and self.key is not None
+            and self.key == other.key
+            and self.build is not None
+            and self.texts is not None
+            and other.texts is not None
+        )
+
+    def absorb(self, other: "SpeechJob") -> None:
+        """
+        Appends the texts of a later job to this one and rebuilds the render function.
+        """
+        self.texts = tuple(f"{mine}{self.separator}{theirs}" for mine, theirs in zip(self.texts, other.texts))
+        self.render = self.build(*self.texts)
+
+    def start(self) -> None:
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.render())
+            self.task.add_done_callback(self._rendered)
+
+    def _rendered(self, task: asyncio.Future) -> None:
+        self.rendered_at = time.monotonic()
+
+    async def result(self) -> Any:
+        self.start()
+        return await self.task
+
+
+class PlaybackQueue:
+    """
+    The voice queue of a guild. Jobs are played in order; while one plays, the next
+    ``prefetch`` jobs are already rendering, so consecutive utterances follow each other
+    without waiting for inference.
+
+    To keep up with bursts, at most ``max_depth`` jobs wait (dropping the oldest or the newest
+    one beyond that), jobs older than ``max_age`` seconds are dropped before they are rendered,
+    and consecutive waiting jobs of the same author are coalesced into one utterance.
+    Dropped jobs have their rendering cancelled and their audio freed.
+
+    :param play: Coroutine function that plays rendered audio and returns once playback ended.
+    :param discard: Function that frees rendered audio that will never be played.
+    :param prefetch: How many jobs to render ahead of the one being played.
+    :param on_play: Called with each job right before its audio starts playing, e.g. to measure latencies.
+    :param ready_since: Returns since when (``time.monotonic()``) the jobs can be rendered, or None while
+        they cannot (e.g. while the engine starts). Jobs only start to age from then.
+    """
+
+    def __init__(
+        self,
+        play: Callable[[Any], Awaitable[None]],
+        discard: Callable[[Any], None],
+        prefetch: int = 2,
+        max_depth: Optional[int] = None,
+        overflow: str = "drop_oldest",
+        max_age: Optional[float] = None,
+        coalesce: bool = False,
+        on_play: Optional[Callable[[SpeechJob], None]] = None,
+        ready_since: Optional[Callable[[], Optional[float]]] = None,
+        logger: Optional[logging.Logger] = None,
+    ) -> None:
+        if overflow not in ("drop_oldest", "drop_newest"):
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.play = play
+        self.discard = discard
+        self.prefetch = prefetch
+        self.max_depth = max_depth
+        self.overflow = overflow
+        self.max_age = max_age
+        self.coalesce = coalesce
+        self.on_play = on_play
+        self.ready_since = ready_since
+        self.logger = logger or logging.getLogger(__name__)
+        self.pending = deque()
+        self.playing = False
+        self.dropped = 0
+        self.coalesced = 0
+        self._task = None
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def oldest_age(self) -> float:
+        """
+        Returns how long the oldest waiting job has been queued, in seconds.
+        """
+        if not self.pending:
+            return 0.0
+        return time.monotonic() - self.pending[0].created_at
+
+    def put(self, job: SpeechJob) -> None:
+        self._expire()
+        if self.coalesce and self.pending and self.pending[-1].can_absorb(job):
+            self.pending[-1].absorb(job)
+            self.coalesced += 1
+        elif self.max_depth is not None and len(self.pending) >= self.max_depth:
+            if self.overflow == "drop_newest":
+                self._drop(job)
+            else:
+                self._drop(self.pending.popleft())
+                self.pending.append(job)
+        else:
+            self.pending.append(job)
+        self._start_prefetch()
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    def _drop(self, job: SpeechJob) -> None:
+        self.cancel_job(job)
+        self.dropped += 1
+
+    def _expire(self) -> None:
+        if self.max_age is None:
+            return
+        since = 0.0
+        if self.ready_since is not None:
+            since = self.ready_since()
+            if since is None:
+                return  # the jobs are waiting for the engine, not for the queue
+        deadline = time.monotonic() - self.max_age
+        if since >= deadline:
+            return
+        expired = 0
+        # jobs are queued in order, so the stale ones are at the front
+        while self.pending and self.pending[0].created_at < deadline:
+            self._drop(self.pending.popleft())
+            expired += 1
+        if expired:
+            self.logger.info(f"Dropped {expired} queued messages older than {self.max_age}s")
+
+    def _start_prefetch(self) -> None:
+        for index, job in enumerate(self.pending):
+            if index >= self.prefetch:
+                break
+            job.start()
+
+    async def _run(self) -> None:
+        while True:
+            self._expire()
+            if not self.pending:
+                break
+            job = self.pending.popleft()
+            job.start()
+            # the lookahead starts rendering as soon as the current job leaves the queue
+            self._start_prefetch()
+            try:
+                audio = await job.result()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"Failed to render the audio: {type(e).__name__}: {e}")
+                continue
+            self.playing = True
+            try:
+                if self.on_play is not None:
+                    self.on_play(job)
+                await self.play(audio)
+            except Exception as e:
+                self.logger.error(f"Failed to play the audio: {type(e).__name__}: {e}")
+            finally:
+                self.playing = False
+
+    def cancel_job(self, job: SpeechJob) -> None:
+        """
+        Cancels the rendering of a job and frees its audio if it was already rendered.
+        """
+        if job.task is None:
+            return
+        if not job.task.done():
+            job.task.cancel()
+            # the rendering may still complete if it was about to
+            job.task.add_done_callback(self._discard_result)
+        else:
+            self._discard_result(job.task)
+
+    def _discard_result(self, task: asyncio.Future) -> None:
+        if not task.cancelled() and task.exception() is None:
+            self.discard(task.result())
+
+    def clear(self) -> None:
+        """
+        Drops every pending job and stops the queue.
+        """
+        while self.pending:
+            self.cancel_job(self.pending.popleft())
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.playing = False
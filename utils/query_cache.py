@@ -0,0 +1,102 @@
+"""
+Copyright © Krypton 2019-2023 - https://github.com/kkrypt0nn (https://krypton.ninja)
+
+Version: 6.1.0
+
+Modified by z4kky - https://github.com/z4kkyy
+"""
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from .speech_rate import VoiceParams, apply_speed, apply_voice
+
+
+class AudioQueryCache:
+    """
+    An LRU cache of VOICEVOX AudioQuery objects keyed by (text, speaker).
+
+    The AudioQuery holds the result of the Open JTalk analysis and of the prosody prediction,
+    which do not depend on the speed, pitch or volume of the voice. Callers get a copy that they
+    may modify freely. Thread-safe.
+
+    :param max_entries: How many queries to keep.
+    """
+
+    def __init__(self, max_entries: int = 1024) -> None:
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            query = self.entries.get(key)
+            if query is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return copy.deepcopy(query)
+
+    def put(self, key: Hashable, query: Any) -> None:
+        if self.max_entries <= 0:
+            return
+        query = copy.deepcopy(query)
+        with self._lock:
+            self.entries[key] = query
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self.entries),
+            }
+
+
+def staged_synthesis(
+    core,
+    queries: AudioQueryCache,
+    text: str,
+    speaker: int,
+    voice: VoiceParams = VoiceParams(),
+    speed: float = 1.0,
+    shorten_pauses: bool = False,
+) -> Tuple[bytes, Dict[str, float]]:
+    """
+    Synthesizes the text with a VoicevoxCore in two stages: the AudioQuery (text analysis and
+    prosody, cached in ``queries``) then the waveform. Blocking.
+
+    Returns the WAV bytes and the durations in seconds of the stages that ran.
+
+    :param core: The VoicevoxCore, with the model of the speaker loaded.
+    :param queries: The AudioQuery cache.
+    :param text: The text to synthesize.
+    :param speaker: The speaker ID to use.
+    :param voice: The voice settings of the guild.
+    :param speed: The speed factor from the backlog, on top of the voice speed.
+    :param shorten_pauses: Whether the silences are shortened along with the backlog speed.
+    """
+    stages = {}
+    key = (text, speaker)
+    query = queries.get(key)
+    if query is None:
+        started = time.perf_counter()
+        query = core.audio_query(text, speaker)
+        stages["audio_query"] = time.perf_counter() - started
+        queries.put(key, query)
+    apply_speed(apply_voice(query, voice), speed, shorten_pauses)
+    started = time.perf_counter()
+    wav = core.synthesis(query, speaker)
+    stages["synthesis"] = time.perf_counter() - started
+    return wav, stages
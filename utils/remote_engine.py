@@ -0,0 +1,194 @@
+"""
+Copyright © Krypton 2019-2023 - https://github.com/kkrypt0nn (https://krypton.ninja)
+
+Version: 6.1.0
+
+Modified by z4kky - https://github.com/z4kkyy
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+import aiohttp
+
+from .query_cache import AudioQueryCache
+from .speech_rate import VoiceParams
+
+
+class RemoteEngineUnavailable(Exception):
+    """
+    Raised when no remote VOICEVOX engine could serve a request.
+    """
+
+
+class _Endpoint:
+    __slots__ = ("url", "outstanding", "healthy", "failures")
+
+    def __init__(self, url: str) -> None:
+        self.url = url.rstrip("/")
+        self.outstanding = 0
+        self.healthy = True
+        self.failures = 0
+
+
+def apply_voice_json(query: dict, voice: VoiceParams, speed: float = 1.0, shorten_pauses: bool = False) -> dict:
+    """
+    The JSON counterpart of utils.speech_rate.apply_voice and apply_speed, for the AudioQuery
+    returned by the HTTP API of the VOICEVOX engine.
+    """
+    query["speedScale"] = voice.speed * speed
+    query["pitchScale"] = voice.pitch
+    query["intonationScale"] = voice.intonation
+    query["volumeScale"] = voice.volume
+    if shorten_pauses and speed > 1.0:
+        query["prePhonemeLength"] /= speed
+        query["postPhonemeLength"] /= speed
+        for phrase in query.get("accent_phrases", []):
+            if phrase.get("pause_mora") is not None:
+                phrase["pause_mora"]["vowel_length"] /= speed
+    return query
+
+
+class RemoteEngine:
+    """
+    A client for one or more VOICEVOX engines over HTTP, sharing a keep-alive connection pool.
+
+    Requests go to the healthy engine with the fewest requests in flight. An engine that fails is
+    marked unhealthy and the request is retried on the next one; the health check brings it back
+    once its ``/version`` endpoint answers again. When every engine failed,
+    RemoteEngineUnavailable is raised so that the caller can fall back to the local core.
+
+    :param urls: The base URLs of the engines.
+    :param timeout: Seconds allowed for each HTTP request.
+    :param health_interval: Seconds between two health checks of every engine.
+    :param max_connections: The size of the connection pool.
+    :param query_cache_size: How many AudioQuery results to cache (see AudioQueryCache).
+    """
+
+    def __init__(
+        self,
+        urls: Iterable[str],
+        timeout: float = 10.0,
+        health_interval: float = 30.0,
+        max_connections: int = 16,
+        query_cache_size: int = 1024,
+        logger: Optional[logging.Logger] = None,
+    ) -> None:
+        self.endpoints = [_Endpoint(url) for url in urls]
+        if not self.endpoints:
+            raise ValueError("At least one engine URL is required")
+        self.timeout = timeout
+        self.health_interval = health_interval
+        self.max_connections = max_connections
+        self.queries = AudioQueryCache(query_cache_size)
+        self.logger = logger or logging.getLogger(__name__)
+        self.session = None
+        self._health_task = None
+
+    def start(self) -> None:
+        """
+        Opens the connection pool and starts the health checks. Must run on the event loop.
+        """
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        self._health_task = asyncio.ensure_future(self._check_health())
+
+    async def close(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def healthy(self) -> bool:
+        return any(endpoint.healthy for endpoint in self.endpoints)
+
+    async def _check_health(self) -> None:
+        while True:
+            await asyncio.gather(*(self._probe(endpoint) for endpoint in self.endpoints))
+            await asyncio.sleep(self.health_interval)
+
+    async def _probe(self, endpoint: _Endpoint) -> None:
+        try:
+            async with self.session.get(f"{endpoint.url}/version") as response:
+                healthy = response.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            healthy = False
+        if healthy != endpoint.healthy:
+            self.logger.info(f"VOICEVOX engine {endpoint.url} is {'back up' if healthy else 'down'}")
+        endpoint.healthy = healthy
+        if healthy:
+            endpoint.failures = 0
+
+    def _candidates(self):
+        # least outstanding requests first; unhealthy engines are only tried as a last resort
+        return sorted(self.endpoints, key=lambda endpoint: (not endpoint.healthy, endpoint.outstanding))
+
+    async def synthesize(
+        self,
+        text: str,
+        speaker: int,
+        voice: VoiceParams = VoiceParams(),
+        speed: float = 1.0,
+        shorten_pauses: bool = False,
+    ) -> Tuple[bytes, Dict[str, float]]:
+        """
+        Synthesizes the text on a remote engine in two stages, like utils.query_cache.staged_synthesis.
+        Returns the WAV bytes and the durations of the stages that ran.
+
+        :raises RemoteEngineUnavailable: If no engine could synthesize the text.
+        """
+        errors = []
+        for endpoint in self._candidates():
+            endpoint.outstanding += 1
+            try:
+                return await self._synthesize_on(endpoint, text, speaker, voice, speed, shorten_pauses)
+            except aiohttp.ClientResponseError as e:
+                if e.status < 500:
+                    raise  # the request itself is wrong, another engine would refuse it too
+                errors.append(f"{endpoint.url}: HTTP {e.status}")
+                self._mark_failed(endpoint, e)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                errors.append(f"{endpoint.url}: {type(e).__name__}")
+                self._mark_failed(endpoint, e)
+            finally:
+                endpoint.outstanding -= 1
+        raise RemoteEngineUnavailable(", ".join(errors))
+
+    def _mark_failed(self, endpoint: _Endpoint, error: Exception) -> None:
+        endpoint.failures += 1
+        if endpoint.healthy:
+            self.logger.warning(f"VOICEVOX engine {endpoint.url} failed: {type(error).__name__}: {error}")
+        endpoint.healthy = False
+
+    async def _synthesize_on(
+        self, endpoint: _Endpoint, text: str, speaker: int, voice: VoiceParams, speed: float, shorten_pauses: bool
+    ) -> Tuple[bytes, Dict[str, float]]:
+        stages = {}
+        key = (text, speaker)
+        query = self.queries.get(key)
+        if query is None:
+            started = time.perf_counter()
+            async with self.session.post(
+                f"{endpoint.url}/audio_query", params={"text": text, "speaker": speaker}
+            ) as response:
+                response.raise_for_status()
+                query = await response.json()
+            stages["audio_query"] = time.perf_counter() - started
+            self.queries.put(key, query)
+        apply_voice_json(query, voice, speed, shorten_pauses)
+        started = time.perf_counter()
+        async with self.session.post(f"{endpoint.url}/synthesis", params={"speaker": speaker}, json=query) as response:
+            response.raise_for_status()
+            wav = await response.read()
+        stages["synthesis"] = time.perf_counter() - started
+        return wav, stages
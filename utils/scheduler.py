@@ -0,0 +1,142 @@
+"""
+Copyright © Krypton 2019-2023 - https://github.com/kkrypt0nn (https://krypton.ninja)
+
+Version: 6.1.0
+
+Modified by z4kky - https://github.com/z4kkyy
+"""
+
+import asyncio
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+
+class _Request:
+    __slots__ = ("key", "cost", "func", "future", "task")
+
+    def __init__(self, key: Hashable, cost: int, func: Callable[[], Awaitable[Any]], future: asyncio.Future) -> None:
+        self.key = key
+        self.cost = cost
+        self.func = func
+        self.future = future
+        self.task = None
+
+
+class FairScheduler:
+    """
+    Shares the synthesis engine between guilds with deficit round-robin.
+
+    Each guild has its own queue. When it is a guild's turn it is credited ``quantum`` units
+    (characters) and may start requests as long as their estimated cost fits in its credit, so a
+    guild pasting a wall of text cannot starve the others. At most ``concurrency`` requests run
+    at once, and at most ``max_in_flight`` per guild.
+    """
+
+    def __init__(self, concurrency: int = 2, quantum: int = 100, max_in_flight: int = 1) -> None:
+        self.concurrency = concurrency
+        self.quantum = quantum
+        self.max_in_flight = max_in_flight
+        self._queues = OrderedDict()  # key -> deque of requests, in round-robin order
+        self._deficit = {}
+        self._in_flight = {}
+        self._running = 0
+        self._current = None  # the key whose turn it is
+
+    def pending(self, key: Optional[Hashable] = None) -> int:
+        """
+        Returns the number of queued requests, of one guild or of all of them.
+        """
+        if key is not None:
+            return len(self._queues.get(key, ()))
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def run(self, key: Hashable, cost: int, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Waits for the turn of the guild, then runs the coroutine function and returns its result.
+
+        :param key: The guild the request belongs to.
+        :param cost: The estimated cost of the request, e.g. its number of characters.
+        :param func: The coroutine function doing the work.
+        """
+        request = _Request(key, max(cost, 1), func, asyncio.get_running_loop().create_future())
+        self._queues.setdefault(key, deque()).append(request)
+        self._deficit.setdefault(key, 0)
+        self._dispatch()
+        try:
+            return await asyncio.shield(request.future)
+        except asyncio.CancelledError:
+            if request.task is not None:
+                request.task.cancel()
+            else:
+                self._withdraw(request)
+            raise
+
+    def _withdraw(self, request: _Request) -> None:
+        queue = self._queues.get(request.key)
+        if queue is None:
+            return
+        try:
+            queue.remove(request)
+        except ValueError:
+            return
+        if not queue:
+            self._drop_key(request.key)
+
+    def _drop_key(self, key: Hashable) -> None:
+        del self._queues[key]
+        self._deficit.pop(key, None)  # an idle guild does not keep its credit
+        if self._current == key:
+            self._current = None
+
+    def _dispatch(self) -> None:
+        while self._running < self.concurrency:
+            request = self._next()
+            if request is None:
+                return
+            self._start(request)
+
+    def _next(self) -> Optional[_Request]:
+        if not any(self._in_flight.get(key, 0) < self.max_in_flight for key in self._queues):
+            return None
+        while True:
+            key, queue = next(iter(self._queues.items()))
+            if self._in_flight.get(key, 0) >= self.max_in_flight:
+                self._end_turn(key)
+                continue
+            if self._current != key:
+                self._current = key
+                self._deficit[key] += self.quantum
+            request = queue[0]
+            if request.cost > self._deficit[key]:
+                self._end_turn(key)
+                continue
+            self._deficit[key] -= request.cost
+            queue.popleft()
+            if not queue:
+                self._drop_key(key)
+            return request
+
+    def _end_turn(self, key: Hashable) -> None:
+        self._queues.move_to_end(key)
+        if self._current == key:
+            self._current = None
+
+    def _start(self, request: _Request) -> None:
+        self._running += 1
+        self._in_flight[request.key] = self._in_flight.get(request.key, 0) + 1
+        request.task = asyncio.ensure_future(request.func())
+        request.task.add_done_callback(lambda task: self._finish(request, task))
+
+    def _finish(self, request: _Request, task: asyncio.Task) -> None:
+        self._running -= 1
+        self._in_flight[request.key] -= 1
+        if not self._in_flight[request.key]:
+            del self._in_flight[request.key]
+        if not request.future.done():
+            if task.cancelled():
+                request.future.cancel()
+            elif task.exception() is not None:
+                request.future.set_exception(task.exception())
+            else:
+                request.future.set_result(task.result())
+        self._dispatch()
@@ -0,0 +1,90 @@
+"""
+Copyright © Krypton 2019-2023 - https://github.com/kkrypt0nn (https://krypton.ninja)
+
+Version: 6.1.0
+
+Modified by z4kky - https://github.com/z4kkyy
+"""
+
+import time
+from typing import Dict, Iterator, List, Optional
+
+from .playback import PlaybackQueue
+
+
+class GuildSession:
+    """
+    The state of the bot in a guild while it is connected to a voice channel.
+    """
+
+    __slots__ = (
+        "guild_id",
+        "voice_client",
+        "text_channel",
+        "user_channel",
+        "audio_queue",
+        "expected_disconnection",
+        "last_active",
+        "playing_since",
+    )
+
+    def __init__(self, guild_id: int, voice_client, text_channel, user_channel, audio_queue: PlaybackQueue) -> None:
+        self.guild_id = guild_id
+        self.voice_client = voice_client
+        self.text_channel = text_channel
+        self.user_channel = user_channel
+        self.audio_queue = audio_queue
+        self.expected_disconnection = False  # for unexpected disconnection
+        self.last_active = time.monotonic()
+        self.playing_since = None  # when the message being read out was received
+
+    def touch(self) -> None:
+        self.last_active = time.monotonic()
+
+    def is_idle(self, timeout: float) -> bool:
+        return (
+            not self.audio_queue.playing
+            and len(self.audio_queue) == 0
+            and time.monotonic() - self.last_active > timeout
+        )
+
+
+class SessionRegistry:
+    """
+    The guild sessions, keyed by guild ID. Lookups never create a session: sessions are only
+    created on /join and removed on /leave, /hardreset or when idle, so memory is bounded by the
+    number of active voice sessions.
+    """
+
+    def __init__(self) -> None:
+        self._sessions: Dict[int, GuildSession] = {}
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __iter__(self) -> Iterator[GuildSession]:
+        return iter(list(self._sessions.values()))
+
+    def get(self, guild_id: int) -> Optional[GuildSession]:
+        return self._sessions.get(guild_id)
+
+    def add(self, session: GuildSession) -> None:
+        """
+        Registers a session, replacing (and stopping) the previous one of the guild.
+        """
+        previous = self._sessions.get(session.guild_id)
+        if previous is not None and previous is not session:
+            previous.audio_queue.clear()
+        self._sessions[session.guild_id] = session
+
+    def remove(self, guild_id: int) -> Optional[GuildSession]:
+        """
+        Removes the session of the guild and drops its queued audio.
+        """
+        session = self._sessions.pop(guild_id, None)
+        if session is not None:
+            session.audio_queue.clear()
+        return session
+
+    def idle(self, timeout: float) -> List[GuildSession]:
+        return [session for session in self._sessions.values() if session.is_idle(timeout)]
@@ -0,0 +1,106 @@
+"""
+Copyright © Krypton 2019-2023 - https://github.com/kkrypt0nn (https://krypton.ninja)
+
+Version: 6.1.0
+
+Modified by z4kky - https://github.com/z4kkyy
+"""
+
+import json
+import logging
+import os
+from typing import Dict, NamedTuple, Optional
+
+
+class CustomSettings(NamedTuple):
+    """
+    An immutable snapshot of custom_setting.json, indexed by integer ID.
+    """
+
+    custom_emoji: Dict[int, dict]
+    custom_sticker: Dict[int, dict]
+    custom_speaker: Dict[int, dict]
+
+
+EMPTY_SETTINGS = CustomSettings({}, {}, {})
+
+
+def parse_custom_settings(raw: dict) -> CustomSettings:
+    """
+    Validates the content of custom_setting.json and builds the lookup indexes.
+
+    :param raw: The parsed JSON document.
+    :raises ValueError: If the document is malformed.
+    """
+    if not isinstance(raw, dict):
+        raise ValueError("the top level must be an object")
+    indexes = []
+    for section in CustomSettings._fields:
+        entries = raw.get(section, {})
+        if not isinstance(entries, dict):
+            raise ValueError(f"'{section}' must be an object")
+        index = {}
+        for key, value in entries.items():
+            try:
+                entry_id = int(key)
+            except ValueError:
+                raise ValueError(f"'{section}' has a non-numeric ID: {key!r}") from None
+            if not isinstance(value, dict):
+                raise ValueError(f"'{section}.{key}' must be an object")
+            if section == "custom_speaker":
+                if not isinstance(value.get("speaker_id"), int):
+                    raise ValueError(f"'{section}.{key}.speaker_id' must be an integer")
+            elif value.get("filename") is None:
+                if not isinstance(value.get("content"), str):
+                    raise ValueError(f"'{section}.{key}' needs a 'filename' or a 'content'")
+            elif not isinstance(value["filename"], str):
+                raise ValueError(f"'{section}.{key}.filename' must be a string")
+            index[entry_id] = value
+        indexes.append(index)
+    return CustomSettings(*indexes)
+
+
+class CustomSettingStore:
+    """
+    Loads custom_setting.json once and reloads it when the file changes.
+
+    ``current`` is swapped as a whole, so readers always see a consistent snapshot.
+    A bad edit is logged and the previous snapshot is kept.
+    """
+
+    def __init__(self, path: str, logger: Optional[logging.Logger] = None) -> None:
+        self.path = path
+        self.logger = logger or logging.getLogger(__name__)
+        self.current = EMPTY_SETTINGS
+        self._mtime = None
+        self.reload_if_changed()
+
+    def reload_if_changed(self) -> bool:
+        """
+        Reloads the file if its modification time changed. Blocking.
+
+        :return: Whether a new snapshot was installed.
+        """
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            if self._mtime != -1:
+                self.logger.warning(f"{self.path} not found, custom settings are disabled.")
+                self.current = EMPTY_SETTINGS
+                self._mtime = -1
+            return False
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        try:
+            with open(self.path, "r") as file:
+                settings = parse_custom_settings(json.load(file))
+        except (OSError, ValueError) as e:  # json.JSONDecodeError is a ValueError
+            self.logger.error(f"Ignoring bad edit of {self.path}, keeping the previous settings: {e}")
+            return False
+        self.current = settings
+        self.logger.info(
+            f"Loaded custom settings: {len(settings.custom_emoji)} emojis, "
+            f"{len(settings.custom_sticker)} stickers, {len(settings.custom_speaker)} speakers"
+        )
+        return True
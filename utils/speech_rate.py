@@ -0,0 +1,108 @@
+"""
+Copyright © Krypton 2019-2023 - https://github.com/kkrypt0nn (https://krypton.ninja)
+
+Version: 6.1.0
+
+Modified by z4kky - https://github.com/z4kkyy
+"""
+
+from typing import NamedTuple
+
+
+class VoiceParams(NamedTuple):
+    """
+    The voice settings of a guild, applied to the AudioQuery of every utterance.
+    """
+
+    speed: float = 1.0
+    pitch: float = 0.0
+    intonation: float = 1.0
+    volume: float = 1.0
+
+
+class AdaptiveSpeechRate:
+    """
+    Maps the backlog of a voice queue to a VOICEVOX ``speedScale``, so bursts are read out faster.
+
+    The speed grows linearly from ``min_speed`` to ``max_speed`` as the queue depth goes from
+    ``depth_start`` to ``depth_full`` jobs, or as its oldest job ages from ``age_start`` to
+    ``age_full`` seconds, whichever is further. It is rounded down to multiples of ``step``
+    so that the audio cache still hits while the backlog fluctuates.
+    """
+
+    def __init__(
+        self,
+        min_speed: float = 1.0,
+        max_speed: float = 1.5,
+        depth_start: int = 2,
+        depth_full: int = 8,
+        age_start: float = 5.0,
+        age_full: float = 30.0,
+        step: float = 0.1,
+    ) -> None:
+        if max_speed < min_speed:
+            raise ValueError("max_speed must not be lower than min_speed")
+        self.min_speed = min_speed
+        self.max_speed = max_speed
+        self.depth_start = depth_start
+        self.depth_full = depth_full
+        self.age_start = age_start
+        self.age_full = age_full
+        self.step = step
+
+    @staticmethod
+    def _ratio(value: float, start: float, full: float) -> float:
+        if value <= start:
+            return 0.0
+        if value >= full:
+            return 1.0
+        return (value - start) / (full - start)
+
+    def speed(self, depth: int, age: float) -> float:
+        """
+        Returns the speed scale for a queue.
+
+        :param depth: The number of jobs waiting in the queue.
+        :param age: The age of the oldest waiting job in seconds.
+        """
+        pressure = max(
+            self._ratio(depth, self.depth_start, self.depth_full),
+            self._ratio(age, self.age_start, self.age_full),
+        )
+        speed = self.min_speed + (self.max_speed - self.min_speed) * pressure
+        if self.step:
+            speed = self.min_speed + int((speed - self.min_speed) / self.step + 1e-9) * self.step
+        return round(speed, 2)
+
+
+def apply_voice(query, voice: VoiceParams):
+    """
+    Sets the speed, pitch, intonation and volume of a VOICEVOX AudioQuery in place and returns it.
+
+    :param query: The AudioQuery returned by ``VoicevoxCore.audio_query``.
+    :param voice: The voice settings to apply.
+    """
+    query.speed_scale = voice.speed
+    query.pitch_scale = voice.pitch
+    query.intonation_scale = voice.intonation
+    query.volume_scale = voice.volume
+    return query
+
+
+def apply_speed(query, speed: float, shorten_pauses: bool = False):
+    """
+    Multiplies the speed of a VOICEVOX AudioQuery in place and returns it.
+
+    :param query: The AudioQuery returned by ``VoicevoxCore.audio_query``.
+    :param speed: The speed factor, 1.0 leaving the speed unchanged.
+    :param shorten_pauses: Whether the silences (before, after and between phrases) are shortened
+        by the same factor on top of the speed scale.
+    """
+    query.speed_scale *= speed
+    if shorten_pauses and speed > 1.0:
+        query.pre_phoneme_length /= speed
+        query.post_phoneme_length /= speed
+        for phrase in query.accent_phrases:
+            if phrase.pause_mora is not None:
+                phrase.pause_mora.vowel_length /= speed
+    return query
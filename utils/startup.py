@@ -0,0 +1,56 @@
+"""
+Copyright © Krypton 2019-2023 - https://github.com/kkrypt0nn (https://krypton.ninja)
+
+Version: 6.1.0
+
+Modified by z4kky - https://github.com/z4kkyy
+"""
+
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+
+def process_age() -> float:
+    """
+    Returns the seconds since the process was started, or 0.0 where /proc is unavailable.
+    """
+    try:
+        with open("/proc/self/stat") as file:
+            # the fields after the command name, which may contain spaces; starttime is the 22nd field
+            fields = file.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as file:
+            uptime = float(file.read().split()[0])
+        return max(0.0, uptime - int(fields[19]) / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+class StartupTimer:
+    """
+    Logs how long after the process start each startup phase was reached ("cogs loaded",
+    "gateway ready", "engine ready", "first utterance", ...). Every phase is recorded once, so
+    reconnections do not overwrite it.
+    """
+
+    def __init__(self, logger: Optional[logging.Logger] = None) -> None:
+        self.logger = logger or logging.getLogger(__name__)
+        self.started = time.monotonic() - process_age()
+        self.phases = {}  # phase -> seconds since the process start
+
+    def mark(self, phase: str) -> Optional[float]:
+        """
+        Records that a phase was reached and logs it. Returns the seconds since the process start,
+        or None if the phase was already recorded.
+
+        :param phase: The name of the phase.
+        """
+        if phase in self.phases:
+            return None
+        elapsed = self.phases[phase] = time.monotonic() - self.started
+        self.logger.info(f"Startup: {phase} after {elapsed:.2f}s")
+        return elapsed
+
+    def summary(self) -> Dict[str, float]:
+        return {phase: round(elapsed, 3) for phase, elapsed in self.phases.items()}
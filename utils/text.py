@@ -0,0 +1,118 @@
+"""
+Copyright © Krypton 2019-2023 - https://github.com/kkrypt0nn (https://krypton.ninja)
+
+Version: 6.1.0
+
+Modified by z4kky - https://github.com/z4kkyy
+"""
+
+import re
+import unicodedata
+from typing import List
+
+MENTION_PATTERN = re.compile(r"<@\d+>")
+WHITESPACE_PATTERN = re.compile(r"\s+")  # also matches "\u3000" and "\n"
+CUSTOM_EMOJI_PATTERN = re.compile(r"<a?:.+?:\d+>")
+LAUGH_PATTERN = re.compile(r"笑+$")
+JAPANESE_FREE_PATTERN = re.compile(r"^[^\u4E00-\u9FFF\u3040-\u309F\u30A0-\u30FF]+$")
+W_ONLY_PATTERN = re.compile(r"[wWｗ]+")
+HALFWIDTH_KANA_ONLY_PATTERN = re.compile(r"[\uFF61-\uFF9F]+")
+
+EMOJI_CATEGORIES = frozenset(("So", "Sk", "Sm", "Cn"))
+
+
+class _EmojiDeletionTable(dict):
+    """
+    A ``str.translate`` table that deletes emojis and symbols.
+
+    Listing every such code point up front would take close to a million entries, so the
+    category of a code point is computed the first time it is seen and memoized.
+    """
+
+    def __missing__(self, codepoint: int):
+        value = None if unicodedata.category(chr(codepoint)) in EMOJI_CATEGORIES else codepoint
+        self[codepoint] = value
+        return value
+
+
+EMOJI_DELETION_TABLE = _EmojiDeletionTable()
+
+
+def remove_mentions(text: str) -> str:
+    """
+    Removes user mentions from a message.
+    """
+    return MENTION_PATTERN.sub("", text)
+
+
+def clean_text(text: str) -> str:
+    """
+    Collapses the whitespace of a message and removes its custom and unicode emojis.
+
+    :param text: The message content, without user mentions.
+    """
+    text = WHITESPACE_PATTERN.sub(" ", text)
+    text = CUSTOM_EMOJI_PATTERN.sub("", text)
+    return text.translate(EMOJI_DELETION_TABLE)
+
+
+def to_reading(text: str) -> str:
+    """
+    Turns cleaned text into the text read out by VOICEVOX.
+
+    :param text: The text returned by clean_text.
+    """
+    # escape what VOICEVOX cannot read, e.g. control characters
+    text = repr(text)[1:-1]
+    # "w" is read as "わら", and so is a run of "笑" at the end.
+    # three str.replace calls beat a translate table here (see benchmarks/)
+    text = text.replace("w", "わら").replace("ｗ", "わら").replace("W", "わら")
+    if not text.endswith("笑"):  # the pattern would otherwise be tried at every position
+        return text
+    return LAUGH_PATTERN.sub(lambda m: "わら" * len(m.group()), text)
+
+
+def is_english(text: str) -> bool:
+    """
+    Returns whether a message should be read out in English.
+
+    :param text: The text returned by clean_text.
+    """
+    return (JAPANESE_FREE_PATTERN.match(text) is not None
+            and W_ONLY_PATTERN.fullmatch(text) is None
+            and HALFWIDTH_KANA_ONLY_PATTERN.fullmatch(text) is None)
+
+
+# sentence and phrase boundaries; the delimiter stays with the text before it
+BOUNDARY_PATTERN = re.compile(r"(?<=[。！？!?、\n])")
+STRONG_BOUNDARIES = "。！？!?\n"
+
+
+def split_sentences(text: str, chunk_length: int = 30) -> List[str]:
+    """
+    Splits a message at sentence and phrase boundaries, so that long messages can be
+    synthesized chunk by chunk.
+
+    The first chunk ends at the first boundary, so that it renders as fast as possible.
+    The following chunks are merged until they are at least ``chunk_length`` characters long,
+    preferably ending on a sentence boundary rather than on a comma.
+
+    :param text: The text to split. Line breaks must not have been collapsed yet.
+    :param chunk_length: The minimal length of the chunks after the first one.
+    """
+    chunks = []
+    current = ""
+    for piece in BOUNDARY_PATTERN.split(text):
+        current += piece
+        if not current.strip():
+            continue
+        if not chunks or (len(current) >= chunk_length and current[-1] in STRONG_BOUNDARIES):
+            chunks.append(current)
+            current = ""
+        elif len(current) >= chunk_length * 2:
+            # no sentence boundary in sight, a comma will do
+            chunks.append(current)
+            current = ""
+    if current.strip():
+        chunks.append(current)
+    return chunks
@@ -0,0 +1,220 @@
+"""
+Copyright © Krypton 2019-2023 - https://github.com/kkrypt0nn (https://krypton.ninja)
+
+Version: 6.1.0
+
+Modified by z4kky - https://github.com/z4kkyy
+"""
+
+import asyncio
+import ctypes
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .models import WARMUP_TEXT
+from .query_cache import AudioQueryCache, staged_synthesis
+from .speech_rate import VoiceParams
+
+# the VoicevoxCore of the current worker process, and its AudioQuery cache
+_core = None
+_queries = None
+
+
+def _init_worker(jtalk_dict_dir: str, lib_path: str, speakers: List[int], query_cache_size: int) -> None:
+    """
+    Builds the VoicevoxCore of a worker process, then loads and warms up its initial models.
+    """
+    global _core, _queries
+    _queries = AudioQueryCache(query_cache_size)
+    os.environ["LD_LIBRARY_PATH"] = f"{lib_path}:{os.environ.get('LD_LIBRARY_PATH', '')}"
+    os.environ["ONNXRUNTIME_PROVIDERS_PATH"] = lib_path
+    try:
+        ctypes.CDLL(f"{lib_path}/libonnxruntime.so.1.13.1")
+    except OSError:
+        pass
+
+    from voicevox_core import VoicevoxCore
+
+    _core = VoicevoxCore(open_jtalk_dict_dir=jtalk_dict_dir)
+    for speaker in speakers:
+        _core.load_model(speaker)
+        _core.tts(WARMUP_TEXT, speaker)  # the first inference of a model is much slower than the next ones
+
+
+def _worker_ready() -> None:
+    pass
+
+
+def _worker_tts(text: str, speaker: int) -> bytes:
+    if not _core.is_model_loaded(speaker):
+        _core.load_model(speaker)
+    return _core.tts(text, speaker)
+
+
+def _worker_synthesize(
+    text: str, speaker: int, voice: VoiceParams, speed: float, shorten_pauses: bool
+) -> Tuple[bytes, Dict[str, float]]:
+    if not _core.is_model_loaded(speaker):
+        _core.load_model(speaker)
+    return staged_synthesis(_core, _queries, text, speaker, voice, speed, shorten_pauses)
+
+
+class _Worker:
+    __slots__ = ("executor", "speakers", "outstanding")
+
+    def __init__(self, executor: ProcessPoolExecutor, speakers: Iterable[int]) -> None:
+        self.executor = executor
+        self.speakers = set(speakers)
+        self.outstanding = 0
+
+
+class SynthesisWorkerPool:
+    """
+    A pool of processes that each own a VoicevoxCore, so synthesis scales with the number of cores.
+
+    Jobs are routed to a worker that already holds the model of the requested speaker. A speaker is
+    only spread to another worker when all of its holders are busier than the least loaded worker
+    by more than ``max_imbalance`` jobs.
+
+    A worker whose process died is restarted with its initial models, and the job it was running
+    is retried once on another worker.
+    """
+
+    def __init__(
+        self,
+        jtalk_dict_dir: str,
+        lib_path: str,
+        processes: Optional[int] = None,
+        speakers: Iterable[int] = (3,),
+        timeout: Optional[float] = 30.0,
+        max_imbalance: int = 2,
+        query_cache_size: int = 1024,
+        logger: Optional[logging.Logger] = None,
+    ) -> None:
+        self.timeout = timeout
+        self.max_imbalance = max_imbalance
+        self.logger = logger or logging.getLogger(__name__)
+        self.speakers = list(speakers)
+        self._initargs = (str(jtalk_dict_dir), str(lib_path), self.speakers, query_cache_size)
+        self.workers = [_Worker(self._executor(), self.speakers) for _ in range(processes or os.cpu_count() or 1)]
+        self.restarts = 0
+
+    def _executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=1,
+            # spawn instead of fork: the bot process runs threads and an event loop that must not be duplicated
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=self._initargs,
+        )
+
+    async def start(self) -> None:
+        """
+        Starts every worker process and waits until its initial models are warmed up.
+        Without it, each process only starts with its first job.
+        """
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(
+            asyncio.wrap_future(worker.executor.submit(_worker_ready), loop=loop) for worker in self.workers
+        ))
+
+    def _pick_worker(self, speaker: int, exclude: Optional[_Worker] = None) -> _Worker:
+        workers = [worker for worker in self.workers if worker is not exclude] or self.workers
+        least_loaded = min(workers, key=lambda worker: worker.outstanding)
+        holders = [worker for worker in workers if speaker in worker.speakers]
+        if holders:
+            holder = min(holders, key=lambda worker: worker.outstanding)
+            if holder.outstanding - least_loaded.outstanding <= self.max_imbalance:
+                return holder
+        least_loaded.speakers.add(speaker)
+        return least_loaded
+
+    async def tts(self, text: str, speaker: int, timeout: Optional[float] = None) -> bytes:
+        """
+        Synthesizes the text on a worker process with ``VoicevoxCore.tts`` and returns the WAV bytes.
+
+        :param text: The text to synthesize.
+        :param speaker: The speaker ID to use.
+        :param timeout: Seconds to wait for the result. Defaults to the pool timeout.
+        :raises asyncio.TimeoutError: If the job did not finish in time.
+        """
+        return await self._submit(speaker, timeout, _worker_tts, text, speaker)
+
+    async def synthesize(
+        self,
+        text: str,
+        speaker: int,
+        voice: VoiceParams = VoiceParams(),
+        speed: float = 1.0,
+        shorten_pauses: bool = False,
+        timeout: Optional[float] = None,
+    ) -> Tuple[bytes, Dict[str, float]]:
+        """
+        Synthesizes the text on a worker process in two stages (see utils.query_cache.staged_synthesis).
+        Every worker keeps its own AudioQuery cache.
+
+        Returns the WAV bytes and the durations of the stages that ran.
+
+        :param text: The text to synthesize.
+        :param speaker: The speaker ID to use.
+        :param voice: The voice settings of the guild.
+        :param speed: The speed factor from the backlog.
+        :param shorten_pauses: Whether the silences are shortened along with the backlog speed.
+        :param timeout: Seconds to wait for the result. Defaults to the pool timeout.
+        :raises asyncio.TimeoutError: If the job did not finish in time.
+        """
+        return await self._submit(speaker, timeout, _worker_synthesize, text, speaker, voice, speed, shorten_pauses)
+
+    async def _submit(self, speaker: int, timeout: Optional[float], func, *args):
+        loop = asyncio.get_running_loop()
+        timeout = self.timeout if timeout is None else timeout
+        failed = None
+        while True:
+            worker = self._pick_worker(speaker, exclude=failed)
+            executor = worker.executor
+            try:
+                future = executor.submit(func, *args)
+            except BrokenProcessPool:
+                # the process died since its last job
+                self._restart(worker, executor)
+                continue
+            worker.outstanding += 1
+            # the worker stays busy until the process is done, even if the caller stopped waiting
+            future.add_done_callback(lambda _, worker=worker: self._release(loop, worker))
+            try:
+                return await asyncio.wait_for(asyncio.wrap_future(future, loop=loop), timeout)
+            except BrokenProcessPool:
+                # the process died while running the job
+                self._restart(worker, executor)
+                if failed is not None:
+                    raise
+                failed = worker
+
+    def _restart(self, worker: _Worker, executor: ProcessPoolExecutor) -> None:
+        if worker.executor is not executor:
+            return  # another job already restarted it
+        self.restarts += 1
+        self.logger.warning(f"A synthesis worker died, restarting it (restarts: {self.restarts})")
+        executor.shutdown(wait=False, cancel_futures=True)
+        worker.executor = self._executor()
+        worker.speakers = set(self.speakers)
+        # starts the new process right away, so that it is warmed up before its next job
+        worker.executor.submit(_worker_ready)
+
+    @staticmethod
+    def _release(loop: asyncio.AbstractEventLoop, worker: _Worker) -> None:
+        def release() -> None:
+            worker.outstanding -= 1
+
+        try:
+            loop.call_soon_threadsafe(release)
+        except RuntimeError:  # the loop is already closed
+            pass
+
+    def shutdown(self) -> None:
+        for worker in self.workers:
+            worker.executor.shutdown(wait=False, cancel_futures=True)